@@ -0,0 +1,113 @@
+from models import Store, StoreRiskSummary
+from core.events import bus
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from core.logger import logger
+import threading
+
+# ==========================================
+# 🔔 ANLIK RİSK VE STOK ALARMLARI
+# ==========================================
+# [OPTIMIZASYON] Dashboard'lar /stores ve insights'ı periyodik sorgulamak yerine
+# /api/events/stream'e abone olur. Envanter yazan her kod yolu commit sonrası
+# publish_inventory_change çağırır; sadece etkilenen mağazaların risk özeti
+# (store_risk_summary, yazma transaction'ında zaten yenilendi) okunur.
+# Abone yoksa hiçbir okuma yapılmaz.
+
+LOW_STOCK_THRESHOLD = 3 # Dashboard insights'taki kritik stok eşiğiyle aynı
+MAX_CHANGES_IN_EVENT = 200 # Toplu yazmalarda olay gövdesi küçük kalsın
+
+# Durum -> Alarm seviyesi
+ALERT_LEVELS = {
+    "HIGH_RISK": "critical",
+    "OVERSTOCK": "warning",
+    "LOW_RISK": "info"
+}
+
+_last_status = {} # store_id -> son bilinen risk durumu
+_status_lock = threading.Lock()
+
+def publish_inventory_change(db: Session, changes: Optional[List[Tuple[int, int, int]]] = None,
+                             store_ids: Optional[Iterable[int]] = None, source: str = "transfer"):
+    """
+    Envanter değişikliğini yayınlar. Commit SONRASI çağrılmalı.
+
+    changes:   [(store_id, product_id, yeni_miktar), ...] (Satır bazlı delta)
+    store_ids: Etkilenen mağazalar. changes ve store_ids ikisi de None ise tüm ağ.
+    """
+    if changes is not None and store_ids is None:
+        store_ids = {change[0] for change in changes}
+    affected = None if store_ids is None else sorted(set(store_ids))
+
+    if bus.subscriber_count == 0:
+        # Dinleyen yok: Okuma yapma. Etkilenen mağazaların bilinen durumu artık
+        # güvenilmez; bir sonraki değerlendirmede yanlış alarm üretmesin.
+        with _status_lock:
+            if affected is None:
+                _last_status.clear()
+            else:
+                for store_id in affected:
+                    _last_status.pop(store_id, None)
+        return
+
+    try:
+        _publish(db, changes, affected, source)
+    except Exception as e:
+        # Alarm yayını yazma işlemini asla bozmamalı (Commit zaten yapıldı)
+        logger.error(f"Alert Publish Error: {e}")
+
+def _publish(db: Session, changes, affected, source: str):
+    inventory_event = {
+        "source": source,
+        "stores": affected, # None -> Tüm ağ
+        "products": sorted({change[1] for change in changes}) if changes else None
+    }
+    if changes and len(changes) <= MAX_CHANGES_IN_EVENT:
+        inventory_event["changes"] = [
+            {"store_id": s, "product_id": p, "quantity": q} for s, p, q in changes
+        ]
+    bus.publish("inventory", inventory_event)
+
+    # Risk değerlendirici: Sadece etkilenen mağazaların özet satırı
+    query = db.query(
+        StoreRiskSummary.store_id, Store.name, StoreRiskSummary.status, StoreRiskSummary.total_stock,
+        StoreRiskSummary.total_safety, StoreRiskSummary.high_risk_count, StoreRiskSummary.overstock_count
+    ).join(Store, Store.id == StoreRiskSummary.store_id)
+    if affected is not None:
+        query = query.filter(StoreRiskSummary.store_id.in_(affected))
+
+    for store_id, name, status, stock, safety, high_risk, overstock in query.all():
+        bus.publish("store_risk", {
+            "store_id": store_id,
+            "name": name,
+            "status": status,
+            "stock": stock,
+            "safety_stock": safety,
+            "high_risk_count": high_risk,
+            "overstock_count": overstock
+        })
+
+        with _status_lock:
+            previous = _last_status.get(store_id)
+            _last_status[store_id] = status
+        if previous is not None and previous != status and status in ALERT_LEVELS:
+            bus.publish("alert", {
+                "kind": "risk_status",
+                "level": ALERT_LEVELS[status],
+                "store_id": store_id,
+                "status": status,
+                "previous_status": previous,
+                "message": f"{name}: Risk durumu {previous} -> {status}"
+            })
+
+    # Satır bazlı düşük stok alarmı (Sadece değişen satırlar)
+    for store_id, product_id, quantity in changes or []:
+        if quantity <= LOW_STOCK_THRESHOLD:
+            bus.publish("alert", {
+                "kind": "low_stock",
+                "level": "critical",
+                "store_id": store_id,
+                "product_id": product_id,
+                "quantity": quantity,
+                "message": f"KRİTİK: Mağaza {store_id}, ürün {product_id} stoğu {quantity} adede düştü."
+            })
@@ -1,81 +1,365 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-from models import Sale, Product, Store, Inventory, Forecast
+from sqlalchemy import text, select, update, func, case, bindparam, or_
+from models import Sale, Product, Store, Inventory, Forecast, DailySalesRollup, StoreDailySalesRollup
+from rollup_engine import ensure_sales_rollup, rollup_anchor_date
 from core.logger import logger
+from core import versions
+from typing import Dict, List, Optional
+import datetime
+import numpy as np
+import threading
 # import pandas as pd # Pandas artık gerekli değil (Optimizasyon)
-# import numpy as np # Numpy da gerekli değil
 # from sklearn.metrics import r2_score, mean_absolute_error # Sklearn yerine manuel hesap
 
-def calculate_abc_analysis(db: Session):
+# ==========================================
+# 🔠 ABC SINIFLANDIRMA DURUMU (Süreç içi)
+# ==========================================
+# [OPTIMIZASYON] Sınıflar ürün başına SELECT + ORM yazma yerine toplu yazılır:
+#   - full:        Tek UPDATE ... FROM (günlük rollup üzerinde window sorgusu)
+#   - incremental: Son watermark'tan sonraki satışların ciro deltası (tek GROUP BY)
+#                  bellekteki ciro tablosuna eklenir, sıralama NumPy ile yenilenir ve
+#                  sadece sınıfı DEĞİŞEN ürünler executemany ile yazılır.
+# Ciro değişmediyse (watermark aynı) önbellekteki rapor döner; hiç yazma yapılmaz.
+
+ABC_MODES = ("incremental", "full")
+ABC_THRESHOLDS = (0.80, 0.95) # Kümülatif ciro payı: A <= %80 < B <= %95 < C
+ABC_REPORT_SIZE = 20
+
+_abc_lock = threading.Lock()
+_abc_state = {
+    "watermark": None,       # İşlenen son sale id
+    "products_token": None,  # Durumun geçerli olduğu ürün versiyonu
+    "product_ids": None,     # np.ndarray (ciro olan ürünler)
+    "revenue": None,         # np.ndarray
+    "classes": None,         # np.ndarray[str]
+    "report": []
+}
+
+def _classify_ratio(ratio: np.ndarray) -> np.ndarray:
+    return np.where(ratio <= ABC_THRESHOLDS[0], "A", np.where(ratio <= ABC_THRESHOLDS[1], "B", "C"))
+
+def _rank_classes(revenue: np.ndarray) -> np.ndarray:
     """
-    🔠 ABC ANALİZİ (SQL OPTİMİZE)
-    
-    RAM dostu versiyon. 
-    Tüm veriyi belleğe çekmek yerine, hesaplamayı veritabanı motoruna (SQL) yıkar.
+    Window sorgusunun NumPy karşılığı: SUM(revenue) OVER (ORDER BY revenue DESC).
+    Varsayılan RANGE çerçevesi gibi eşit cirolu ürünler aynı kümülatif toplamı alır.
     """
-    # 1. SQL Window Functions ile Kümülatif Ciro Hesabı
-    # Modern veritabanları (PostgreSQL, SQLite 3.25+) Window Function destekler.
-    
-    sql_query = text("""
-    WITH product_sales AS (
-        SELECT product_id, SUM(total_price) as revenue
-        FROM sales
-        GROUP BY product_id
-    ),
-    total as (
-        SELECT SUM(revenue) as total_revenue FROM product_sales
-    ),
-    cumulative AS (
-        SELECT 
-            p.product_id, 
-            p.revenue,
-            SUM(p.revenue) OVER (ORDER BY p.revenue DESC) as running_total,
-            t.total_revenue
-        FROM product_sales p, total t
-    )
-    SELECT 
-        product_id, 
-        revenue,
-        (running_total * 1.0 / total_revenue) as ratio
-    FROM cumulative;
-    """)
-    
-    try:
-        results = db.execute(sql_query).fetchall()
-    except Exception as e:
-        logger.error(f"SQL Error: {e}")
+    n = len(revenue)
+    if n == 0:
+        return np.zeros(0, dtype="<U1")
+    order = np.argsort(-revenue, kind="stable")
+    ordered = revenue[order]
+    running = np.cumsum(ordered)
+    group_ends = np.flatnonzero(np.r_[ordered[1:] != ordered[:-1], True])
+    running = running[group_ends[np.searchsorted(group_ends, np.arange(n))]]
+    total = running[-1]
+    ratio = running / total if total else np.ones(n)
+    classes = np.empty(n, dtype="<U1")
+    classes[order] = _classify_ratio(ratio)
+    return classes
+
+def _abc_report(db: Session, product_ids: np.ndarray, revenue: np.ndarray, classes: np.ndarray) -> List[Dict]:
+    """En yüksek cirolu ilk 20 ürün (Performance UI). İsimler tek sorguda."""
+    if len(product_ids) == 0:
         return []
+    k = min(ABC_REPORT_SIZE, len(product_ids))
+    top = np.argpartition(-revenue, k - 1)[:k]
+    top = top[np.argsort(-revenue[top], kind="stable")]
+    top_ids = [int(product_ids[i]) for i in top]
+    names = dict(db.query(Product.id, Product.name).filter(Product.id.in_(top_ids)).all())
+    return [
+        {"product": names.get(int(product_ids[i])), "revenue": float(revenue[i]), "class": str(classes[i])}
+        for i in top
+    ]
 
-    abc_results = []
-    
-    for row in results:
-        p_id = row[0]
-        revenue = row[1]
-        ratio = row[2]
-        
-        # Sınıflandırma
-        if ratio <= 0.80:
-            abc_class = "A"
-        elif ratio <= 0.95:
-            abc_class = "B"
-        else:
-            abc_class = "C"
-            
-        # Veritabanında güncelle (Bulk Update yerine tek tek yapıyoruz şimdilik, 
-        # çünkü model bağımlılığı var. İlerde bu da bulk SQL olabilir.)
-        product = db.query(Product).filter(Product.id == p_id).first()
-        if product:
-            product.abc_category = abc_class
-            # Sadece ilk 20 veya A grubu ürünleri rapora ekle (Performance UI)
-            if len(abc_results) < 20: 
-                abc_results.append({
-                    "product": product.name,
-                    "revenue": revenue,
-                    "class": abc_class
-                })
-            
-    db.commit()
-    return abc_results
+def _abc_full(db: Session):
+    """Tek UPDATE ... FROM ile tüm sınıfları yazar; durum için ciro tablosunu okur."""
+    product_revenue = select(
+        DailySalesRollup.product_id.label("product_id"),
+        func.sum(DailySalesRollup.revenue).label("revenue")
+    ).group_by(DailySalesRollup.product_id).subquery()
+    cumulative = select(
+        product_revenue.c.product_id,
+        product_revenue.c.revenue,
+        (func.sum(product_revenue.c.revenue).over(order_by=product_revenue.c.revenue.desc()) * 1.0
+         / select(func.sum(product_revenue.c.revenue)).scalar_subquery()).label("ratio")
+    ).subquery()
+    ranked = select(
+        cumulative.c.product_id,
+        cumulative.c.revenue,
+        case(
+            (cumulative.c.ratio <= ABC_THRESHOLDS[0], "A"),
+            (cumulative.c.ratio <= ABC_THRESHOLDS[1], "B"),
+            else_="C"
+        ).label("abc_class")
+    ).subquery()
+
+    result = db.execute(
+        update(Product)
+        .where(Product.id == ranked.c.product_id, Product.abc_category.is_distinct_from(ranked.c.abc_class))
+        .values(abc_category=ranked.c.abc_class)
+        .execution_options(synchronize_session=False)
+    )
+    rows = db.query(ranked.c.product_id, ranked.c.revenue, ranked.c.abc_class).all()
+    product_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    revenue = np.array([row[1] or 0.0 for row in rows], dtype=float)
+    classes = np.array([row[2] for row in rows], dtype="<U1")
+    return product_ids, revenue, classes, max(result.rowcount or 0, 0)
+
+def _abc_incremental(db: Session, watermark: int):
+    """Yeni satışların ciro deltasını ekler; sadece sınıfı değişen ürünleri yazar."""
+    product_ids, revenue, previous = _abc_state["product_ids"], _abc_state["revenue"], _abc_state["classes"]
+    delta = db.query(Sale.product_id, func.sum(Sale.total_price)).filter(
+        Sale.id > _abc_state["watermark"], Sale.id <= watermark
+    ).group_by(Sale.product_id).all()
+
+    if delta:
+        delta_ids = np.array([row[0] for row in delta], dtype=np.int64)
+        delta_revenue = np.array([row[1] or 0.0 for row in delta], dtype=float)
+        new_ids = np.setdiff1d(delta_ids, product_ids)
+        if len(new_ids):
+            # İlk kez satılan ürünler: Tabloya eklenir (Sıralı kalır)
+            product_ids = np.concatenate([product_ids, new_ids])
+            revenue = np.concatenate([revenue, np.zeros(len(new_ids))])
+            previous = np.concatenate([previous, np.full(len(new_ids), "", dtype="<U1")])
+            order = np.argsort(product_ids)
+            product_ids, revenue, previous = product_ids[order], revenue[order], previous[order]
+        positions = np.searchsorted(product_ids, delta_ids)
+        revenue = revenue.copy()
+        np.add.at(revenue, positions, delta_revenue)
+
+    classes = _rank_classes(revenue)
+    changed = np.flatnonzero(classes != previous)
+    if len(changed):
+        table = Product.__table__
+        db.execute(
+            table.update().where(table.c.id == bindparam("pid")).values(abc_category=bindparam("abc_class")),
+            [{"pid": int(product_ids[i]), "abc_class": str(classes[i])} for i in changed]
+        )
+    return product_ids, revenue, classes, len(changed)
+
+def calculate_abc_analysis(db: Session, mode: str = "incremental"):
+    """
+    🔠 ABC ANALİZİ (SQL + ARTIMLI)
+
+    Ciro, satışların günlük rollup'ından (daily_sales_rollup) okunur.
+    incremental: Ciro değişmediyse önbellekteki rapor döner; değiştiyse sadece delta işlenir.
+    full: Tüm sınıflar tek UPDATE ... FROM ile yeniden yazılır.
+    Sınıfı değişen ürün varsa PRODUCTS versiyonu artırılır.
+    """
+    if mode not in ABC_MODES:
+        raise ValueError(f"Geçersiz mode: {mode}")
+
+    with _abc_lock:
+        watermark = ensure_sales_rollup(db)
+        products_token = versions.get_versions(db, [versions.PRODUCTS])[versions.PRODUCTS]
+        state_valid = (
+            _abc_state["watermark"] is not None
+            and _abc_state["products_token"] == products_token
+            and watermark >= _abc_state["watermark"]
+        )
+
+        if mode == "incremental" and state_valid and watermark == _abc_state["watermark"]:
+            return _abc_state["report"]
+
+        try:
+            if mode == "incremental" and state_valid:
+                product_ids, revenue, classes, changed = _abc_incremental(db, watermark)
+            else:
+                product_ids, revenue, classes, changed = _abc_full(db)
+            if changed:
+                transitions = versions.bump_version(db, versions.PRODUCTS)
+                products_token = transitions[versions.PRODUCTS][1]
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"ABC Analysis Error: {e}")
+            return []
+
+        _abc_state.update(
+            watermark=watermark,
+            products_token=products_token,
+            product_ids=product_ids,
+            revenue=revenue,
+            classes=classes,
+            report=_abc_report(db, product_ids, revenue, classes)
+        )
+        logger.info(f"ABC analysis ({mode}): {changed} class changes")
+        return _abc_state["report"]
+
+# ==========================================
+# 🧮 ABC-XYZ MATRİSİ (Talep Değişkenliği)
+# ==========================================
+# [OPTIMIZASYON] ABC (ciro payı) ve XYZ (günlük talebin değişim katsayısı, CV)
+# rollup üzerinde TEK sorguda, window aggregate'lerle hesaplanır ve tek
+# UPDATE ... FROM ile yazılır. Python'da ürün başına döngü yoktur.
+#   - Ürün seviyesi:           daily_sales_rollup       -> products (sadece xyz_category)
+#   - Mağaza x ürün seviyesi:  store_daily_sales_rollup -> inventories (PARTITION BY store)
+# Ürün ABC sınıfı burada yeniden sıralanmaz: products.abc_category'nin tek sahibi
+# calculate_abc_analysis'tir (artımlı); matris önce onu çalıştırır, saklı sınıfı okur.
+# CV karekök gerektirmez (SQLite'ta sqrt yok): CV² = N * Σq² / (Σq)² - 1 ile eşiklerin karesine göre sınıflanır.
+
+ABC_XYZ_LEVELS = ("product", "store")
+XYZ_THRESHOLDS = (0.5, 1.0) # CV: X <= 0.5 < Y <= 1.0 < Z (Satışsız seri: Z)
+XYZ_WINDOW_DAYS = 90
+
+_abc_xyz_lock = threading.Lock()
+_abc_xyz_state = {"key": None, "product": None, "store": None}
+
+def _xyz_case(window_qty, window_qty_sq):
+    """Pencere toplamlarından XYZ sınıfı (SQL CASE)."""
+    squared = window_qty * window_qty
+    return case(
+        (window_qty <= 0, "Z"),
+        (window_qty_sq * XYZ_WINDOW_DAYS <= (1 + XYZ_THRESHOLDS[0] ** 2) * squared, "X"),
+        (window_qty_sq * XYZ_WINDOW_DAYS <= (1 + XYZ_THRESHOLDS[1] ** 2) * squared, "Y"),
+        else_="Z"
+    )
+
+def _abc_case(ratio):
+    return case(
+        (ratio <= ABC_THRESHOLDS[0], "A"),
+        (ratio <= ABC_THRESHOLDS[1], "B"),
+        else_="C"
+    )
+
+def _window_sums(model, window_start, group_columns):
+    """Tüm zaman cirosu (ABC) ve pencere talep toplamları (XYZ) tek GROUP BY'da."""
+    in_window = model.date >= window_start
+    quantity = model.quantity * 1.0
+    return select(
+        *group_columns,
+        func.sum(model.revenue).label("revenue"),
+        func.sum(case((in_window, quantity), else_=0.0)).label("window_qty"),
+        func.sum(case((in_window, quantity * quantity), else_=0.0)).label("window_qty_sq")
+    ).group_by(*group_columns).subquery()
+
+def _classify_products(db: Session, window_start):
+    sums = _window_sums(DailySalesRollup, window_start, [DailySalesRollup.product_id.label("product_id")])
+    ranked = select(
+        sums.c.product_id,
+        sums.c.revenue,
+        func.coalesce(Product.abc_category, "C").label("abc_class"),
+        _xyz_case(sums.c.window_qty, sums.c.window_qty_sq).label("xyz_class")
+    ).join(Product, Product.id == sums.c.product_id).subquery()
+
+    # Satışı olmayan ürünler dokunulmaz; abc_category calculate_abc_analysis'e aittir
+    result = db.execute(
+        update(Product)
+        .where(Product.id == ranked.c.product_id, Product.xyz_category.is_distinct_from(ranked.c.xyz_class))
+        .values(xyz_category=ranked.c.xyz_class)
+        .execution_options(synchronize_session=False)
+    )
+    return ranked, max(result.rowcount or 0, 0)
+
+def _classify_store_products(db: Session, window_start):
+    sums = _window_sums(StoreDailySalesRollup, window_start, [
+        StoreDailySalesRollup.store_id.label("store_id"), StoreDailySalesRollup.product_id.label("product_id")
+    ])
+    # Envanterdeki her satır sınıflanır: Satışı olmayan seri C/Z olur
+    revenue = func.coalesce(sums.c.revenue, 0.0)
+    ratio = func.sum(revenue).over(partition_by=Inventory.store_id, order_by=revenue.desc()) * 1.0 / \
+        func.nullif(func.sum(revenue).over(partition_by=Inventory.store_id), 0)
+    ranked = select(
+        Inventory.id.label("inventory_id"),
+        Inventory.store_id.label("store_id"),
+        revenue.label("revenue"),
+        _abc_case(ratio).label("abc_class"),
+        _xyz_case(func.coalesce(sums.c.window_qty, 0.0), func.coalesce(sums.c.window_qty_sq, 0.0)).label("xyz_class")
+    ).select_from(Inventory).outerjoin(
+        sums, (sums.c.store_id == Inventory.store_id) & (sums.c.product_id == Inventory.product_id)
+    ).subquery()
+
+    # Core UPDATE: Stok kolonlarına dokunmaz, iyimser kilit versiyonunu artırmaz
+    table = Inventory.__table__
+    result = db.execute(
+        table.update()
+        .where(
+            table.c.id == ranked.c.inventory_id,
+            or_(table.c.abc_category.is_distinct_from(ranked.c.abc_class),
+                table.c.xyz_category.is_distinct_from(ranked.c.xyz_class))
+        )
+        .values(abc_category=ranked.c.abc_class, xyz_category=ranked.c.xyz_class)
+    )
+    return ranked, max(result.rowcount or 0, 0)
+
+def _empty_matrix() -> Dict[str, Dict]:
+    return {abc + xyz: {"count": 0, "revenue": 0.0} for abc in "ABC" for xyz in "XYZ"}
+
+def refresh_abc_xyz(db: Session, force: bool = False) -> Dict:
+    """
+    İki seviyede ABC-XYZ sınıflarını hesaplar, yazar ve matris özetini önbelleğe alır.
+    Ürün ABC sınıfı calculate_abc_analysis'ten gelir; burada sadece XYZ yazılır.
+    Satış (rollup watermark'ı), ürün versiyonu ve pencere günü değişmediyse önbellek döner.
+    """
+    with _abc_xyz_lock:
+        watermark = ensure_sales_rollup(db)
+        # Ürün ABC sınıfları: Tek sahip olan ABC analizi (değişim varsa PRODUCTS versiyonunu o artırır)
+        calculate_abc_analysis(db, "full" if force else "incremental")
+        anchor = rollup_anchor_date(db) or datetime.date.today()
+        products_token = versions.get_versions(db, [versions.PRODUCTS])[versions.PRODUCTS]
+        key = (watermark, products_token, anchor)
+        if not force and _abc_xyz_state["key"] == key:
+            return _abc_xyz_state
+
+        window_start = anchor - datetime.timedelta(days=XYZ_WINDOW_DAYS - 1)
+        try:
+            product_ranked, product_changes = _classify_products(db, window_start)
+            store_ranked, store_changes = _classify_store_products(db, window_start)
+
+            product_matrix = _empty_matrix()
+            for abc, xyz, count, revenue in db.query(
+                product_ranked.c.abc_class, product_ranked.c.xyz_class,
+                func.count(), func.sum(product_ranked.c.revenue)
+            ).group_by(product_ranked.c.abc_class, product_ranked.c.xyz_class).all():
+                product_matrix[abc + xyz] = {"count": count, "revenue": float(revenue or 0.0)}
+
+            store_matrix = {}
+            for store_id, abc, xyz, count, revenue in db.query(
+                store_ranked.c.store_id, store_ranked.c.abc_class, store_ranked.c.xyz_class,
+                func.count(), func.sum(store_ranked.c.revenue)
+            ).group_by(store_ranked.c.store_id, store_ranked.c.abc_class, store_ranked.c.xyz_class).all():
+                store_matrix.setdefault(store_id, _empty_matrix())[abc + xyz] = {
+                    "count": count, "revenue": float(revenue or 0.0)
+                }
+
+            # xyz_category ürün versiyonlu önbelleklerde kullanılmaz: PRODUCTS artırılmaz
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"ABC-XYZ Error: {e}")
+            raise
+
+        _abc_xyz_state.update(key=(watermark, products_token, anchor), product=product_matrix, store=store_matrix)
+        logger.info(f"ABC-XYZ refreshed: {product_changes} product, {store_changes} store-product class changes")
+        return _abc_xyz_state
+
+def get_abc_xyz_matrix(db: Session, level: str = "product", store_id: Optional[int] = None) -> Dict:
+    """ABC-XYZ matrisi: Her hücrede seri sayısı ve ciro. store seviyesi mağaza filtresini destekler."""
+    if level not in ABC_XYZ_LEVELS:
+        raise ValueError(f"Geçersiz level: {level}")
+    state = refresh_abc_xyz(db)
+
+    if level == "product":
+        matrix = state["product"]
+    elif store_id is not None:
+        matrix = state["store"].get(store_id, _empty_matrix())
+    else:
+        matrix = _empty_matrix()
+        for store_matrix in state["store"].values():
+            for cell, values in store_matrix.items():
+                matrix[cell]["count"] += values["count"]
+                matrix[cell]["revenue"] += values["revenue"]
+
+    return {
+        "level": level,
+        "store_id": store_id,
+        "window_days": XYZ_WINDOW_DAYS,
+        "abc_thresholds": list(ABC_THRESHOLDS),
+        "xyz_thresholds": list(XYZ_THRESHOLDS),
+        "matrix": matrix
+    }
+
+POTENTIAL_REVENUE_RATE = 0.7 # Transfer edilen stoğun satışa dönme varsayımı (what-if)
 
 def simulate_what_if(db: Session, source_store_id: int, target_store_id: int, product_id: int, amount: int):
     """
@@ -96,7 +380,7 @@ def simulate_what_if(db: Session, source_store_id: int, target_store_id: int, pr
         source_risk = "YÜKSEK"
     
     # Hedef Analizi
-    potential_revenue = amount * product.price * 0.7 
+    potential_revenue = amount * product.price * POTENTIAL_REVENUE_RATE
     
     return {
         "scenario": f"{amount} adet transfer senaryosu",
@@ -113,6 +397,108 @@ def simulate_what_if(db: Session, source_store_id: int, target_store_id: int, pr
         "recommendation": "ONAY" if source_after > source_inv.safety_stock else "RED"
     }
 
+def simulate_what_if_batch(db: Session, moves: List[Dict]) -> Dict:
+    """
+    🧪 TOPLU WHAT-IF (Bütün bir transfer planı tek istekte)
+
+    Hamleler sırayla uygulanmış gibi değerlendirilir: Aynı kaynaktan çıkan (veya
+    aynı hedefe giren) birden fazla hamle birbirinin stoğunu görür.
+    Her hamle iki stok olayına (kaynak -miktar, hedef +miktar) ayrılır; olaylar
+    (mağaza, ürün) anahtarına göre stabil sıralanıp grup içi kümülatif toplanır.
+
+    Sorgu sayısı hamle sayısından bağımsızdır: Envanter ve ürünler için iki IN sorgusu.
+    """
+    n = len(moves)
+    if n == 0:
+        return {"results": [], "summary": {"moves": 0, "approved": 0, "rejected": 0, "invalid": 0,
+                                           "potential_revenue_increase": 0.0}}
+
+    source = np.array([m["source_store_id"] for m in moves], dtype=np.int64)
+    target = np.array([m["target_store_id"] for m in moves], dtype=np.int64)
+    product = np.array([m["product_id"] for m in moves], dtype=np.int64)
+    amount = np.array([m["amount"] for m in moves], dtype=np.int64)
+
+    # 1. İlgili envanter satırları ve ürün fiyatları (İki IN sorgusu; mağaza x ürün üst kümesi)
+    store_ids = np.union1d(source, target).tolist()
+    product_ids = np.unique(product).tolist()
+    inventory = {
+        (row[0], row[1]): (row[2] or 0, row[3] or 0)
+        for row in db.query(Inventory.store_id, Inventory.product_id, Inventory.quantity, Inventory.safety_stock)
+        .filter(Inventory.store_id.in_(store_ids), Inventory.product_id.in_(product_ids)).all()
+    }
+    prices = dict(db.query(Product.id, Product.price).filter(Product.id.in_(product_ids)).all())
+
+    def lookup(stores):
+        rows = [inventory.get(key) for key in zip(stores.tolist(), product.tolist())]
+        found = np.array([row is not None for row in rows], dtype=bool)
+        values = np.array([row or (0, 0) for row in rows], dtype=np.int64).reshape(-1, 2)
+        return found, values[:, 0], values[:, 1]
+
+    source_found, source_qty, source_safety = lookup(source)
+    target_found, target_qty, _ = lookup(target)
+    valid = source_found & target_found & (source != target) & (amount > 0)
+    price = np.array([prices.get(p) or 0.0 for p in product.tolist()], dtype=float)
+
+    # 2. Sıralı stok olayları: 2i -> kaynak çıkışı, 2i+1 -> hedef girişi (Geçersiz hamle etkisiz)
+    event_store = np.empty(2 * n, dtype=np.int64)
+    event_store[0::2], event_store[1::2] = source, target
+    event_product = np.repeat(product, 2)
+    event_delta = np.empty(2 * n, dtype=np.int64)
+    event_delta[0::2], event_delta[1::2] = -amount, amount
+    event_delta[np.repeat(~valid, 2)] = 0
+
+    order = np.lexsort((np.arange(2 * n), event_product, event_store)) # Anahtar, sonra istek sırası
+    sorted_delta = np.cumsum(event_delta[order])
+    key_store, key_product = event_store[order], event_product[order]
+    group_start = np.r_[True, (key_store[1:] != key_store[:-1]) | (key_product[1:] != key_product[:-1])]
+    start_positions = np.flatnonzero(group_start)
+    offsets = np.r_[0, sorted_delta][start_positions] # Grup başına önceki grupların toplamı
+    group_index = np.cumsum(group_start) - 1
+    running = np.empty(2 * n, dtype=np.int64)
+    running[order] = sorted_delta - offsets[group_index]
+
+    source_after = source_qty + running[0::2]
+    target_after = target_qty + running[1::2]
+    source_before = source_after + np.where(valid, amount, 0)
+    target_before = target_after - np.where(valid, amount, 0)
+    high_risk = source_after < source_safety
+    approved = valid & (source_after > source_safety)
+    revenue = np.where(valid, amount * price * POTENTIAL_REVENUE_RATE, 0.0)
+
+    # 3. Tekil what-if ile aynı şekilde sonuç
+    results = []
+    for i in range(n):
+        if not valid[i]:
+            reason = "Envanter bulunamadı" if not (source_found[i] and target_found[i]) else "Geçersiz hamle"
+            results.append({"index": i, "error": reason})
+            continue
+        results.append({
+            "index": i,
+            "scenario": f"{int(amount[i])} adet transfer senaryosu",
+            "source_store_impact": {
+                "current_stock": int(source_before[i]),
+                "stock_after": int(source_after[i]),
+                "risk_assessment": "YÜKSEK" if high_risk[i] else "DÜŞÜK"
+            },
+            "target_store_impact": {
+                "current_stock": int(target_before[i]),
+                "stock_after": int(target_after[i]),
+                "potential_revenue_increase": float(revenue[i])
+            },
+            "recommendation": "ONAY" if approved[i] else "RED"
+        })
+
+    return {
+        "results": results,
+        "summary": {
+            "moves": n,
+            "approved": int(approved.sum()),
+            "rejected": int((valid & ~approved).sum()),
+            "invalid": int((~valid).sum()),
+            "potential_revenue_increase": float(revenue.sum())
+        }
+    }
+
 def calculate_forecast_accuracy(db: Session, store_id: int, product_id: int):
     """
     🎯 TAHMİN DOĞRULUĞU (SQL JOIN OPTİMİZE)
@@ -1,76 +1,109 @@
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from models import Product, Sale, Store
-import random
+from models import Product, DailySalesRollup
+from rollup_engine import ensure_sales_rollup
+from product_index_engine import product_index, DEMAND_DAYS
+import math
 
-def get_similar_products(db: Session, target_product: Product, limit: int = 3):
+# ==========================================
+# 🆕 SOĞUK BAŞLANGIÇ (COLD START)
+# ==========================================
+# [OPTIMIZASYON] Proxy ürünler SQL ile değil, ürün benzerlik indeksinden
+# (product_index_engine, NumPy + argpartition) bulunur. Proxy'lerin son 30 günlük
+# talep istatistikleri de indekste hazır tutulur (günlük rollup'tan, artımlı).
+# Yeni satış (rollup watermark'ı) veya katalog değişikliği (PRODUCTS versiyonu)
+# indeksi kendiliğinden günceller.
+
+PROXY_LIMIT = 3            # k-NN: Referans alınan benzer ürün sayısı
+ESTABLISHED_SALE_COUNT = 10 # Bu sayının üstünde satış kaydı olan ürün "yerleşik" sayılır
+
+def get_similar_products(db: Session, target_product: Product, limit: int = PROXY_LIMIT):
     """
-    k-NN (k-Nearest Neighbors) Algoritması (SQL OPTİMİZE):
+    k-NN (k-Nearest Neighbors) Algoritması:
     Yeni bir ürün için "Benzer" (Proxy) ürünleri bulur.
-    
+
     Benzerlik Kriterleri:
-    1. Hard Filter: Aynı kategoride olmalı.
-    2. Distance Metric (Mesafe): Fiyat farkı (|P1 - P2|) en az olanlar seçilir.
-    
-    Eski yöntem: Tüm kategori ürünlerini çekip Python'da sort ediyordu.
-    Yeni yöntem: SQL ORDER BY ABS(...) LIMIT ... ile sadece gerekenleri çeker.
+    1. Hard Filter: Aynı kategoride olmalı (Kategoride yeterli ürün yoksa tüm katalog).
+       Sadece son 30 günde satışı olan ürünler aday olur (Satışsız kardeş ürünler ~0 talep taşır).
+    2. Distance Metric: Fiyat, maliyet, marj, kategori ve haftalık satış profili
+       vektörleri arasındaki kosinüs benzerliği.
     """
-    # SQL ile sıralama ve limit (RAM tasarrufu)
-    similar_products = db.query(Product).filter(
-        Product.category == target_product.category,
-        Product.id != target_product.id
-    ).order_by(
-        func.abs(Product.price - target_product.price)
-    ).limit(limit).all()
-    
-    return similar_products
+    return product_index.similar(db, target_product.id, limit)
+
+def _proxy_message(category: str, proxies) -> str:
+    """Proxy'lerin nereden geldiğini (kategori / katalog geneli) doğru anlatan mesaj."""
+    if not proxies:
+        return "Yetersiz veri. Son 30 günde satışı olan benzer ürün bulunamadı."
+    in_category = sum(1 for p in proxies if p["category"] == (category or ""))
+    if in_category == len(proxies):
+        return f"Yetersiz veri. '{category}' kategorisindeki benzer {in_category} ürün referans alındı."
+    if in_category == 0:
+        return f"Yetersiz veri. '{category}' kategorisinde satışı olan ürün yok; katalog genelinden benzer {len(proxies)} ürün referans alındı."
+    return (f"Yetersiz veri. '{category}' kategorisindeki benzer {in_category} ürün ve "
+            f"katalog genelinden {len(proxies) - in_category} ürün referans alındı.")
 
 def analyze_cold_start(db: Session, product_id: int):
     """
     Cold Start Problemi (Soğuk Başlangıç):
     Geçmiş satış verisi olmayan YENİ ürünler için talep tahmini yapma sorunu.
-    
+
     Çözüm: "Proxy" (Vekil) Tabanlı Tahmin.
-    Benzer ürünlerin istatistikleri (Ortalama, Standart Sapma) yeni ürüne kopyalanır.
+    Benzer ürünlerin son 30 günlük istatistikleri (Ortalama, Varyans)
+    benzerlik skoruyla ağırlıklandırılarak yeni ürüne aktarılır.
     """
     product = db.query(Product).filter(Product.id == product_id).first()
     if not product:
         return {"error": "Product not found"}
-        
-    # Bu ürünün satış geçmişi var mı?
-    sale_count = db.query(func.count(Sale.id)).filter(Sale.product_id == product_id).scalar()
-    
-    if sale_count > 10:
+
+    # Bu ürünün satış geçmişi var mı? (Rollup üzerinden, ham tablo taranmaz)
+    ensure_sales_rollup(db)
+    sale_count = db.query(func.coalesce(func.sum(DailySalesRollup.sale_count), 0)).filter(
+        DailySalesRollup.product_id == product_id
+    ).scalar()
+
+    if sale_count > ESTABLISHED_SALE_COUNT:
         return {
             "status": "established",
             "message": "Yeterli geçmiş veri var. Standart istatistiksel motor kullanılıyor."
         }
-        
+
     # Cold Start Durumu: Benzer ürünleri bul
     proxies = get_similar_products(db, product)
-    
+
     proxy_data = []
-    total_avg_daily_sales = 0
-    
+    weight_sum = 0.0
+    weighted_demand = 0.0
+    weighted_variance = 0.0
+
     for p in proxies:
-        # Son 30 günlük ortalama satışını bul (Simüle)
-        avg_sales = random.uniform(5, 15) # Demo verisi
-        total_avg_daily_sales += avg_sales
-        
+        similarity = max(p["similarity"], 0.0) # Zıt yönlü vektörler ağırlık almaz
+        weight_sum += similarity
+        weighted_demand += similarity * p["avg_daily_demand"]
+        weighted_variance += similarity * p["demand_variance"]
+
         proxy_data.append({
-            "id": p.id,
-            "name": p.name,
-            "price": p.price,
-            "similarity_score": f"%{random.randint(85, 99)}", # Demo skoru
-            "avg_daily_demand": round(avg_sales, 1)
+            "id": p["id"],
+            "name": p["name"],
+            "price": p["price"],
+            "similarity_score": f"%{round(similarity * 100)}",
+            "avg_daily_demand": round(p["avg_daily_demand"], 1),
+            "demand_std": round(math.sqrt(p["demand_variance"]), 1)
         })
-        
-    predicted_demand = total_avg_daily_sales / len(proxies) if proxies else 0
-    
+
+    if weight_sum > 0:
+        predicted_demand = weighted_demand / weight_sum
+        predicted_std = math.sqrt(weighted_variance / weight_sum)
+    else:
+        # Hiçbir proxy pozitif benzerlikte değilse: Basit ortalama
+        predicted_demand = sum(p["avg_daily_demand"] for p in proxies) / len(proxies) if proxies else 0
+        predicted_std = math.sqrt(sum(p["demand_variance"] for p in proxies) / len(proxies)) if proxies else 0
+
     return {
         "status": "cold_start",
         "method": "k-NN (Similarity Based)",
-        "message": f"Yetersiz veri. '{product.category}' kategorisindeki benzer {len(proxies)} ürün referans alındı.",
+        "message": _proxy_message(product.category, proxies),
         "proxies": proxy_data,
-        "predicted_demand": round(predicted_demand, 1)
+        "predicted_demand": round(predicted_demand, 1),
+        "predicted_demand_std": round(predicted_std, 1),
+        "window_days": DEMAND_DAYS
     }
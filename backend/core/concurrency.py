@@ -0,0 +1,58 @@
+import time
+import random
+import threading
+from typing import Callable, TypeVar
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from core.logger import logger
+
+T = TypeVar("T")
+
+# Çakışma Metrikleri (Süreç içi sayaçlar)
+_metrics_lock = threading.Lock()
+conflict_metrics = {
+    "conflicts": 0,          # Versiyon uyuşmazlığı yüzünden geri alınan deneme sayısı
+    "retries_succeeded": 0,  # En az bir çakışmadan sonra başarıyla tamamlanan işlem
+    "retries_exhausted": 0   # Tüm denemeler tükendi, hata istemciye döndü
+}
+
+def _record(metric: str):
+    with _metrics_lock:
+        conflict_metrics[metric] += 1
+
+def get_conflict_metrics() -> dict:
+    with _metrics_lock:
+        return dict(conflict_metrics)
+
+def with_optimistic_retry(db: Session, operation: Callable[[], T], max_attempts: int = 5, base_delay: float = 0.02) -> T:
+    """
+    İyimser Eşzamanlılık (Optimistic Concurrency Control):
+
+    Inventory satırları 'version' kolonu ile korunur. ORM her UPDATE'i
+    "... WHERE id = ? AND version = ?" şeklinde yapar; arada başka bir worker
+    satırı değiştirdiyse 0 satır güncellenir ve StaleDataError fırlar.
+
+    Bu durumda transaction geri alınır ve işlem (okuma dahil) baştan tekrar
+    çalıştırılır. Denemeler arasında üstel bekleme + rastgele sapma (jitter)
+    uygulanır. Tabloyu kilitlemeden kayıp güncellemeler (lost update) önlenir.
+
+    operation: Okuma-değiştirme-commit işleminin tamamını yapan fonksiyon.
+    """
+    attempt = 0
+    while True:
+        try:
+            result = operation()
+            if attempt > 0:
+                _record("retries_succeeded")
+            return result
+        except StaleDataError as e:
+            db.rollback()
+            _record("conflicts")
+            attempt += 1
+            if attempt >= max_attempts:
+                _record("retries_exhausted")
+                logger.error(f"Inventory write conflict, giving up after {attempt} attempts: {e}")
+                raise
+            delay = base_delay * (2 ** (attempt - 1)) + random.uniform(0, base_delay)
+            logger.warning(f"Inventory write conflict (attempt {attempt}/{max_attempts}), retrying in {delay:.3f}s")
+            time.sleep(delay)
@@ -16,6 +16,14 @@ class Settings:
     
     # AI & Dış Servisler
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
+
+    # Transfer Motoru
+    # Rota ceza puanlarının yarılanma süresi (gün). 0 -> Zamanla azalma yok.
+    ROUTE_PENALTY_HALF_LIFE_DAYS: float = float(os.getenv("ROUTE_PENALTY_HALF_LIFE_DAYS", "30"))
+
+    # Risk Geçmişi
+    # Mağaza/kategori risk sayaçlarının örneklenme aralığı (dakika). 0 -> Arka plan örnekleyici kapalı.
+    RISK_SNAPSHOT_INTERVAL_MINUTES: int = int(os.getenv("RISK_SNAPSHOT_INTERVAL_MINUTES", "60"))
     
     # Check if testing mode
     TESTING: bool = os.getenv("TESTING", "False").lower() == "true"
@@ -0,0 +1,73 @@
+import asyncio
+import itertools
+import threading
+import datetime
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+# ==========================================
+# 📣 SÜREÇ İÇİ OLAY VERİYOLU (EVENT BUS)
+# ==========================================
+# Envanter yazan kod yolları commit sonrası olay yayınlar; SSE abonelerine
+# (dashboard'lar) anında iletilir. Yayıncılar (sync endpoint thread'leri)
+# abonelerin event loop'una call_soon_threadsafe ile yazar; bekleyen abone
+# thread tutmaz. Kuyruğu dolan (yavaş) abonenin en eski olayı atılır.
+# Not: Olaylar süreç (worker) bazındadır.
+
+SUBSCRIBER_QUEUE_SIZE = 256
+REPLAY_BUFFER_SIZE = 512
+
+class EventBus:
+    def __init__(self, replay_size: int = REPLAY_BUFFER_SIZE):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._subscribers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+        self._recent = deque(maxlen=replay_size) # Yeniden bağlananlar için (Last-Event-ID)
+
+    def publish(self, event_type: str, payload: Dict) -> Dict:
+        """Olayı tüm abonelere iletir. Her thread'den çağrılabilir, bloklamaz."""
+        with self._lock:
+            event = {
+                "id": next(self._ids),
+                "type": event_type,
+                "ts": datetime.datetime.utcnow().isoformat(),
+                "data": payload
+            }
+            self._recent.append(event)
+            subscribers = list(self._subscribers)
+
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # Abonenin loop'u kapanmış: Aboneliği düşür
+                self.unsubscribe(queue)
+        return event
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> asyncio.Queue:
+        """Çalışan event loop içinde çağrılmalı. Kaçırılan olaylar kuyruğa önceden doldurulur."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            if last_event_id is not None:
+                for event in self._recent:
+                    if event["id"] > last_event_id:
+                        _offer(queue, event)
+            self._subscribers.append((loop, queue))
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers = [(loop, q) for loop, q in self._subscribers if q is not queue]
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+def _offer(queue: asyncio.Queue, event: Dict):
+    if queue.full():
+        queue.get_nowait() # En eski olayı at (Yavaş abone yayıncıyı bekletmez)
+    queue.put_nowait(event)
+
+bus = EventBus()
@@ -0,0 +1,174 @@
+import datetime
+import threading
+from typing import Dict, Optional, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from models import RoutePenalty, Store
+from core import versions
+from core.config import settings
+
+# ==========================================
+# 🚧 ROTA CEZA PUANI CACHE'İ
+# ==========================================
+# [OPTIMIZASYON] route_penalties tablosu her öneri isteğinde tekrar okunmaz.
+# Süreç başına bir kez yüklenir ve mağaza sırasına göre indekslenmiş yoğun
+# (dense) NumPy matrislerinde tutulur:
+#   _scores[i, j]  -> Kaynak i, hedef j rotasının son yazılan ceza puanı
+#   _updated[i, j] -> Bu puanın yazıldığı an (epoch saniye)
+# Zamanla azalma (decay) okuma anında, tüm matris için vektörel hesaplanır.
+# Tablo sadece ROUTE_PENALTIES versiyonu (core.versions) değişince yeniden yüklenir.
+
+SECONDS_PER_DAY = 86400.0
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def _to_seconds(moment: datetime.datetime) -> float:
+    return (moment - _EPOCH).total_seconds()
+
+class RoutePenaltyCache:
+    """
+    Rota ceza puanlarının süreç içi (process-level) cache'i.
+
+    Azalma gün hassasiyetindedir: Aynı gün içindeki tüm okumalar aynı puanı
+    görür. Böylece öneri cache'i (ETag) decay_epoch() ile anahtarlanabilir.
+    """
+
+    def __init__(self, half_life_days: float = settings.ROUTE_PENALTY_HALF_LIFE_DAYS):
+        self.half_life_days = half_life_days
+        self.version = None
+        self._lock = threading.Lock()
+        self._store_ids = np.zeros(0, dtype=np.int64)
+        self._index = {}                  # store_id -> matris pozisyonu
+        self._scores = np.zeros((0, 0))
+        self._updated = np.zeros((0, 0))
+
+    def decay_epoch(self, now: Optional[datetime.datetime] = None) -> int:
+        """Azalmanın hesaplandığı gün (UTC). Azalma kapalıysa sabit 0."""
+        if self.half_life_days <= 0:
+            return 0
+        now = now or datetime.datetime.utcnow()
+        return now.date().toordinal()
+
+    def _decay(self, updated: np.ndarray, epoch: int) -> np.ndarray:
+        if self.half_life_days <= 0:
+            return np.ones_like(updated)
+        reference = _to_seconds(datetime.datetime.fromordinal(epoch))
+        age_days = np.maximum(reference - updated, 0.0) / SECONDS_PER_DAY
+        return np.power(0.5, age_days / self.half_life_days)
+
+    def ensure_current(self, db: Session):
+        """Tablo versiyonu değiştiyse (başka worker yazmış veya reset) yeniden yükler."""
+        token = versions.get_versions(db, [versions.ROUTE_PENALTIES])[versions.ROUTE_PENALTIES]
+        if token != self.version:
+            self.reload(db, token)
+
+    def reload(self, db: Session, token: str):
+        """Tüm tabloyu tek sorguda okuyup matrisleri yeniden kurar."""
+        store_ids = [row[0] for row in db.query(Store.id).order_by(Store.id).all()]
+        rows = db.query(
+            RoutePenalty.source_store_id, RoutePenalty.target_store_id,
+            RoutePenalty.penalty_score, RoutePenalty.last_updated
+        ).all()
+
+        index = {store_id: pos for pos, store_id in enumerate(store_ids)}
+        n = len(store_ids)
+        scores = np.zeros((n, n))
+        updated = np.zeros((n, n))
+        loaded_at = _to_seconds(datetime.datetime.utcnow())
+        for source_id, target_id, score, last_updated in rows:
+            if source_id not in index or target_id not in index:
+                continue
+            i, j = index[source_id], index[target_id]
+            scores[i, j] = score or 0.0
+            # Zaman damgası olmayan eski kayıtlar: Yükleme anında yazılmış say
+            updated[i, j] = _to_seconds(last_updated) if last_updated else loaded_at
+
+        with self._lock:
+            self._store_ids = np.array(store_ids, dtype=np.int64)
+            self._index = index
+            self._scores = scores
+            self._updated = updated
+            self.version = token
+
+    def penalty_map(self, db: Session, epoch: Optional[int] = None) -> Dict[Tuple[int, int], float]:
+        """
+        Transfer motorunun beklediği {(kaynak_id, hedef_id): puan} sözlüğü.
+        Sadece sıfır olmayan rotalar döner; azalma vektörel uygulanır.
+        """
+        self.ensure_current(db)
+        epoch = self.decay_epoch() if epoch is None else epoch
+        with self._lock:
+            store_ids, scores, updated = self._store_ids, self._scores, self._updated
+            effective = scores * self._decay(updated, epoch)
+
+        sources, targets = np.nonzero(effective)
+        return {
+            (int(store_ids[i]), int(store_ids[j])): float(effective[i, j])
+            for i, j in zip(sources, targets)
+        }
+
+    def write_penalty(self, db: Session, source_store_id: int, target_store_id: int, increment: float,
+                      transitions: Dict[str, Tuple[str, str]]) -> Dict:
+        """
+        Rotaya ceza ekler (write-through, 1. adım: Veritabanı).
+        Yeni puan = azalmış mevcut puan + artış.
+
+        Cache çağıranın kilitlediği önceki versiyondaysa mevcut puan bellekten okunur
+        (SELECT yok). Tek UPDATE yapılır; satır yoksa INSERT. Commit ETMEZ:
+        Commit sonrası commit_penalty() ile cache güncellenir.
+        """
+        previous_token = transitions[versions.ROUTE_PENALTIES][0]
+        now = datetime.datetime.utcnow()
+        epoch = self.decay_epoch(now)
+
+        current = None
+        with self._lock:
+            if self.version == previous_token and source_store_id in self._index and target_store_id in self._index:
+                i, j = self._index[source_store_id], self._index[target_store_id]
+                current = float(self._scores[i, j] * self._decay(self._updated[i, j:j + 1], epoch)[0])
+
+        if current is None:
+            row = db.query(RoutePenalty.penalty_score, RoutePenalty.last_updated).filter(
+                RoutePenalty.source_store_id == source_store_id,
+                RoutePenalty.target_store_id == target_store_id
+            ).first()
+            current = 0.0
+            if row and row[0]:
+                updated = np.array([_to_seconds(row[1]) if row[1] else _to_seconds(now)])
+                current = float(row[0] * self._decay(updated, epoch)[0])
+
+        new_score = current + increment
+        table = RoutePenalty.__table__
+        result = db.execute(
+            table.update()
+            .where(table.c.source_store_id == source_store_id, table.c.target_store_id == target_store_id)
+            .values(penalty_score=new_score, last_updated=now)
+        )
+        if result.rowcount == 0:
+            db.execute(table.insert().values(
+                source_store_id=source_store_id, target_store_id=target_store_id,
+                penalty_score=new_score, last_updated=now
+            ))
+
+        return {
+            "source_store_id": source_store_id,
+            "target_store_id": target_store_id,
+            "penalty_score": new_score,
+            "updated_at": now
+        }
+
+    def commit_penalty(self, update: Dict, transitions: Dict[str, Tuple[str, str]]):
+        """
+        Write-through, 2. adım: Commit edilen puanı matrise yazar.
+        Cache önceki versiyonda değilse (araya başka yazma girmiş) bir sonraki
+        okumada tablo yeniden yüklenir.
+        """
+        previous_token, new_token = transitions[versions.ROUTE_PENALTIES]
+        with self._lock:
+            source_pos = self._index.get(update["source_store_id"])
+            target_pos = self._index.get(update["target_store_id"])
+            if self.version != previous_token or source_pos is None or target_pos is None:
+                self.version = None
+                return
+            self._scores[source_pos, target_pos] = update["penalty_score"]
+            self._updated[source_pos, target_pos] = _to_seconds(update["updated_at"])
+            self.version = new_token
@@ -0,0 +1,44 @@
+import uuid
+import datetime
+from typing import Dict, Iterable, Tuple
+from sqlalchemy.orm import Session
+from models import DataVersion
+
+# Versiyonlanan veri alanları
+INVENTORY = "inventory"
+FORECAST = "forecast"
+ROUTE_PENALTIES = "route_penalties"
+PRODUCTS = "products"
+
+def bump_version(db: Session, *names: str) -> Dict[str, Tuple[str, str]]:
+    """
+    Verilen veri alanlarının versiyon token'ını yeniler.
+    Dönüş: {name: (eski_token, yeni_token)}
+
+    Commit ETMEZ: Çağıran fonksiyon kendi yazma işlemiyle aynı transaction
+    içinde commit etmelidir. Böylece veri ve versiyon birlikte görünür olur.
+    Versiyon satırı kilitlenir (SELECT ... FOR UPDATE); eşzamanlı yazanlar
+    sıraya girer ve eski token her zaman bir önceki yazmayı gösterir.
+    """
+    now = datetime.datetime.utcnow()
+    transitions = {}
+    for name in names:
+        row = db.query(DataVersion).filter(DataVersion.name == name).with_for_update().first()
+        if row is None:
+            row = DataVersion(name=name, token="0")
+            db.add(row)
+        previous = row.token or "0"
+        row.token = uuid.uuid4().hex
+        row.updated_at = now
+        transitions[name] = (previous, row.token)
+    return transitions
+
+def get_versions(db: Session, names: Iterable[str]) -> Dict[str, str]:
+    """
+    Veri alanlarının güncel token'larını tek sorguda döner.
+    Hiç yazılmamış alanlar için "0" döner.
+    """
+    names = list(names)
+    rows = db.query(DataVersion.name, DataVersion.token).filter(DataVersion.name.in_(names)).all()
+    found = {row[0]: row[1] for row in rows}
+    return {name: found.get(name, "0") for name in names}
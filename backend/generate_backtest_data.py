@@ -1,6 +1,7 @@
 from sqlalchemy.orm import Session
 from database import SessionLocal
 from models import Store, Product, Sale, Forecast
+from core import versions
 import pandas as pd
 import numpy as np
 from sklearn.linear_model import LinearRegression
@@ -12,8 +13,8 @@ def generate_backtest_forecasts(db: Session):
     
     # 1. Clear existing forecasts to avoid confusion
     print("Clearing existing forecasts...")
+    # Silme ve yeni tahminler tek transaction: Okuyucular yarım tablo görmez
     db.query(Forecast).delete()
-    db.commit()
     
     stores = db.query(Store).all()
     products = db.query(Product).limit(50).all() 
@@ -78,6 +79,8 @@ def generate_backtest_forecasts(db: Session):
                 db.add(forecast)
                 generated_count += 1
                 
+    # Tahmine bağlı cache'ler (öneri ETag'i, planlayıcı, days-of-cover, sandbox) yenilensin
+    versions.bump_version(db, versions.FORECAST)
     db.commit()
     print(f"DONE. Generated {generated_count} backtest forecasts.")
 
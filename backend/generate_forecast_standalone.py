@@ -2,64 +2,45 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 from database import SessionLocal
 from models import Store, Product, Sale, Forecast
+from core import versions
+from store_similarity_engine import store_similarity
 import pandas as pd
 import numpy as np
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
 import datetime
 from datetime import timedelta
-import math
 
 # --- Helper Functions ---
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    R = 6371
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat / 2) * math.sin(dlat / 2) + \
-        math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * \
-        math.sin(dlon / 2) * math.sin(dlon / 2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+MIN_HISTORY = 10 # Regresyon için gereken en az satış kaydı
 
 def get_proxy_sales_data(db: Session, target_store: Store, product_id: int):
-    other_stores = db.query(Store).filter(
-        Store.id != target_store.id,
-        Store.store_type == target_store.store_type
-    ).all()
-    
-    best_proxy = None
-    min_dist = float('inf')
-    
-    for s in other_stores:
-        has_data = db.query(Sale).filter(Sale.store_id == s.id, Sale.product_id == product_id).first()
-        if not has_data:
-            continue
-            
-        dist = calculate_distance(target_store.lat, target_store.lon, s.lat, s.lon)
-        if dist < min_dist:
-            min_dist = dist
-            best_proxy = s
-            
-    if best_proxy:
-        print(f"    Using proxy store {best_proxy.name} for Store {target_store.id}")
-        return db.query(Sale.date, Sale.quantity)\
-            .filter(Sale.store_id == best_proxy.id, Sale.product_id == product_id)\
-            .order_by(Sale.date)\
-            .all()
-    return []
+    # Proxy mağaza: Benzerlik servisinin komşu sırası + bulunurluk bitmap'i (sorgusuz;
+    # güncellik generate_forecasts başında bir kez kontrol edilir)
+    proxy_store_id = store_similarity.proxy_store(db, target_store.id, product_id, min_rows=MIN_HISTORY, check=False)
+    if proxy_store_id is None:
+        return []
+
+    print(f"    Using proxy store {proxy_store_id} for Store {target_store.id}")
+    return db.query(Sale.date, Sale.quantity)\
+        .filter(Sale.store_id == proxy_store_id, Sale.product_id == product_id)\
+        .order_by(Sale.date)\
+        .all()
 
 def generate_forecasts(db: Session):
     print("Starting standalone forecast generation...")
     
     # 1. Clear existing forecasts
     print("Clearing existing forecasts...")
+    # Silme ve yeni tahminler tek transaction: Okuyucular yarım tablo görmez
     db.query(Forecast).delete()
-    db.commit()
     
     stores = db.query(Store).all()
     # Use ALL products or a larger limit
     products = db.query(Product).limit(50).all() 
+    # Proxy seçimi için benzerlik indeksi çalıştırma başına bir kez tazelenir (seri başına değil)
+    store_similarity.ensure_current(db)
     
     generated_count = 0
     
@@ -73,11 +54,11 @@ def generate_forecasts(db: Session):
                 .all()
             
             # Cold Start Handle
-            if len(sales_data) < 10:
+            if len(sales_data) < MIN_HISTORY:
                 # print(f"  Insufficient data ({len(sales_data)}), trying proxy...")
                 sales_data = get_proxy_sales_data(db, store, product.id)
                 
-            if len(sales_data) < 10:
+            if len(sales_data) < MIN_HISTORY:
                 # print(f"  Still insufficient data ({len(sales_data)}). Skipping.")
                 continue
                 
@@ -112,6 +93,8 @@ def generate_forecasts(db: Session):
             except Exception as e:
                 print(f"  Error generating forecast for S{store.id} P{product.id}: {e}")
                 
+    # Tahmine bağlı cache'ler (öneri ETag'i, planlayıcı, days-of-cover, sandbox) yenilensin
+    versions.bump_version(db, versions.FORECAST)
     db.commit()
     print(f"DONE. Generated {generated_count} total forecasts.")
 
@@ -0,0 +1,95 @@
+from models import Product, Forecast, Inventory, Store
+from risk_engine import refresh_store_risk_summary
+from core import versions
+from typing import Dict, List
+from sqlalchemy.orm import Session
+from sqlalchemy import select, insert, literal, union_all
+import datetime
+
+# ==========================================
+# 🚀 TOPLU ÜRÜN LANSMANI
+# ==========================================
+# [OPTIMIZASYON] Sezonluk koleksiyonlar yüzlerce SKU ile gelir. Ürün başına
+# commit, referans tahminlerini ORM nesnesi olarak okuyup tek tek ekleme ve
+# mağaza başına Inventory nesnesi yerine:
+#   1. Ürünler tek çok satırlı INSERT ... RETURNING
+#   2. Tahminler sunucuda kopyalanır: INSERT ... SELECT predicted_quantity * katsayı
+#   3. Envanter satırları tek INSERT ... SELECT (mağazalar x yeni ürünler)
+# Risk özeti ve versiyonlar tüm lansman için bir kez güncellenir.
+
+DEFAULT_FORECAST_FACTOR = 0.8 # Referans tahmininin yeni ürüne aktarılan oranı (%80 varsayımı)
+DEFAULT_SAFETY_STOCK = 10
+MAPPING_CHUNK = 400           # SQLite bileşik SELECT sınırı (500) altında kalır
+
+def launch_products(db: Session, products: List[Dict], forecast_factor: float = DEFAULT_FORECAST_FACTOR,
+                    safety_stock: int = DEFAULT_SAFETY_STOCK) -> Dict:
+    """
+    products: [{"name", "category", "price", "cost", "reference_product_id" (opsiyonel)}, ...]
+
+    Yeni ürünleri, referans ürünlerden kopyalanan gelecek tahminlerini ve tüm
+    mağazalarda sıfır stoklu envanter satırlarını oluşturur.
+    Commit ETMEZ: Çağıran commit eder ve sonra olay yayınlar.
+    Dönüş: {"product_ids": [...], "store_ids": [...], "cloned_forecasts": n}
+    """
+    if not products:
+        return {"product_ids": [], "store_ids": [], "cloned_forecasts": 0}
+
+    # Referans ürünlerin ABC sınıfı (Tek sorgu). Bulunamayan referans yok sayılır.
+    reference_ids = {p["reference_product_id"] for p in products if p.get("reference_product_id")}
+    reference_abc = dict(
+        db.query(Product.id, Product.abc_category).filter(Product.id.in_(reference_ids)).all()
+    ) if reference_ids else {}
+
+    # 1. Ürünler (Yeni ürün başlangıçta C; referans varsa onun sınıfı)
+    rows = [
+        {
+            "name": p["name"],
+            "category": p["category"],
+            "price": p["price"],
+            "cost": p["cost"],
+            "abc_category": reference_abc.get(p.get("reference_product_id"), "C")
+        }
+        for p in products
+    ]
+    new_ids = list(db.execute(
+        insert(Product).returning(Product.id, sort_by_parameter_order=True), rows
+    ).scalars())
+
+    # 2. Referans tahminlerini sunucuda kopyala (Sadece bugün ve sonrası)
+    mapping = [
+        (new_id, p["reference_product_id"])
+        for new_id, p in zip(new_ids, products)
+        if p.get("reference_product_id") in reference_abc
+    ]
+    cloned = 0
+    today = datetime.date.today()
+    forecast_table = Forecast.__table__
+    for start in range(0, len(mapping), MAPPING_CHUNK):
+        chunk = mapping[start:start + MAPPING_CHUNK]
+        pairs = union_all(*[
+            select(literal(new_id).label("new_id"), literal(ref_id).label("ref_id"))
+            for new_id, ref_id in chunk
+        ]).subquery("launch_map")
+        source = select(
+            forecast_table.c.store_id,
+            pairs.c.new_id,
+            forecast_table.c.date,
+            forecast_table.c.predicted_quantity * forecast_factor,
+            forecast_table.c.model_name
+        ).join(pairs, pairs.c.ref_id == forecast_table.c.product_id).where(forecast_table.c.date >= today)
+        result = db.execute(forecast_table.insert().from_select(
+            ["store_id", "product_id", "date", "predicted_quantity", "model_name"], source
+        ))
+        cloned += max(result.rowcount or 0, 0)
+
+    # 3. Envanter: Tüm mağazalar x yeni ürünler, sıfır stok (Tek INSERT ... SELECT)
+    store_ids = [row[0] for row in db.query(Store.id).all()]
+    db.execute(Inventory.__table__.insert().from_select(
+        ["store_id", "product_id", "quantity", "safety_stock", "version"],
+        select(Store.id, Product.id, literal(0), literal(safety_stock), literal(1))
+        .select_from(Store).join(Product, Product.id.in_(new_ids))
+    ))
+
+    refresh_store_risk_summary(db, store_ids)
+    versions.bump_version(db, versions.INVENTORY, versions.FORECAST, versions.PRODUCTS)
+    return {"product_ids": new_ids, "store_ids": store_ids, "cloned_forecasts": cloned}
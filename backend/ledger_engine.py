@@ -0,0 +1,194 @@
+import datetime
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import func, and_, bindparam
+from sqlalchemy.orm import Session
+from models import Transfer, Product
+
+# ==========================================
+# 📒 TRANSFER DEFTERİ (LEDGER)
+# ==========================================
+# Onaylanan planlar ve gerçekleşen transferler "transfers" tablosuna yazılır.
+# [OPTIMIZASYON] Yazmalar satır satır ORM nesnesi yerine toplu INSERT (executemany),
+# durum geçişleri tek bir set-based UPDATE ile yapılır.
+
+PENDING = "Pending"
+APPROVED = "Approved"
+COMPLETED = "Completed"
+CANCELLED = "Cancelled"
+
+# İzin verilen geçişler: hedef_durum -> kaynak durumlar
+# Completed'a geçiş sadece stok hareketiyle (transfer endpoint'leri) yapılır.
+STATUS_TRANSITIONS = {
+    APPROVED: (PENDING,),
+    CANCELLED: (PENDING, APPROVED),
+}
+
+def record_transfers(db: Session, rows: Iterable[dict], status: str = COMPLETED, reason: Optional[str] = None) -> int:
+    """
+    Transfer satırlarını tek bir toplu INSERT ile deftere yazar.
+    rows: [{"source_store_id", "target_store_id", "product_id", "amount", (opsiyonel) "reason"}]
+
+    Commit ETMEZ: Stok hareketiyle aynı transaction içinde görünür olmalı.
+    """
+    now = datetime.datetime.utcnow()
+    params = [
+        {
+            "source_store_id": row["source_store_id"],
+            "target_store_id": row["target_store_id"],
+            "product_id": row["product_id"],
+            "amount": row["amount"],
+            "status": status,
+            "request_date": now,
+            "completed_at": now if status == COMPLETED else None,
+            "reason": row.get("reason", reason),
+        }
+        for row in rows
+    ]
+    if params:
+        db.execute(Transfer.__table__.insert(), params)
+    return len(params)
+
+def transition_status(db: Session, transfer_ids: List[int], new_status: str) -> int:
+    """
+    Verilen transferleri tek UPDATE ile yeni duruma taşır.
+    Sadece izin verilen kaynak durumdaki satırlar güncellenir (WHERE status IN ...).
+    Dönüş: Güncellenen satır sayısı. Commit ETMEZ.
+    """
+    if new_status not in STATUS_TRANSITIONS:
+        raise ValueError(f"Geçersiz durum geçişi: {new_status}")
+    if not transfer_ids:
+        return 0
+
+    table = Transfer.__table__
+    result = db.execute(
+        table.update()
+        .where(table.c.id.in_(transfer_ids), table.c.status.in_(STATUS_TRANSITIONS[new_status]))
+        .values(status=new_status)
+    )
+    return result.rowcount
+
+def complete_transfers(db: Session, lines: List[dict]) -> int:
+    """
+    Planlanan (Pending/Approved) transferleri stok hareketi uygulandığında
+    Completed'a taşır. Commit ETMEZ.
+    lines: [{"ledger_id", "source_store_id", "target_store_id", "product_id", "amount"}]
+
+    Defter satırı sadece gerçekten uygulanan hareketle (kaynak, hedef, ürün, miktar)
+    birebir eşleşiyorsa kapanır; aksi halde ilgisiz bir hareket planı kapatabilirdi.
+    Dönüş: Kapanan satır sayısı.
+    """
+    if not lines:
+        return 0
+    table = Transfer.__table__
+    result = db.execute(
+        table.update()
+        .where(
+            table.c.id == bindparam("b_id"),
+            table.c.source_store_id == bindparam("b_source"),
+            table.c.target_store_id == bindparam("b_target"),
+            table.c.product_id == bindparam("b_product"),
+            table.c.amount == bindparam("b_amount"),
+            table.c.status.in_((PENDING, APPROVED))
+        )
+        .values(status=COMPLETED, completed_at=datetime.datetime.utcnow()),
+        [
+            {
+                "b_id": line["ledger_id"],
+                "b_source": line["source_store_id"],
+                "b_target": line["target_store_id"],
+                "b_product": line["product_id"],
+                "b_amount": line["amount"],
+            }
+            for line in lines
+        ]
+    )
+    return result.rowcount
+
+def open_ledger_lines(db: Session, ledger_ids: Iterable[int]) -> Dict[int, tuple]:
+    """
+    İşlenmemiş (Pending/Approved) planlı transferler:
+    {ledger_id: (source_store_id, target_store_id, product_id, amount)}
+    """
+    ledger_ids = list(ledger_ids)
+    if not ledger_ids:
+        return {}
+    rows = db.query(
+        Transfer.id, Transfer.source_store_id, Transfer.target_store_id, Transfer.product_id, Transfer.amount
+    ).filter(Transfer.id.in_(ledger_ids), Transfer.status.in_((PENDING, APPROVED))).all()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+def open_planned_lanes(db: Session, lanes: Iterable[tuple]) -> Dict[tuple, int]:
+    """
+    Verilen (source_store_id, target_store_id, product_id) hatlarından açık
+    (Pending/Approved) planı olanlar: {hat: açık toplam miktar}. Tek GROUP BY.
+    """
+    lanes = set(lanes)
+    if not lanes:
+        return {}
+    product_ids = {lane[2] for lane in lanes}
+    rows = db.query(
+        Transfer.source_store_id, Transfer.target_store_id, Transfer.product_id, func.sum(Transfer.amount)
+    ).filter(Transfer.product_id.in_(product_ids), Transfer.status.in_((PENDING, APPROVED)))\
+        .group_by(Transfer.source_store_id, Transfer.target_store_id, Transfer.product_id).all()
+    return {tuple(row[:3]): row[3] or 0 for row in rows if tuple(row[:3]) in lanes}
+
+def query_ledger(db: Session, start_date: Optional[datetime.datetime] = None, end_date: Optional[datetime.datetime] = None,
+                 source_store_id: Optional[int] = None, target_store_id: Optional[int] = None,
+                 product_id: Optional[int] = None, status: Optional[str] = None,
+                 limit: int = 100, offset: int = 0) -> List[Dict]:
+    """
+    Defter kayıtlarını tarih, rota (kaynak→hedef) ve ürün bazlı filtreler.
+    Filtreler modeldeki bileşik index'lerin ön ekleriyle eşleşir.
+    """
+    query = db.query(
+        Transfer.id, Transfer.source_store_id, Transfer.target_store_id, Transfer.product_id,
+        Transfer.amount, Transfer.status, Transfer.request_date, Transfer.completed_at, Transfer.reason,
+        (Transfer.amount * Product.price).label("value")
+    ).join(Product, Product.id == Transfer.product_id)
+
+    if source_store_id is not None:
+        query = query.filter(Transfer.source_store_id == source_store_id)
+    if target_store_id is not None:
+        query = query.filter(Transfer.target_store_id == target_store_id)
+    if product_id is not None:
+        query = query.filter(Transfer.product_id == product_id)
+    if status is not None:
+        query = query.filter(Transfer.status == status)
+    if start_date is not None:
+        query = query.filter(Transfer.request_date >= start_date)
+    if end_date is not None:
+        query = query.filter(Transfer.request_date < end_date)
+
+    rows = query.order_by(Transfer.request_date.desc(), Transfer.id.desc()).offset(offset).limit(limit).all()
+    return [
+        {
+            "id": r.id,
+            "source_store_id": r.source_store_id,
+            "target_store_id": r.target_store_id,
+            "product_id": r.product_id,
+            "amount": r.amount,
+            "status": r.status,
+            "request_date": r.request_date,
+            "completed_at": r.completed_at,
+            "reason": r.reason,
+            "value": round(float(r.value or 0), 2),
+        }
+        for r in rows
+    ]
+
+def completed_transfer_value(db: Session, start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None) -> float:
+    """
+    Tamamlanan transferlerin toplam mal değeri (adet x fiyat).
+    Tek aggregate sorgu; (status, completed_at) index'ini kullanır.
+    """
+    conditions = [Transfer.status == COMPLETED]
+    if start is not None:
+        conditions.append(Transfer.completed_at >= start)
+    if end is not None:
+        conditions.append(Transfer.completed_at < end)
+
+    total = db.query(func.sum(Transfer.amount * Product.price))\
+        .join(Product, Product.id == Transfer.product_id)\
+        .filter(and_(*conditions))\
+        .scalar()
+    return float(total or 0)
@@ -1,10 +1,18 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, text
-from database import get_db, engine, Base
-from models import Store, Product, Customer, Sale, Forecast, Inventory, User
+from sqlalchemy import func, desc, text, bindparam
+from database import get_db, engine, Base, SessionLocal
+from models import Store, StoreType, Product, Customer, Sale, Forecast, Inventory, User
 from core.logger import logger
+from core import versions
+from core.concurrency import with_optimistic_retry, get_conflict_metrics
+from core.penalty_cache import RoutePenaltyCache
+from core.config import settings
+from core.events import bus
+import hashlib
+import json
+import asyncio
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
@@ -41,8 +49,8 @@ def seed_default_user():
 # Uygulama başlarken seed çalıştır
 seed_default_user()
 
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, model_validator
+from typing import List, Optional, Union
 import datetime
 from datetime import timedelta
 import pandas as pd
@@ -75,6 +83,8 @@ app.add_middleware(
     allow_headers=["*"], # Tüm başlıklara izin ver
 )
 
+from fastapi.responses import StreamingResponse
+
 # --- Pydantic Models ---
 class StoreSchema(BaseModel):
     id: int
@@ -104,14 +114,61 @@ class TransferRequest(BaseModel):
     target_store_id: int
     product_id: int # Şimdilik stok genel tutuluyor ama ürün bazlı transfer için parametre
     amount: int
+    ledger_id: Optional[int] = None # Defterdeki planlı transfer (varsa Completed'a taşınır)
+
+class BatchTransferRequest(BaseModel):
+    transfers: List[TransferRequest]
+
+class TransferPlanRequest(BaseModel):
+    transfer_ids: Optional[List[str]] = None # Boşsa güncel planın tamamı kaydedilir
+    reason: Optional[str] = "Stok Dengeleme"
+
+class TransferStatusUpdateRequest(BaseModel):
+    ids: List[int]
+    status: str
+
+class TransferLedgerSchema(BaseModel):
+    id: int
+    source_store_id: int
+    target_store_id: int
+    product_id: int
+    amount: int
+    status: str
+    request_date: datetime.datetime
+    completed_at: Optional[datetime.datetime] = None
+    reason: Optional[str] = None
+    value: float
 
 class AnalyticsResponse(BaseModel):
     total_revenue: float
     top_selling_product: str
     total_transactions: int
 
-from risk_engine import analyze_store_risk, get_risk_report
-from transfer_engine import generate_transfer_recommendations
+from risk_engine import (
+    analyze_store_risk,
+    get_risk_report,
+    refresh_store_risk_summary,
+    get_cover_risk_report,
+    get_cover_snapshot,
+    top_cover_risks,
+    cover_row,
+    RISK_MODES,
+    COVER_HORIZON_DAYS
+)
+from transfer_engine import (
+    plan_transfer_matches,
+    build_recommendation,
+    build_explanation,
+    match_for_target,
+    parse_recommendation_id,
+    iter_transfer_recommendations,
+    load_planning_snapshot,
+    product_scope,
+    hub_catchment,
+    REGION_MODES,
+    RECOMMENDATION_VIEWS,
+    TransferPlanner
+)
 from simulation_engine import (
     simulate_sales_boom, 
     simulate_recession, 
@@ -119,8 +176,27 @@ from simulation_engine import (
     reset_database,
     simulate_custom_scenario
 )
-from analysis_engine import calculate_abc_analysis, simulate_what_if, calculate_forecast_accuracy
+from analysis_engine import (
+    calculate_abc_analysis, simulate_what_if, simulate_what_if_batch, calculate_forecast_accuracy, get_abc_xyz_matrix,
+    ABC_MODES, ABC_XYZ_LEVELS
+)
 from cold_start_engine import analyze_cold_start
+from store_similarity_engine import store_similarity
+from launch_engine import launch_products, DEFAULT_FORECAST_FACTOR
+from sandbox_engine import run_sandbox, sweep_custom_scenario, SANDBOX_SCENARIOS, PRICE_ELASTICITY, MAX_SWEEP_POINTS
+from monte_carlo_engine import run_monte_carlo, MAX_PATHS, DEFAULT_PATHS
+from supply_chain_engine import run_supply_chain, MAX_SIMULATION_DAYS
+import ledger_engine
+from alert_engine import publish_inventory_change
+from risk_history_engine import (
+    take_risk_snapshot,
+    snapshot_max_gap,
+    query_risk_history,
+    start_risk_snapshotter,
+    stop_risk_snapshotter,
+    HISTORY_SCOPES,
+    HISTORY_BUCKETS
+)
 
 class SaleSchema(BaseModel):
     id: int
@@ -156,6 +232,17 @@ class TransferRecommendationSchema(BaseModel):
     xai_explanation: XaiExplanationSchema
     algorithm: str
 
+class CompactTransferRecommendationSchema(BaseModel):
+    transfer_id: str
+    source_id: int
+    target_id: int
+    product_id: int
+    amount: int
+    score: int
+
+class TransferExplanationSchema(CompactTransferRecommendationSchema):
+    xai_explanation: XaiExplanationSchema
+
 # --- API Endpoints ---
 
 # --- User Schemas ---
@@ -240,20 +327,26 @@ def read_sales(request: Request, skip: int = 0, limit: int = 100, db: Session =
     return results
 
 @app.get("/stores", response_model=List[StoreSchema])
-def read_stores(db: Session = Depends(get_db)):
+def read_stores(risk_mode: str = "ratio", db: Session = Depends(get_db)):
     """
     🏪 MAĞAZA LİSTESİ VE DURUM ANALİZİ
     
     Sistemdeki tüm mağazaları, konumlarını ve risk durumlarını döner.
-    Risk durumu (analyze_store_risk) her istekte anlık hesaplanır.
+    risk_mode=ratio -> Envanter yazmalarında güncellenen store_risk_summary tablosundan okunur.
+    risk_mode=cover -> Tahmin bazlı stokta kalma süresine (days-of-cover) göre hesaplanır.
     """
+    if risk_mode not in RISK_MODES:
+        raise HTTPException(status_code=400, detail=f"Geçersiz risk_mode. Seçenekler: {', '.join(RISK_MODES)}")
+
     stores = db.query(Store).all()
     
-    # [OPTIMIZASYON] Risk raporunu tek seferde çek (Bulk SQL)
-    # Eski yöntem döngü içinde database'e gidiyordu (N+1).
-    # Şimdi risk_engine.get_risk_report ile toplu çekiyoruz.
-    from risk_engine import get_risk_report
-    risk_report = get_risk_report(db, stores)
+    # [OPTIMIZASYON] Risk raporu materialized özetten okunur (O(mağaza))
+    # Eski yöntem döngü içinde database'e gidiyordu (N+1), sonra her istekte
+    # tüm envanteri GROUP BY ile tarıyordu.
+    if risk_mode == "cover":
+        risk_report = get_cover_risk_report(db, stores)
+    else:
+        risk_report = get_risk_report(db, stores)
     
     # Raporu ID ile eşleştir
     risk_map = {r["store_id"]: r for r in risk_report}
@@ -324,19 +417,260 @@ def get_store_inventory(store_id: int, db: Session = Depends(get_db)):
         })
     return results
 
-@app.get("/api/transfers/recommendations", response_model=List[TransferRecommendationSchema])
-def get_transfer_recommendations(db: Session = Depends(get_db)):
+# --- Transfer Önerisi Cache'i ---
+# Öneriler sadece envanter, tahmin, ceza puanı veya ürün (ABC) değiştiğinde değişir.
+# Anahtar: Bu veri alanlarının versiyon token'ları + istek parametreleri.
+# Global plan artımlı planlayıcıda tutulur; bölgesel planlar bu sözlükte cache'lenir.
+# Eşleşmeler de saklanır: Kompakt listedeki bir kartın açıklaması aynı plandan üretilir.
+# { cache_key: {"etag": str, "data": [...], "matches": {product_id: [match, ...]}} }
+_transfer_planner = TransferPlanner(max_truck_capacity=50)
+_recommendation_cache = {}
+RECOMMENDATION_CACHE_MAX_ENTRIES = 16
+RECOMMENDATION_INPUTS = (versions.INVENTORY, versions.FORECAST, versions.ROUTE_PENALTIES, versions.PRODUCTS)
+# Rota cezaları süreç içinde matris olarak tutulur (reject_transfer write-through yazar)
+_penalty_cache = RoutePenaltyCache()
+PENALTY_DECAY_KEY = "penalty_decay"
+
+def _recommendation_versions(db: Session) -> dict:
+    """Planın girdi versiyonları + ceza azalma günü (Gün değişince plan yenilenir)."""
+    current_versions = versions.get_versions(db, RECOMMENDATION_INPUTS)
+    current_versions[PENALTY_DECAY_KEY] = str(_penalty_cache.decay_epoch())
+    return current_versions
+
+ABC_CLASSES = ("A", "B", "C")
+
+def _scoped_stores(db: Session, store_ids: Optional[List[int]], hub_id: Optional[int]) -> List[Store]:
+    """Kapsamlı planlama için mağaza dilimi (store_ids ve/veya HUB etki alanı)."""
+    query = db.query(Store)
+    if store_ids and hub_id is None:
+        query = query.filter(Store.id.in_(store_ids))
+    stores = query.all()
+
+    if hub_id is not None:
+        # Etki alanı tüm ağa göre hesaplanır (en yakın HUB), sonra store_ids ile kesişir
+        if not any(s.id == hub_id and s.store_type == StoreType.HUB for s in stores):
+            raise HTTPException(status_code=404, detail="HUB bulunamadı")
+        stores = hub_catchment(stores, hub_id)
+        if store_ids:
+            wanted = set(store_ids)
+            stores = [s for s in stores if s.id in wanted]
+    return stores
+
+def _ensure_planner_current(db: Session, current_versions: dict, refresh: bool = False):
+    if refresh or not _transfer_planner.is_current(current_versions):
+        stores = db.query(Store).all()
+        _transfer_planner.rebuild(db, stores, current_versions, penalty_map=_penalty_cache.penalty_map(db))
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag in candidates or "*" in candidates
+
+@app.get("/api/transfers/recommendations", response_model=Union[List[TransferRecommendationSchema], List[CompactTransferRecommendationSchema]])
+def get_transfer_recommendations(request: Request, response: Response, region_mode: Optional[str] = None, n_regions: Optional[int] = None, refresh: bool = False, view: str = "full",
+                                 store_ids: Optional[List[int]] = Query(None), hub_id: Optional[int] = None,
+                                 product_ids: Optional[List[int]] = Query(None), category: Optional[str] = None, abc_class: Optional[str] = None,
+                                 db: Session = Depends(get_db)):
     """
     🚚 TRANSFER ÖNERİLERİ (ROBIN HOOD)
     
     Fazla stoğu olan mağazalardan (Zengin), stoğu tükenen mağazalara (Fakir)
     yapılabilecek transferleri hesaplar. Coğrafi yakınlığı dikkate alır.
+
+    region_mode=hub     -> HUB etki alanlarına göre bölgesel (paralel) planlama
+    region_mode=cluster -> lat/lon kümeleme ile bölgesel planlama (n_regions opsiyonel)
+
+    [OPTIMIZASYON] Sonuç, girdi versiyonlarına göre cache'lenir ve ETag ile döner.
+    İstemci If-None-Match gönderirse ve veri değişmediyse 304 döner (gövdesiz).
+    Global plan, transfer/red işlemlerinde artımlı güncellenir; refresh=true tam plan yaptırır.
+
+    view=compact -> Sadece id, miktar ve skor döner (XAI metinleri yok, yanıt birkaç kat küçük).
+    Açıklama, kart açıldığında /api/transfers/recommendations/{transfer_id}/explanation ile alınır.
+
+    Kapsamlı (scoped) planlama: store_ids, hub_id (HUB etki alanı), product_ids, category, abc_class.
+    Filtreler envanter ve tahmin sorgularına gömülür; sadece ilgili dilim planlanır.
+    Transferler dilimin içinde kalır (kaynak ve hedef dilimdeki mağazalardır).
     """
-    stores = db.query(Store).all()
-    # Tüm mağazalar için proaktif analiz yapalım
-    recommendations = generate_transfer_recommendations(db, stores) 
+    if region_mode and region_mode not in REGION_MODES:
+        raise HTTPException(status_code=400, detail=f"Geçersiz region_mode. Seçenekler: {', '.join(REGION_MODES)}")
+    if view not in RECOMMENDATION_VIEWS:
+        raise HTTPException(status_code=400, detail=f"Geçersiz view. Seçenekler: {', '.join(RECOMMENDATION_VIEWS)}")
+    if abc_class and abc_class not in ABC_CLASSES:
+        raise HTTPException(status_code=400, detail=f"Geçersiz abc_class. Seçenekler: {', '.join(ABC_CLASSES)}")
+
+    scope = (
+        tuple(sorted(set(store_ids))) if store_ids else None,
+        hub_id,
+        tuple(sorted(set(product_ids))) if product_ids else None,
+        category,
+        abc_class
+    )
+    scoped = any(part is not None for part in scope)
+
+    current_versions = _recommendation_versions(db)
+    cache_key = tuple(current_versions.values()) + (region_mode, n_regions, view) + scope
+    etag = '"' + hashlib.md5(repr(cache_key).encode('utf-8')).hexdigest() + '"'
+
+    # Tarayıcı HTTP cache'i her istekte ETag ile yeniden doğrulasın
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+    if not region_mode and not scoped:
+        _ensure_planner_current(db, current_versions, refresh)
+        return _transfer_planner.recommendations(view)
+
+    cached = _recommendation_cache.get(cache_key)
+    if cached and not refresh:
+        return cached["data"]
+
+    stores = _scoped_stores(db, store_ids, hub_id) if scoped else db.query(Store).all()
+    matches = plan_transfer_matches(db, stores, region_mode=region_mode, n_regions=n_regions,
+                                    penalty_map=_penalty_cache.penalty_map(db),
+                                    products=product_scope(product_ids, category, abc_class))
+    recommendations = [build_recommendation(match, view) for match in matches]
+    matches_by_product = {}
+    for match in matches:
+        matches_by_product.setdefault(match["receiver"]["product_id"], []).append(match)
+
+    # En eski girdiyi at (Bellek sınırı)
+    if len(_recommendation_cache) >= RECOMMENDATION_CACHE_MAX_ENTRIES:
+        _recommendation_cache.pop(next(iter(_recommendation_cache)))
+    _recommendation_cache[cache_key] = {"etag": etag, "data": recommendations, "matches": matches_by_product}
     return recommendations
 
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream"
+}
+
+def _format_stream_event(payload: dict, stream_format: str, event: str = "recommendation") -> str:
+    body = json.dumps(payload, ensure_ascii=False, default=str)
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {body}\n\n"
+    return body + "\n"
+
+@app.get("/api/transfers/recommendations/stream")
+def stream_transfer_recommendations(format: str = "ndjson", view: str = "full", db: Session = Depends(get_db)):
+    """
+    📡 TRANSFER ÖNERİLERİ (AKIŞ / STREAMING)
+
+    Öneriler öncelik sırasıyla (A grubu ve en acil önce) NDJSON veya
+    Server-Sent Events olarak akıtılır. Planlama sürerken ilk kartlar
+    istemciye ulaşır; büyük ağlarda tüm planı beklemek gerekmez.
+
+    format=ndjson -> Her satır bir öneri (application/x-ndjson)
+    format=sse    -> event: recommendation / event: done (text/event-stream)
+    """
+    if format not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Geçersiz format. Seçenekler: {', '.join(STREAM_FORMATS)}")
+    if view not in RECOMMENDATION_VIEWS:
+        raise HTTPException(status_code=400, detail=f"Geçersiz view. Seçenekler: {', '.join(RECOMMENDATION_VIEWS)}")
+
+    current_versions = _recommendation_versions(db)
+    if _transfer_planner.is_current(current_versions):
+        # Plan zaten hazır: Bellekten akıt
+        recommendations = iter(_transfer_planner.recommendations(view))
+    else:
+        # Veri, yanıt başlamadan (DB oturumu açıkken) yüklenir; akış sadece CPU işidir
+        stores = db.query(Store).all()
+        snapshot = load_planning_snapshot(db, stores)
+        penalty_map = _penalty_cache.penalty_map(db)
+        recommendations = iter_transfer_recommendations(snapshot, penalty_map, _transfer_planner.max_truck_capacity, view)
+
+    def event_stream():
+        count = 0
+        for rec in recommendations:
+            count += 1
+            yield _format_stream_event(rec, format)
+        if format == "sse":
+            yield _format_stream_event({"count": count}, format, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type=STREAM_FORMATS[format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+EVENT_KEEPALIVE_SECONDS = 15
+
+@app.get("/api/events/stream")
+async def stream_events(request: Request):
+    """
+    📣 ANLIK OLAY AKIŞI (SSE)
+
+    Olay tipleri:
+    - inventory  -> Değişen mağaza/ürün satırları (delta)
+    - store_risk -> Etkilenen mağazanın güncel risk özeti
+    - alert      -> Risk durumu değişimi veya kritik stok
+    Yeniden bağlanan istemci Last-Event-ID ile kaçırdığı olayları alır.
+    Değişiklik olmadığında sadece keepalive yorumu gönderilir (DB okuması yok).
+    """
+    last_event_id = request.headers.get("last-event-id")
+    queue = bus.subscribe(int(last_event_id) if last_event_id and last_event_id.isdigit() else None)
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=EVENT_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+        finally:
+            bus.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/transfers/recommendations/{transfer_id}/explanation", response_model=TransferExplanationSchema)
+def get_transfer_explanation(transfer_id: str, db: Session = Depends(get_db)):
+    """
+    💡 TEK ÖNERİNİN XAI AÇIKLAMASI (LAZY)
+
+    Kompakt listede olmayan açıklama metinlerini, bellekteki plan durumundan
+    sadece istenen kart için üretir. Plan bayatsa önce tam plan yapılır.
+
+    transfer_id kararlı anahtardır (TRF-{kaynak}-{hedef}-{ürün}): Önce global plana,
+    sonra güncel versiyonlardaki bölgesel/kapsamlı planlara bakılır.
+    Kart artık planda yoksa 404, hedef/ürün başka kaynaktan besleniyorsa 409 döner.
+    """
+    key = parse_recommendation_id(transfer_id)
+    if key is None:
+        raise HTTPException(status_code=404, detail="Öneri bulunamadı")
+    source_id, target_id, product_id = key
+
+    current_versions = _recommendation_versions(db)
+    _ensure_planner_current(db, current_versions)
+
+    match, same_source = _transfer_planner.find_match(source_id, target_id, product_id)
+    changed = match is not None and not same_source
+    if not same_source:
+        prefix = tuple(current_versions.values())
+        for cache_key, cached in list(_recommendation_cache.items()):
+            if cache_key[:len(prefix)] != prefix:
+                continue # Bayat plan
+            match, same_source = match_for_target(cached["matches"].get(product_id, []), source_id, target_id)
+            if same_source:
+                break
+            changed = changed or match is not None
+
+    if same_source:
+        return build_explanation(match)
+    if changed:
+        raise HTTPException(status_code=409, detail="Öneri değişti: Bu ürün artık başka bir kaynaktan planlanıyor")
+    raise HTTPException(status_code=404, detail="Öneri bulunamadı (Plan güncellenmiş olabilir)")
+
 @app.post("/api/transfer")
 @limiter.limit("30/minute") # Transfer işlemi kritik
 def transfer_stock(transfer_req: TransferRequest, request: Request, db: Session = Depends(get_db)):
@@ -346,41 +680,273 @@ def transfer_stock(transfer_req: TransferRequest, request: Request, db: Session
     İki mağaza arasında stok transferini veritabanında uygular.
     Kaynak stok düşer, hedef stok artar.
     """
-    # 1. Kaynak ve Hedef mağazayı bul
-    source = db.query(Store).filter(Store.id == transfer_req.source_store_id).first()
-    target = db.query(Store).filter(Store.id == transfer_req.target_store_id).first()
+    def apply_transfer():
+        # 1. Kaynak ve Hedef mağazayı bul
+        source = db.query(Store).filter(Store.id == transfer_req.source_store_id).first()
+        target = db.query(Store).filter(Store.id == transfer_req.target_store_id).first()
     
-    if not source or not target:
-        raise HTTPException(status_code=404, detail="Mağaza bulunamadı")
+        if not source or not target:
+            raise HTTPException(status_code=404, detail="Mağaza bulunamadı")
         
-    # 2. Ürün bazlı stok kontrolü
-    if transfer_req.product_id:
-        source_item = db.query(Inventory).filter(Inventory.store_id == source.id, Inventory.product_id == transfer_req.product_id).first()
-        target_item = db.query(Inventory).filter(Inventory.store_id == target.id, Inventory.product_id == transfer_req.product_id).first()
+        # 2. Ürün bazlı stok kontrolü
+        if transfer_req.product_id:
+            source_item = db.query(Inventory).filter(Inventory.store_id == source.id, Inventory.product_id == transfer_req.product_id).first()
+            target_item = db.query(Inventory).filter(Inventory.store_id == target.id, Inventory.product_id == transfer_req.product_id).first()
         
-        if not source_item:
-             raise HTTPException(status_code=400, detail="Kaynak mağazada bu ürün yok")
+            if not source_item:
+                 raise HTTPException(status_code=400, detail="Kaynak mağazada bu ürün yok")
              
-        if not target_item:
-            # Hedefte ürün yoksa oluştur (Sıfır stokla)
-            target_item = Inventory(store_id=target.id, product_id=transfer_req.product_id, quantity=0, safety_stock=10) # safety default
-            db.add(target_item)
+            if not target_item:
+                # Hedefte ürün yoksa oluştur (Sıfır stokla)
+                target_item = Inventory(store_id=target.id, product_id=transfer_req.product_id, quantity=0, safety_stock=10) # safety default
+                db.add(target_item)
             
-        if source_item.quantity < transfer_req.amount:
-            raise HTTPException(status_code=400, detail=f"Kaynak mağazada yetersiz stok (Mevcut: {source_item.quantity})")
+            if source_item.quantity < transfer_req.amount:
+                raise HTTPException(status_code=400, detail=f"Kaynak mağazada yetersiz stok (Mevcut: {source_item.quantity})")
             
-        source_item.quantity -= transfer_req.amount
-        target_item.quantity += transfer_req.amount
+            source_item.quantity -= transfer_req.amount
+            target_item.quantity += transfer_req.amount
+            inventory_changes = [
+                (source.id, transfer_req.product_id, source_item.quantity),
+                (target.id, transfer_req.product_id, target_item.quantity)
+            ]
         
-        product_name = source_item.product.name
-        msg = f"{source.name} şubesinden {target.name} şubesine {transfer_req.amount} adet {product_name} transfer edildi."
+            product_name = source_item.product.name
+            msg = f"{source.name} şubesinden {target.name} şubesine {transfer_req.amount} adet {product_name} transfer edildi."
 
-    else:
-        raise HTTPException(status_code=400, detail="Transfer için product_id zorunludur.")
-    
-    db.commit()
+        else:
+            raise HTTPException(status_code=400, detail="Transfer için product_id zorunludur.")
+
+        # Deftere yaz: Planlı transfer ise durumunu kapat, değilse yeni kayıt aç
+        if transfer_req.ledger_id is not None:
+            if ledger_engine.complete_transfers(db, [transfer_req.model_dump()]) == 0:
+                raise HTTPException(status_code=409, detail="Planlı transfer bulunamadı, zaten işlenmiş veya bu hareketle eşleşmiyor")
+        else:
+            ledger_engine.record_transfers(db, [transfer_req.model_dump(exclude={"ledger_id"})], reason="Manuel Transfer")
+
+        refresh_store_risk_summary(db, [source.id, target.id])
+        transitions = versions.bump_version(db, versions.INVENTORY)
+        db.commit()
+        return msg, inventory_changes, transitions
+
+    # Okuma-değiştirme-yazma: Çakışmada (başka worker aynı satırı güncellediyse) baştan dene
+    msg, inventory_changes, transitions = with_optimistic_retry(db, apply_transfer)
+
+    # Planlayıcıya sadece değişen stokları bildir (Tüm ağ yeniden planlanmaz)
+    _transfer_planner.apply_inventory_delta(inventory_changes, transitions)
+    publish_inventory_change(db, inventory_changes, source="transfer")
     return {"message": msg}
 
+@app.post("/api/transfers/batch")
+@limiter.limit("10/minute")
+def transfer_stock_batch(batch_req: BatchTransferRequest, request: Request, db: Session = Depends(get_db)):
+    """
+    ⚡ TOPLU TRANSFER (BATCH)
+
+    Bir planın tüm satırlarını tek istekte ve tek transaction'da uygular.
+    - Tüm satırlar tek envanter sorgusuyla doğrulanır.
+    - Stoklar set-based UPDATE (quantity = quantity + delta) ile güncellenir.
+    - Hedefte olmayan envanter satırları toplu INSERT ile açılır.
+    Her satır için ayrı sonuç döner; hatalı satırlar diğerlerini engellemez.
+    """
+    lines = batch_req.transfers
+    if not lines:
+        raise HTTPException(status_code=400, detail="Transfer listesi boş")
+
+    # Versiyon satırını en başta kilitle: Aynı anda çalışan yazmalar sıraya girer,
+    # aşağıda okunan stoklar commit anına kadar geçerli kalır.
+    transitions = versions.bump_version(db, versions.INVENTORY)
+
+    store_ids = {l.source_store_id for l in lines} | {l.target_store_id for l in lines}
+    product_ids = {l.product_id for l in lines}
+
+    stores = {row[0]: row[1] for row in db.query(Store.id, Store.name).filter(Store.id.in_(store_ids)).all()}
+    products = {row[0]: row[1] for row in db.query(Product.id, Product.name).filter(Product.id.in_(product_ids)).all()}
+
+    # Tek envanter sorgusu (Gerekli mağaza x ürün kümesi)
+    inventory_rows = db.query(Inventory.id, Inventory.store_id, Inventory.product_id, Inventory.quantity).filter(
+        Inventory.store_id.in_(store_ids),
+        Inventory.product_id.in_(product_ids)
+    ).all()
+    inventory = {(row[1], row[2]): {"id": row[0], "quantity": row[3]} for row in inventory_rows}
+
+    # Satırlarda referans verilen planlı transferler (Henüz işlenmemiş olanlar)
+    open_ledger = ledger_engine.open_ledger_lines(db, {l.ledger_id for l in lines if l.ledger_id is not None})
+
+    # Satırları bellekte sırayla doğrula (Aynı kaynağa düşen satırlar birbirini görür)
+    quantities = {key: item["quantity"] for key, item in inventory.items()}
+    deltas = {}
+    results = []
+    completed_ledger_lines = []
+    new_ledger_rows = []
+    for idx, line in enumerate(lines):
+        source_key = (line.source_store_id, line.product_id)
+        target_key = (line.target_store_id, line.product_id)
+
+        error = None
+        if line.source_store_id not in stores or line.target_store_id not in stores:
+            error = "Mağaza bulunamadı"
+        elif line.product_id not in products:
+            error = "Ürün bulunamadı"
+        elif line.amount <= 0:
+            error = "Transfer miktarı pozitif olmalı"
+        elif line.source_store_id == line.target_store_id:
+            error = "Kaynak ve hedef aynı olamaz"
+        elif source_key not in quantities:
+            error = "Kaynak mağazada bu ürün yok"
+        elif quantities[source_key] < line.amount:
+            error = f"Kaynak mağazada yetersiz stok (Mevcut: {quantities[source_key]})"
+        elif line.ledger_id is not None and line.ledger_id not in open_ledger:
+            error = "Planlı transfer bulunamadı veya zaten işlenmiş"
+        elif line.ledger_id is not None and open_ledger[line.ledger_id] != (line.source_store_id, line.target_store_id, line.product_id, line.amount):
+            error = "Planlı transfer bu satırla eşleşmiyor (kaynak, hedef, ürün veya miktar farklı)"
+
+        if error:
+            results.append({"index": idx, "status": "error", "detail": error})
+            continue
+
+        quantities[source_key] -= line.amount
+        quantities[target_key] = quantities.get(target_key, 0) + line.amount
+        deltas[source_key] = deltas.get(source_key, 0) - line.amount
+        deltas[target_key] = deltas.get(target_key, 0) + line.amount
+        if line.ledger_id is not None:
+            del open_ledger[line.ledger_id] # Aynı plan satırı iki kez işlenmesin
+            completed_ledger_lines.append(line.model_dump())
+        else:
+            new_ledger_rows.append(line.model_dump(exclude={"ledger_id"}))
+
+        results.append({
+            "index": idx,
+            "status": "ok",
+            "message": f"{stores[line.source_store_id]} şubesinden {stores[line.target_store_id]} şubesine {line.amount} adet {products[line.product_id]} transfer edildi."
+        })
+
+    applied = sum(1 for r in results if r["status"] == "ok")
+    if applied == 0:
+        db.rollback()
+        return {"applied": 0, "failed": len(results), "results": results}
+
+    inventory_table = Inventory.__table__
+    update_params = [
+        {"b_id": inventory[key]["id"], "b_delta": delta}
+        for key, delta in deltas.items() if key in inventory and delta != 0
+    ]
+    insert_params = [
+        {"store_id": key[0], "product_id": key[1], "quantity": delta, "safety_stock": 10} # safety default
+        for key, delta in deltas.items() if key not in inventory
+    ]
+
+    # Set-based UPDATE (executemany): Göreli güncelleme, okunan değeri geri yazmaz
+    if update_params:
+        db.execute(
+            inventory_table.update()
+            .where(inventory_table.c.id == bindparam("b_id"))
+            .values(
+                quantity=inventory_table.c.quantity + bindparam("b_delta"),
+                version=inventory_table.c.version + 1 # ORM yazanlar bu değişikliği çakışma olarak görsün
+            ),
+            update_params
+        )
+    # Hedefte olmayan satırlar: Toplu INSERT
+    if insert_params:
+        db.execute(inventory_table.insert(), insert_params)
+
+    # Defter: Planlı satırlar tek UPDATE ile kapanır, diğerleri toplu INSERT ile yazılır
+    ledger_engine.complete_transfers(db, completed_ledger_lines)
+    ledger_engine.record_transfers(db, new_ledger_rows, reason="Toplu Transfer")
+
+    refresh_store_risk_summary(db, {key[0] for key in deltas})
+    db.commit()
+
+    batch_changes = [(key[0], key[1], quantities[key]) for key in deltas]
+    _transfer_planner.apply_inventory_delta(batch_changes, transitions)
+    publish_inventory_change(db, batch_changes, source="batch_transfer")
+    return {"applied": applied, "failed": len(results) - applied, "results": results}
+
+@app.get("/api/metrics/inventory-conflicts")
+def read_inventory_conflict_metrics():
+    """
+    📈 ENVANTER YAZMA ÇAKIŞMA METRİKLERİ
+
+    İyimser kilit (version kolonu) ile yakalanan çakışma ve tekrar deneme sayıları.
+    Sayaçlar süreç (worker) bazındadır.
+    """
+    return get_conflict_metrics()
+
+@app.post("/api/transfers/plan")
+@limiter.limit("10/minute")
+def persist_transfer_plan(plan_req: TransferPlanRequest, request: Request, db: Session = Depends(get_db)):
+    """
+    📒 PLANI DEFTERE KAYDET
+
+    Güncel transfer önerilerini (veya seçilen transfer_id'leri) "Pending" olarak
+    transfers tablosuna tek bir toplu INSERT ile yazar. Stok hareketi yapılmaz;
+    uygulama, ledger_id ile /api/transfer veya /api/transfers/batch üzerinden yapılır.
+    Açık planı olan (kaynak, hedef, ürün) hatları atlanır ("skipped").
+    """
+    _ensure_planner_current(db, _recommendation_versions(db))
+
+    recommendations = _transfer_planner.recommendations("compact")
+    if plan_req.transfer_ids is not None:
+        selected = set(plan_req.transfer_ids)
+        recommendations = [r for r in recommendations if r["transfer_id"] in selected]
+        missing = selected - {r["transfer_id"] for r in recommendations}
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Öneri bulunamadı (Plan güncellenmiş olabilir): {', '.join(sorted(missing))}")
+
+    # İdempotent: Planlayıcı açık defter satırlarını görmez, aynı hareketleri tekrar önerir.
+    # Açık (Pending/Approved) planı olan hatlar tekrar yazılmaz.
+    open_lanes = ledger_engine.open_planned_lanes(
+        db, [(r["source_id"], r["target_id"], r["product_id"]) for r in recommendations]
+    )
+    new_lines = [r for r in recommendations if (r["source_id"], r["target_id"], r["product_id"]) not in open_lanes]
+
+    recorded = ledger_engine.record_transfers(db, [
+        {
+            "source_store_id": r["source_id"],
+            "target_store_id": r["target_id"],
+            "product_id": r["product_id"],
+            "amount": r["amount"],
+        }
+        for r in new_lines
+    ], status=ledger_engine.PENDING, reason=plan_req.reason)
+    db.commit()
+    return {"recorded": recorded, "skipped": len(recommendations) - len(new_lines)}
+
+@app.patch("/api/transfers/ledger/status")
+def update_transfer_status(update_req: TransferStatusUpdateRequest, db: Session = Depends(get_db)):
+    """
+    🔁 TOPLU DURUM GEÇİŞİ
+
+    Pending -> Approved, Pending/Approved -> Cancelled geçişlerini tek UPDATE ile yapar.
+    Completed durumuna sadece stok hareketi uygulanınca geçilir.
+    """
+    if update_req.status not in ledger_engine.STATUS_TRANSITIONS:
+        raise HTTPException(status_code=400, detail=f"Geçersiz durum. Seçenekler: {', '.join(ledger_engine.STATUS_TRANSITIONS)}")
+
+    updated = ledger_engine.transition_status(db, update_req.ids, update_req.status)
+    db.commit()
+    return {"updated": updated, "skipped": len(set(update_req.ids)) - updated}
+
+@app.get("/api/transfers/ledger", response_model=List[TransferLedgerSchema])
+def read_transfer_ledger(start_date: Optional[datetime.date] = None, end_date: Optional[datetime.date] = None,
+                         source_store_id: Optional[int] = None, target_store_id: Optional[int] = None,
+                         product_id: Optional[int] = None, status: Optional[str] = None,
+                         limit: int = 100, offset: int = 0, db: Session = Depends(get_db)):
+    """
+    📒 TRANSFER DEFTERİ
+
+    Tarih aralığı (end_date dahil), rota (kaynak/hedef) ve ürün bazlı filtreleme.
+    """
+    start = datetime.datetime.combine(start_date, datetime.time.min) if start_date else None
+    end = datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min) if end_date else None
+    return ledger_engine.query_ledger(
+        db, start_date=start, end_date=end,
+        source_store_id=source_store_id, target_store_id=target_store_id,
+        product_id=product_id, status=status,
+        limit=min(limit, 1000), offset=offset
+    )
+
 @app.get("/api/sales/analytics", response_model=AnalyticsResponse)
 def get_analytics(db: Session = Depends(get_db)):
     """
@@ -414,39 +980,24 @@ def get_analytics(db: Session = Depends(get_db)):
         "total_transactions": total_transactions
     }
 
-from transfer_engine import calculate_distance
-
-def get_proxy_sales_data(db: Session, target_store: Store, product_id: int):
+def get_proxy_sales_data(db: Session, target_store: Store, product_id: int, min_rows: int = 1,
+                         check: bool = True):
     """
     Cold Start Çözümü: Geçmiş verisi olmayan mağaza için 
-    coğrafi ve tip bazlı en yakın (k-NN) mağazanın verisini proxy olarak çeker.
+    özellik ve konum bazlı en benzer (k-NN) mağazanın verisini proxy olarak çeker.
+
+    [OPTIMIZASYON] Proxy mağaza, mağaza benzerlik servisinin önceden sıralanmış
+    komşu listesi ve (mağaza, ürün) bulunurluk bitmap'inden seçilir.
+    check=False ile sorgusuzdur: Seri döngüsü öncesinde store_similarity.ensure_current
+    bir kez çağrılmalıdır. Tek sorgu: Seçilen mağazanın satış serisi.
     """
-    # Aynı tipteki diğer mağazaları bul
-    other_stores = db.query(Store).filter(
-        Store.id != target_store.id,
-        Store.store_type == target_store.store_type
-    ).all()
-    
-    best_proxy = None
-    min_dist = float('inf')
-    
-    for s in other_stores:
-        # Bu mağazanın bu ürün için verisi var mı?
-        has_data = db.query(Sale).filter(Sale.store_id == s.id, Sale.product_id == product_id).first()
-        if not has_data:
-            continue
-            
-        dist = calculate_distance(target_store.lat, target_store.lon, s.lat, s.lon)
-        if dist < min_dist:
-            min_dist = dist
-            best_proxy = s
-            
-    if best_proxy:
-        return db.query(Sale.date, Sale.quantity)\
-            .filter(Sale.store_id == best_proxy.id, Sale.product_id == product_id)\
-            .order_by(Sale.date)\
-            .all()
-    return []
+    proxy_store_id = store_similarity.proxy_store(db, target_store.id, product_id, min_rows=min_rows, check=check)
+    if proxy_store_id is None:
+        return []
+    return db.query(Sale.date, Sale.quantity)\
+        .filter(Sale.store_id == proxy_store_id, Sale.product_id == product_id)\
+        .order_by(Sale.date)\
+        .all()
 
 @app.post("/api/forecast/generate")
 @limiter.limit("5/minute") # Çok ağır işlem (CPU Intensive)
@@ -459,6 +1010,7 @@ def generate_forecasts(request: Request, db: Session = Depends(get_db)):
     """
     # Önce eski tahminleri temizle
     db.query(Forecast).delete()
+    versions.bump_version(db, versions.FORECAST)
     db.commit()
     
     # 1. Tüm satış verisini tek sorguda DataFrame'e çek (RAM Dostu: Sadece gerekli kolonlar)
@@ -527,7 +1079,10 @@ def generate_forecasts(request: Request, db: Session = Depends(get_db)):
     # Kalanları yaz
     if forecasts_buffer:
         db.bulk_insert_mappings(Forecast, forecasts_buffer)
-        db.commit()
+
+    # Yeni tahmin koşusu tamamlandı -> Tahmine bağlı cache'ler geçersiz
+    versions.bump_version(db, versions.FORECAST)
+    db.commit()
 
     return {
         "message": f"{generated_count} adet günlük tahmin oluşturuldu (Vectorized Optimization).",
@@ -573,21 +1128,24 @@ def read_root():
 @limiter.limit("10/minute") # Simülasyonlar ağır olabilir
 def trigger_sales_boom(request: Request, db: Session = Depends(get_db)):
     """🚨 SİMÜLASYON: SATIŞ PATLAMASI (BOOM)"""
-    msg = simulate_sales_boom(db)
+    msg = with_optimistic_retry(db, lambda: simulate_sales_boom(db))
+    publish_inventory_change(db, source="simulation")
     return {"message": msg, "status": "BOOM"}
 
 @app.post("/api/simulate/recession")
 @limiter.limit("10/minute")
 def trigger_recession(request: Request, db: Session = Depends(get_db)):
     """📉 SİMÜLASYON: EKONOMİK DURGUNLUK (RECESSION)"""
-    msg = simulate_recession(db)
+    msg = with_optimistic_retry(db, lambda: simulate_recession(db))
+    publish_inventory_change(db, source="simulation")
     return {"message": msg, "status": "RECESSION"}
 
 @app.post("/api/simulate/supply-shock")
 @limiter.limit("10/minute")
 def trigger_supply_shock(request: Request, db: Session = Depends(get_db)):
     """⚠️ SİMÜLASYON: TEDARİK ZİNCİRİ KRİZİ (SUPPLY SHOCK)"""
-    msg = simulate_supply_shock(db)
+    msg = with_optimistic_retry(db, lambda: simulate_supply_shock(db))
+    publish_inventory_change(db, source="simulation")
     return {"message": msg, "status": "SHOCK"}
 
 @app.post("/api/simulate/reset")
@@ -595,6 +1153,7 @@ def trigger_supply_shock(request: Request, db: Session = Depends(get_db)):
 def trigger_reset(request: Request, db: Session = Depends(get_db)):
     """🔄 FABRİKA AYARLARINA DÖN (RESET)"""
     msg = reset_database(db)
+    publish_inventory_change(db, source="reset")
     return {"message": msg, "status": "RESET"}
 
 class SimulationStats(BaseModel):
@@ -611,9 +1170,12 @@ def get_dashboard_insights(db: Session = Depends(get_db)):
     critical_stores_count = db.query(Inventory).filter(Inventory.quantity <= 3).count()
     
     # 2. BİLGİ: Dün gerçekleşen başarılı transferlerin finansal özeti
-    # Demo: Transfer tablosu olmadığı için simüle ediyoruz veya loglardan çekiyoruz.
-    # Varsayım: Dün 5 transfer yapıldı, ortalama ürün fiyatı 1500 TL
-    yesterday_transfers_value = 5 * 1500 
+    # Transfer defterinden tek aggregate sorgu (adet x fiyat)
+    # completed_at utcnow() ile yazılır: "Dün" penceresi de UTC gününden kurulur
+    today_start = datetime.datetime.combine(datetime.datetime.utcnow().date(), datetime.time.min)
+    yesterday_transfers_value = ledger_engine.completed_transfer_value(
+        db, start=today_start - datetime.timedelta(days=1), end=today_start
+    )
     
     # 3. UYARI: Dışsal Faktörler (Hava Durumu, Tatil vb.)
     # Demo: Rastgele veya statik bir dış faktör
@@ -632,15 +1194,16 @@ def get_dashboard_insights(db: Session = Depends(get_db)):
             "border": "border-red-200"
         })
         
-    insights.append({
-        "id": 2,
-        "type": "info",
-        "icon": "CheckCircleIcon",
-        "message": f"BİLGİ: Dün yapılan akıllı transferler ile tahmini ₺{yesterday_transfers_value:,.0f} tutarında satış kaybı önlendi.",
-        "color": "text-emerald-700",
-        "bg": "bg-emerald-50",
-        "border": "border-emerald-200"
-    })
+    if yesterday_transfers_value > 0:
+        insights.append({
+            "id": 2,
+            "type": "info",
+            "icon": "CheckCircleIcon",
+            "message": f"BİLGİ: Dün yapılan akıllı transferler ile tahmini ₺{yesterday_transfers_value:,.0f} tutarında satış kaybı önlendi.",
+            "color": "text-emerald-700",
+            "bg": "bg-emerald-50",
+            "border": "border-emerald-200"
+        })
     
     insights.append({
         "id": 3,
@@ -662,10 +1225,10 @@ def get_dashboard_kpi(db: Session = Depends(get_db)):
     # Toplam Ciro
     total_revenue = db.query(func.sum(Sale.total_price)).scalar() or 0
     
-    # Kurtarılan Satış Hesabı (Demo Mantığı)
-    # (Tahmin Edilen Talep - Mevcut Stok) * Fiyat -> Eğer transfer yapılmazsa kayıp
+    # Kurtarılan Satış Hesabı
+    # Tamamlanan transferlerle ihtiyaç olan mağazaya taşınan mal değeri (adet x fiyat)
     # Bunu pozitif bir KPI olarak sunuyoruz: "Transfer yaparak X TL kurtardık"
-    recovered_sales = total_revenue * 0.12 # %12'lik bir iyileştirme varsayımı
+    recovered_sales = ledger_engine.completed_transfer_value(db)
     
     # Sparkline için son 24 saatlik (veya 7 günlük) veri serisi
     # Demo: Son 7 günün günlük satış toplamları
@@ -697,30 +1260,108 @@ def get_dashboard_kpi(db: Session = Depends(get_db)):
         ]
     }
 
+def _render_cover_rows(db: Session, cover: dict, indices: List[int]) -> List[dict]:
+    """Seçilen days-of-cover satırlarına mağaza/ürün adlarını ekler (Tek küçük sorgu)."""
+    rows = [cover_row(cover, idx) for idx in indices]
+    store_names = dict(db.query(Store.id, Store.name).filter(Store.id.in_({r["store_id"] for r in rows})).all()) if rows else {}
+    product_names = dict(db.query(Product.id, Product.name).filter(Product.id.in_({r["product_id"] for r in rows})).all()) if rows else {}
+    for row in rows:
+        row["store_name"] = store_names.get(row["store_id"])
+        row["product_name"] = product_names.get(row["product_id"])
+    return rows
+
 @app.get("/api/dashboard/critical-stock")
 def get_critical_stock(db: Session = Depends(get_db)):
     """
     Gelecek 7 günlük projeksiyona göre en riskli ürünleri getirir.
+    Risk, tahmin bazlı stokta kalma süresine (days-of-cover) göre sıralanır.
     """
-    # En riskli 5 envanter kaydını bul
+    # En riskli 5 envanter kaydını bul (Tükenmesine en az gün kalanlar)
+    cover = get_cover_snapshot(db)
     critical_list = []
-    # Basitlik için: Mevcut stok < Güvenlik stoğu olanları getir
-    risky_items = db.query(Inventory).join(Product).join(Store).filter(Inventory.quantity < Inventory.safety_stock).limit(5).all()
-    
-    for item in risky_items:
-        # Forecast verisi var mı bak (generate_forecasts ile üretilmiş olmalı)
-        # Şimdilik demo/tahmin verisi ekleyelim
+    for row in _render_cover_rows(db, cover, top_cover_risks(cover, n=5)):
+        if row["risk"] == "Düşük":
+            continue
         critical_list.append({
-            "id": item.id,
-            "name": item.store.name,
-            "stock": item.quantity,
-            "forecast": item.safety_stock * 2, # Örnek tahmin
-            "risk": "Yüksek" if item.quantity < item.safety_stock / 2 else "Orta",
-            "color": "rose" if item.quantity < item.safety_stock / 2 else "amber"
+            "id": row["inventory_id"],
+            "name": row["store_name"],
+            "product": row["product_name"],
+            "stock": row["stock"],
+            "forecast": row["forecast_7d"], # Gelecek 7 günün tahmini talebi
+            "days_of_cover": row["days_of_cover"],
+            "stockout_date": row["stockout_date"],
+            "risk": row["risk"],
+            "color": "rose" if row["risk"] == "Yüksek" else "amber"
         })
     
     return critical_list
 
+@app.on_event("startup")
+def start_background_jobs():
+    # Risk geçmişi örnekleyicisi (Test modunda kapalı)
+    if not settings.TESTING:
+        start_risk_snapshotter(SessionLocal, settings.RISK_SNAPSHOT_INTERVAL_MINUTES)
+
+@app.on_event("shutdown")
+def stop_background_jobs():
+    stop_risk_snapshotter()
+
+@app.post("/api/risk/history/snapshot")
+@limiter.limit("10/minute")
+def trigger_risk_snapshot(request: Request, db: Session = Depends(get_db)):
+    """
+    📸 ANLIK RİSK ÖRNEĞİ
+
+    Periyodik örnekleyiciyi beklemeden tek örnek alır.
+    Değişmeyen sayaçlar yeni satır açmaz, son koşuyu uzatır.
+    """
+    result = take_risk_snapshot(db, max_gap=snapshot_max_gap(settings.RISK_SNAPSHOT_INTERVAL_MINUTES))
+    db.commit()
+    return result
+
+@app.get("/api/risk/history")
+def get_risk_history(scope_type: str = "store", scope_key: str = "", start: Optional[datetime.datetime] = None,
+                     end: Optional[datetime.datetime] = None, bucket: str = "day", db: Session = Depends(get_db)):
+    """
+    📈 RİSK GEÇMİŞİ (TREND GRAFİĞİ)
+
+    scope_type=store    -> scope_key: Mağaza id'si
+    scope_type=category -> scope_key: Kategori adı
+    bucket: hour | day | week (Noktalar bu genişliğe indirgenir, en fazla 2000 nokta)
+    Varsayılan aralık: Son 30 gün (UTC).
+    """
+    if scope_type not in HISTORY_SCOPES:
+        raise HTTPException(status_code=400, detail=f"Geçersiz scope_type. Seçenekler: {', '.join(HISTORY_SCOPES)}")
+    if bucket not in HISTORY_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Geçersiz bucket. Seçenekler: {', '.join(HISTORY_BUCKETS)}")
+
+    end = end or datetime.datetime.utcnow()
+    start = start or end - timedelta(days=30)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start, end'den önce olmalı")
+
+    try:
+        points = query_risk_history(db, scope_type, scope_key, start, end, bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"scope_type": scope_type, "scope_key": scope_key, "bucket": bucket, "points": points}
+
+@app.get("/api/risk/top")
+def get_top_risks(n: int = 10, store_id: Optional[int] = None, horizon_days: int = COVER_HORIZON_DAYS, db: Session = Depends(get_db)):
+    """
+    ⏳ EN RİSKLİ N KALEM (DAYS-OF-COVER)
+
+    Kümülatif tahmin talebine göre stoğu en erken tükenecek envanter satırları.
+    [OPTIMIZASYON] Tüm satırlar sıralanmaz; argpartition ile sadece ilk N seçilir.
+    """
+    if n < 1 or n > 500:
+        raise HTTPException(status_code=400, detail="n 1 ile 500 arasında olmalı")
+    if horizon_days < 1 or horizon_days > 365:
+        raise HTTPException(status_code=400, detail="horizon_days 1 ile 365 arasında olmalı")
+
+    cover = get_cover_snapshot(db, horizon_days)
+    return _render_cover_rows(db, cover, top_cover_risks(cover, n=n, store_id=store_id))
+
 @app.get("/api/dashboard/ai-voice")
 def get_ai_voice_summary(db: Session = Depends(get_db)):
     """
@@ -749,9 +1390,58 @@ def run_custom_simulation(scenario_req: CustomScenarioRequest, request: Request,
     Kullanıcının belirlediği parametrelere (Fiyat değişimi, Tedarik gecikmesi)
     göre sistemin nasıl etkileneceğini simüle eder.
     """
-    result = simulate_custom_scenario(db, scenario_req.price_change, scenario_req.delay_days)
+    result = with_optimistic_retry(db, lambda: simulate_custom_scenario(db, scenario_req.price_change, scenario_req.delay_days))
+    publish_inventory_change(db, source="simulation")
     return result
 
+class SweepRange(BaseModel):
+    start: float
+    stop: float  # Dahil
+    step: float = 1
+
+    @model_validator(mode="after")
+    def check_bounds(self):
+        if self.step <= 0 or self.stop < self.start:
+            raise ValueError("Aralık için step > 0 ve stop >= start olmalı.")
+        return self
+
+    @property
+    def count(self) -> int:
+        """Aralıktaki nokta sayısı (değerler üretilmeden)."""
+        return int(np.floor((self.stop - self.start) / self.step + 1e-9)) + 1
+
+    def values(self) -> List[float]:
+        return [round(self.start + i * self.step, 6) for i in range(self.count)]
+
+class CustomSweepRequest(BaseModel):
+    price_change: SweepRange # %
+    delay_days: SweepRange   # Gün (tam sayıya yuvarlanır)
+    elasticity: SweepRange = SweepRange(start=PRICE_ELASTICITY, stop=PRICE_ELASTICITY)
+
+@app.post("/api/simulate/custom/sweep")
+@limiter.limit("20/minute")
+def run_custom_sweep(sweep: CustomSweepRequest, request: Request, db: Session = Depends(get_db)):
+    """
+    🗺️ ÖZEL SENARYO TARAMASI (Heatmap)
+
+    Fiyat değişimi x tedarik gecikmesi x elastisite ızgarasının tamamını tek
+    snapshot üzerinde, veritabanını değiştirmeden değerlendirir.
+    """
+    # Nokta sayısı değerler üretilmeden kontrol edilir; büyük ızgara kırpılmaz, reddedilir
+    points = sweep.price_change.count * sweep.delay_days.count * sweep.elasticity.count
+    if points > MAX_SWEEP_POINTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Izgara {points} nokta içeriyor; en fazla {MAX_SWEEP_POINTS} nokta olabilir. step değerlerini büyütün veya aralıkları daraltın."
+        )
+    if sweep.delay_days.start < 0:
+        raise HTTPException(status_code=400, detail="delay_days negatif olamaz.")
+
+    prices = sweep.price_change.values()
+    delays = sorted({int(round(d)) for d in sweep.delay_days.values()})
+    elasticities = sweep.elasticity.values()
+    return sweep_custom_scenario(db, prices, delays, elasticities)
+
 @app.get("/api/analysis/accuracy")
 def get_forecast_accuracy(store_id: int, product_id: int, db: Session = Depends(get_db)):
     """
@@ -788,14 +1478,33 @@ def get_simulation_stats(db: Session = Depends(get_db)):
 # --- Analysis Endpoints ---
 
 @app.get("/api/analysis/abc")
-def get_abc_analysis(db: Session = Depends(get_db)):
+def get_abc_analysis(mode: str = "incremental", db: Session = Depends(get_db)):
     """
     🔠 ABC ANALİZİ (PARETO PRENSİBİ)
     
     Ürünleri ciro katkılarına göre A (Çok Değerli), B (Orta), C (Düşük) 
     olarak sınıflandırır. 80/20 kuralını uygular.
+    mode=incremental: Ciro değişmediyse önbellekteki sonuç döner (Varsayılan)
+    mode=full: Tüm sınıfları tek UPDATE ile yeniden yazar
+    """
+    if mode not in ABC_MODES:
+        raise HTTPException(status_code=400, detail=f"Geçersiz mode. Seçenekler: {', '.join(ABC_MODES)}")
+    return calculate_abc_analysis(db, mode)
+
+@app.get("/api/analysis/abc-xyz")
+def get_abc_xyz_analysis(level: str = "product", store_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    🧮 ABC-XYZ MATRİSİ
+
+    ABC (ciro katkısı) x XYZ (günlük talep değişkenliği, CV) 3x3 matrisi.
+    level=product: Ürün bazlı, level=store: Mağaza x ürün bazlı (store_id ile tek mağaza).
+    Sınıflar ürün ve envanter satırlarına yazılır; satış gelmedikçe önbellekten döner.
     """
-    return calculate_abc_analysis(db)
+    if level not in ABC_XYZ_LEVELS:
+        raise HTTPException(status_code=400, detail=f"Geçersiz level. Seçenekler: {', '.join(ABC_XYZ_LEVELS)}")
+    if store_id is not None and level != "store":
+        raise HTTPException(status_code=400, detail="store_id sadece level=store ile kullanılabilir.")
+    return get_abc_xyz_matrix(db, level, store_id)
 
 class WhatIfRequest(BaseModel):
     source_store_id: int
@@ -808,6 +1517,102 @@ class WhatIfRequest(BaseModel):
 def trigger_what_if(request: WhatIfRequest, db: Session = Depends(get_db)):
     return simulate_what_if(db, request.source_store_id, request.target_store_id, request.product_id, request.amount)
 
+class WhatIfBatchRequest(BaseModel):
+    moves: List[WhatIfRequest]
+
+MAX_WHAT_IF_BATCH = 5000
+
+@app.post("/api/simulate/what-if/batch")
+@limiter.limit("20/minute")
+def trigger_what_if_batch(request: Request, batch: WhatIfBatchRequest, db: Session = Depends(get_db)):
+    """
+    🧪 TOPLU WHAT-IF
+
+    Bir transfer planının tüm hamlelerini tek istekte değerlendirir.
+    Aynı kaynağı (veya hedefi) paylaşan hamleler sırayla birbirinin stoğunu tüketir.
+    """
+    if len(batch.moves) > MAX_WHAT_IF_BATCH:
+        raise HTTPException(status_code=400, detail=f"Tek istekte en fazla {MAX_WHAT_IF_BATCH} hamle değerlendirilebilir.")
+    return simulate_what_if_batch(db, [move.model_dump() for move in batch.moves])
+
+class SandboxStep(BaseModel):
+    scenario: str # sales_boom, recession, supply_shock, custom
+    price_change: int = 0 # Sadece custom: Fiyat değişimi (%)
+    delay_days: int = 0   # Sadece custom: Tedarik gecikmesi (gün)
+
+class SandboxRequest(BaseModel):
+    steps: List[SandboxStep]
+    seed: Optional[int] = None # Aynı seed ile aynı sonuç (Tekrarlanabilir karşılaştırma)
+
+MAX_SANDBOX_STEPS = 50
+
+@app.post("/api/simulate/sandbox")
+@limiter.limit("20/minute")
+def trigger_sandbox(request: Request, sandbox: SandboxRequest, db: Session = Depends(get_db)):
+    """
+    🧪 SANDBOX SİMÜLASYONU
+
+    Senaryoları (tek tek veya zincir halinde) canlı envantere dokunmadan,
+    stok snapshot'ının kopyası üzerinde çalıştırır. KPI ve risk farklarını döner.
+    Reset gerekmez; veritabanına hiçbir şey yazılmaz.
+    """
+    if not sandbox.steps:
+        raise HTTPException(status_code=400, detail="En az bir senaryo adımı gerekli.")
+    if len(sandbox.steps) > MAX_SANDBOX_STEPS:
+        raise HTTPException(status_code=400, detail=f"Tek istekte en fazla {MAX_SANDBOX_STEPS} adım çalıştırılabilir.")
+    for step in sandbox.steps:
+        if step.scenario not in SANDBOX_SCENARIOS:
+            raise HTTPException(status_code=400, detail=f"Geçersiz scenario. Seçenekler: {', '.join(SANDBOX_SCENARIOS)}")
+    return run_sandbox(db, [step.model_dump() for step in sandbox.steps], sandbox.seed)
+
+@app.get("/api/simulate/monte-carlo")
+@limiter.limit("10/minute")
+def trigger_monte_carlo(request: Request, paths: int = DEFAULT_PATHS, horizon_days: int = 14,
+                        store_id: Optional[int] = None, product_id: Optional[int] = None,
+                        seed: Optional[int] = None, top: int = 20, db: Session = Depends(get_db)):
+    """
+    🎲 MONTE CARLO STOK TÜKENME ANALİZİ
+
+    Her mağaza x ürün için tahmin ve geçmiş sapma dağılımından binlerce talep yolu
+    üretir. Ufuk boyunca tükenme olasılığı, beklenen kayıp satış ve karşılama oranı döner.
+    """
+    if not 1 <= paths <= MAX_PATHS:
+        raise HTTPException(status_code=400, detail=f"paths 1 ile {MAX_PATHS} arasında olmalı.")
+    if not 1 <= horizon_days <= COVER_HORIZON_DAYS:
+        raise HTTPException(status_code=400, detail=f"horizon_days 1 ile {COVER_HORIZON_DAYS} arasında olmalı.")
+    return run_monte_carlo(db, paths, horizon_days, store_id, product_id, seed, top=min(max(top, 0), 500))
+
+class SupplyChainPolicy(BaseModel):
+    days: int = 90
+    max_truck_capacity: int = 50
+    safety_factor: float = 1.0
+    review_days: int = 1
+    lookahead_days: int = 7
+    lateral_transfers: bool = True
+    supplier_lead_days: int = 7
+    center_cover_days: int = 30
+    demand_scale: float = 1.0
+    daily: bool = True # Günlük seri dönsün mü?
+
+@app.post("/api/simulate/supply-chain")
+@limiter.limit("20/minute")
+def trigger_supply_chain(request: Request, policy: SupplyChainPolicy, db: Session = Depends(get_db)):
+    """
+    🚚 ÇOK GÜNLÜ TEDARİK ZİNCİRİ SİMÜLASYONU
+
+    Tahmini talebi gün gün tüketir; transfer politikasını ve CENTER -> HUB -> STORE
+    ikmalini mesafeye bağlı teslim süreleriyle uygular. Veritabanına yazmaz.
+    """
+    if not 1 <= policy.days <= MAX_SIMULATION_DAYS:
+        raise HTTPException(status_code=400, detail=f"days 1 ile {MAX_SIMULATION_DAYS} arasında olmalı.")
+    if policy.max_truck_capacity < 1 or policy.review_days < 1 or policy.lookahead_days < 1 or policy.supplier_lead_days < 1:
+        raise HTTPException(status_code=400, detail="Kapasite ve gün parametreleri en az 1 olmalı.")
+    if policy.safety_factor < 0 or policy.demand_scale < 0 or policy.center_cover_days < 0:
+        raise HTTPException(status_code=400, detail="Çarpanlar negatif olamaz.")
+    params = policy.model_dump()
+    daily = params.pop("daily")
+    return run_supply_chain(db, params, daily)
+
 class RejectionRequest(BaseModel):
     transfer_id: str # Logs only
     source_store_id: int
@@ -817,7 +1622,7 @@ class RejectionRequest(BaseModel):
 
 @app.post("/api/transfer/reject")
 def reject_transfer(request: RejectionRequest, db: Session = Depends(get_db)):
-    from models import TransferRejection, RoutePenalty
+    from models import TransferRejection
     
     # 1. Red Kaydını Oluştur
     rejection = TransferRejection(
@@ -829,20 +1634,6 @@ def reject_transfer(request: RejectionRequest, db: Session = Depends(get_db)):
     db.add(rejection)
     
     # 2. Ceza Puanını Artır (Penalty)
-    # Rota: Kaynak -> Hedef için ceza puanı var mı?
-    penalty = db.query(RoutePenalty).filter(
-        RoutePenalty.source_store_id == request.source_store_id,
-        RoutePenalty.target_store_id == request.target_store_id
-    ).first()
-    
-    if not penalty:
-        penalty = RoutePenalty(
-            source_store_id=request.source_store_id,
-            target_store_id=request.target_store_id,
-            penalty_score=0.0
-        )
-        db.add(penalty)
-    
     # Ceza Mantığı: 
     # COST (Maliyet) reddi: Hafif ceza (+1.0)
     # OPS (Operasyonel) reddi: Orta ceza (+2.5) -> Belki o mağaza bu dönemde yoğun
@@ -852,13 +1643,20 @@ def reject_transfer(request: RejectionRequest, db: Session = Depends(get_db)):
     if request.reason == "OPS": increment = 2.5
     if request.reason == "STRATEGY": increment = 5.0
     
-    penalty.penalty_score += increment
-    
+    # Versiyon satırı kilitlenir; mevcut puan cache'ten okunur (SELECT yok), tek UPDATE/INSERT yazılır
+    _penalty_cache.ensure_current(db)
+    transitions = versions.bump_version(db, versions.ROUTE_PENALTIES)
+    penalty_update = _penalty_cache.write_penalty(db, request.source_store_id, request.target_store_id, increment, transitions)
+    new_penalty_score = penalty_update["penalty_score"]
     db.commit()
+    _penalty_cache.commit_penalty(penalty_update, transitions)
+
+    # Planlayıcıda sadece bu rotayı etkileyen ürünleri yeniden çöz
+    _transfer_planner.apply_penalty_delta(request.source_store_id, request.target_store_id, new_penalty_score, transitions)
     
     return {
         "message": "Transfer reddedildi. Algoritma bu rotayı gelecekte daha az önerecek.",
-        "new_penalty_score": penalty.penalty_score
+        "new_penalty_score": new_penalty_score
     }
 
 class NewProductSchema(BaseModel):
@@ -866,53 +1664,48 @@ class NewProductSchema(BaseModel):
     category: str
     price: float
     cost: float
-    reference_product_id: int = None
+    reference_product_id: Optional[int] = None
+
+class BulkLaunchSchema(BaseModel):
+    products: List[NewProductSchema]
+    forecast_factor: float = DEFAULT_FORECAST_FACTOR # Referans tahmininin aktarılan oranı
+
+MAX_BULK_LAUNCH = 5000
 
 @app.post("/api/products/launch")
 def launch_new_product(product: NewProductSchema, db: Session = Depends(get_db)):
-    # 1. Yeni Ürünü Oluştur
-    new_product = Product(
-        name=product.name,
-        category=product.category,
-        price=product.price,
-        cost=product.cost,
-        abc_category="C" # Yeni ürün başlangıçta C olur
-    )
-    db.add(new_product)
-    db.commit() # ID almak için commit
-    
-    # 2. Referans Ürün Verilerini Kullan (Cold Start)
-    if product.reference_product_id:
-        ref_product = db.query(Product).filter(Product.id == product.reference_product_id).first()
-        if ref_product:
-            # ABC Kategorisini kopyala (Beklenti bu yönde ise)
-            new_product.abc_category = ref_product.abc_category
-            
-            # Referans ürünün tahminlerini %80 oranıyla kopyala (Training Data)
-            # Not: Gerçek hayatta bu daha karmaşık bir ML modelidir.
-            today = datetime.date.today()
-            ref_forecasts = db.query(Forecast).filter(
-                Forecast.product_id == ref_product.id,
-                Forecast.date >= today
-            ).all()
-            
-            for rf in ref_forecasts:
-                new_forecast = Forecast(
-                    store_id=rf.store_id,
-                    product_id=new_product.id,
-                    date=rf.date,
-                    predicted_quantity=rf.predicted_quantity * 0.8 # %80 varsayımı
-                )
-                db.add(new_forecast)
-                
-    # 3. Envanter Kayıtlarını Aç (Stok 0)
-    stores = db.query(Store).all()
-    for store in stores:
-        inv = Inventory(store_id=store.id, product_id=new_product.id, quantity=0, safety_stock=10)
-        db.add(inv)
-        
+    # Tek ürün = Tek elemanlı toplu lansman (Tek transaction, set-based)
+    result = launch_products(db, [product.model_dump()])
     db.commit()
-    return {"message": "Yeni ürün lansmanı başarıyla yapıldı", "product_id": new_product.id}
+    new_product_id = result["product_ids"][0]
+    # Yeni SKU'nun sıfır stoğu beklenen durumdur: Satır bazlı düşük stok alarmı üretilmez (bkz. toplu lansman)
+    publish_inventory_change(db, store_ids=result["store_ids"], source="product_launch")
+    return {"message": "Yeni ürün lansmanı başarıyla yapıldı", "product_id": new_product_id}
+
+@app.post("/api/products/launch/bulk")
+def launch_new_products_bulk(request: BulkLaunchSchema, db: Session = Depends(get_db)):
+    """
+    🚀 TOPLU ÜRÜN LANSMANI (Sezonluk koleksiyon)
+
+    Tüm ürünler tek transaction'da, set-based SQL ile açılır:
+    Tahminler sunucuda kopyalanır (INSERT ... SELECT), envanter tek INSERT ile oluşturulur.
+    """
+    if not request.products:
+        raise HTTPException(status_code=400, detail="En az bir ürün gönderilmelidir.")
+    if len(request.products) > MAX_BULK_LAUNCH:
+        raise HTTPException(status_code=400, detail=f"Tek seferde en fazla {MAX_BULK_LAUNCH} ürün açılabilir.")
+    if request.forecast_factor < 0:
+        raise HTTPException(status_code=400, detail="forecast_factor negatif olamaz.")
+
+    result = launch_products(db, [p.model_dump() for p in request.products], forecast_factor=request.forecast_factor)
+    db.commit()
+    # Yeni SKU'ların sıfır stoğu beklenen durumdur: Satır bazlı düşük stok alarmı üretilmez
+    publish_inventory_change(db, store_ids=result["store_ids"], source="product_launch")
+    return {
+        "message": f"{len(result['product_ids'])} ürün lansmanı başarıyla yapıldı",
+        "product_ids": result["product_ids"],
+        "cloned_forecasts": result["cloned_forecasts"]
+    }
 
 # ==========================================
 # 📤 RAPOR DIŞA AKTARMA (Excel / CSV)
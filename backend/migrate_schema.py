@@ -0,0 +1,35 @@
+from database import engine, Base
+from sqlalchemy import text, inspect
+import models # Tabloların metadata'ya kaydı için
+
+# Mevcut tablolara sonradan eklenen kolonlar: (tablo, kolon, DDL tipi)
+# create_all yeni tabloları oluşturur ama var olan tablolara kolon eklemez.
+COLUMN_MIGRATIONS = [
+    ("inventories", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("transfers", "completed_at", "TIMESTAMP"),
+    ("products", "xyz_category", "VARCHAR"),
+    ("inventories", "abc_category", "VARCHAR"),
+    ("inventories", "xyz_category", "VARCHAR"),
+]
+
+def migrate():
+    Base.metadata.create_all(bind=engine) # Eksik tabloları oluştur
+    inspector = inspect(engine)
+
+    for table, column, ddl in COLUMN_MIGRATIONS:
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        if column in existing:
+            print(f"Skip: {table}.{column} already exists.")
+            continue
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        print(f"Migration successful: Added {column} to {table} table.")
+
+    # Modellerde tanımlı ama mevcut tablolarda olmayan index'ler
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    print("Indexes verified.")
+
+if __name__ == "__main__":
+    migrate()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey, DateTime, Enum
+from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey, DateTime, Enum, Index
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -29,14 +29,21 @@ class Inventory(Base):
     __tablename__ = "inventories"
 
     id = Column(Integer, primary_key=True, index=True)
-    store_id = Column(Integer, ForeignKey("stores.id"))
+    store_id = Column(Integer, ForeignKey("stores.id"), index=True) # Mağaza bazlı risk özeti yenilemesi
     product_id = Column(Integer, ForeignKey("products.id"))
     quantity = Column(Integer, default=0)
     safety_stock = Column(Integer, default=10)
+    # İyimser kilit (Optimistic Locking): Her UPDATE "WHERE version = ?" ile yapılır
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # Mağaza seviyesi ABC-XYZ sınıfı (analysis_engine toplu yazar)
+    abc_category = Column(String, nullable=True)
+    xyz_category = Column(String, nullable=True)
 
     store = relationship("Store", back_populates="inventory")
     product = relationship("Product")
 
+    __mapper_args__ = {"version_id_col": version}
+
 class Product(Base):
     __tablename__ = "products"
 
@@ -46,6 +53,7 @@ class Product(Base):
     cost = Column(Float)
     price = Column(Float)
     abc_category = Column(String, default="C") # A, B, or C
+    xyz_category = Column(String, nullable=True) # X, Y, Z (Talep değişkenliği, analysis_engine)
     
     sales = relationship("Sale", back_populates="product")
     forecasts = relationship("Forecast", back_populates="product")
@@ -110,12 +118,21 @@ class Transfer(Base):
     target_store_id = Column(Integer, ForeignKey("stores.id")) # Nereye?
     product_id = Column(Integer, ForeignKey("products.id")) # Ne?
     amount = Column(Integer) # Kaç tane?
-    status = Column(String, default="Pending") # "Pending", "Approved", "Completed"
+    status = Column(String, default="Pending") # "Pending", "Approved", "Completed", "Cancelled"
     request_date = Column(DateTime, default=datetime.datetime.utcnow) # Talep tarihi
+    completed_at = Column(DateTime, nullable=True) # Stok hareketinin uygulandığı an
     
     # Transferin neden yapıldığı (Örn: "Stok Dengeleme", "Acil İhtiyaç")
     reason = Column(String, nullable=True)
 
+    # Defter sorguları: Tarih, rota (lane) ve ürün bazlı filtreler tam tarama yapmasın
+    __table_args__ = (
+        Index("ix_transfers_request_date", "request_date"),
+        Index("ix_transfers_lane", "source_store_id", "target_store_id", "request_date"),
+        Index("ix_transfers_product_date", "product_id", "request_date"),
+        Index("ix_transfers_status_completed", "status", "completed_at"),
+    )
+
 # ==========================================
 # 🌟 StoreFeatures (Mağaza Özellikleri)
 # ==========================================
@@ -183,3 +200,88 @@ class RoutePenalty(Base):
     target_store_id = Column(Integer, ForeignKey("stores.id"))
     penalty_score = Column(Float, default=0.0) # Ceza puanı (Her reddedişte artar)
     last_updated = Column(DateTime, default=datetime.datetime.utcnow)
+
+# ==========================================
+# 📅 Günlük Satış Özeti (Rollup)
+# ==========================================
+class DailySalesRollup(Base):
+    __tablename__ = "daily_sales_rollup"
+
+    # Ürün x gün bazında ağ geneli satış toplamı (rollup_engine ile artımlı güncellenir)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    quantity = Column(Integer, default=0)
+    revenue = Column(Float, default=0.0)
+    sale_count = Column(Integer, default=0) # Satış kaydı (fiş satırı) sayısı
+
+    __table_args__ = (
+        Index("ix_daily_sales_rollup_date", "date"),
+    )
+
+class StoreDailySalesRollup(Base):
+    __tablename__ = "store_daily_sales_rollup"
+
+    # Mağaza x ürün x gün bazında satış toplamı (Mağaza seviyesi ABC-XYZ için)
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    quantity = Column(Integer, default=0)
+    revenue = Column(Float, default=0.0)
+    sale_count = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index("ix_store_daily_sales_rollup_date", "date"),
+    )
+
+# ==========================================
+# 🚦 Mağaza Risk Özeti (Materialized)
+# ==========================================
+class StoreRiskSummary(Base):
+    __tablename__ = "store_risk_summary"
+
+    # Envanter yazan her işlem, etkilenen mağazaların satırını yeniler (risk_engine)
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    total_stock = Column(Integer, default=0)
+    total_safety = Column(Integer, default=0)
+    total_items = Column(Integer, default=0)
+    high_risk_count = Column(Integer, default=0) # quantity < safety_stock
+    overstock_count = Column(Integer, default=0) # quantity > safety_stock * 3
+    status = Column(String, default="UNKNOWN") # HIGH_RISK, OVERSTOCK, LOW_RISK, UNKNOWN
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+# ==========================================
+# 📈 Risk Geçmişi (Run-Length Encoded Zaman Serisi)
+# ==========================================
+class RiskSnapshot(Base):
+    __tablename__ = "risk_snapshots"
+
+    # Her satır bir "koşu" (run): Sayaçlar değişmediği sürece yeni satır açılmaz,
+    # sadece period_end ilerletilir. Saatlik örneklemede bile değişmeyen mağaza yılda tek satırdır.
+    id = Column(Integer, primary_key=True, index=True)
+    scope_type = Column(String) # "store" veya "category"
+    scope_key = Column(String) # Mağaza id'si veya kategori adı
+    status = Column(String)
+    total_items = Column(Integer, default=0)
+    total_stock = Column(Integer, default=0)
+    high_risk_count = Column(Integer, default=0)
+    overstock_count = Column(Integer, default=0)
+    period_start = Column(DateTime) # Bu değerlerin ilk görüldüğü örnek
+    period_end = Column(DateTime) # Bu değerlerin son doğrulandığı örnek
+    samples = Column(Integer, default=1) # Koşuya katlanan örnek sayısı
+
+    __table_args__ = (
+        Index("ix_risk_snapshots_scope_period", "scope_type", "scope_key", "period_start"),
+    )
+
+# ==========================================
+# 🏷️ Veri Versiyonları (Cache Geçersizleştirme)
+# ==========================================
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+
+    # Versiyonlanan veri alanı: inventory, forecast, route_penalties, products
+    # (+ risk_snapshotter: Periyodik risk örneğinin worker'lar arası kira satırı)
+    name = Column(String, primary_key=True)
+    # Her yazma işleminde yenilenen rastgele token (Reset sonrası çakışma olmasın diye sayaç değil)
+    token = Column(String)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -0,0 +1,289 @@
+from models import Forecast, Product, StoreDailySalesRollup
+from sandbox_engine import load_sandbox_snapshot
+from rollup_engine import ensure_sales_rollup, rollup_anchor_date
+from risk_engine import COVER_HORIZON_DAYS
+from core.logger import logger
+from core import versions
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+import numpy as np
+import datetime
+import threading
+import os
+
+# ==========================================
+# 🎲 MONTE CARLO STOK TÜKENME SİMÜLASYONU
+# ==========================================
+# [OPTIMIZASYON] simulation_engine her çalıştırmada random.uniform ile tek bir sonuç
+# çeker. Burada her mağaza x ürün için binlerce talep yolu tek seferde üretilir:
+#   talep[satır, yol, gün] = max(0, tahmin + sapma + sigma * Z)   (float32 tensör)
+# Tensör, bellek sınırı (MAX_TENSOR_ELEMENTS) aşılmasın diye satır parçalarına
+# (chunk) bölünür; büyük işler süreç havuzunda paralel çalışır. Her parçanın
+# tohumu SeedSequence ile türetilir, sonuç seri/paralel çalıştırmada aynıdır.
+#
+# Sapma (residual) dağılımı, satır bazında öncelik sırasıyla:
+#   1. Geçmiş tahmin - gerçekleşen satış farkları (en az MIN_RESIDUAL_DAYS gün)
+#   2. Geçmiş günlük satışların değişim katsayısı (CV) x tahmin
+#   3. DEFAULT_DEMAND_CV x tahmin
+
+DEFAULT_PATHS = 1000
+MAX_PATHS = 20000
+RESIDUAL_WINDOW_DAYS = 90
+MIN_RESIDUAL_DAYS = 14
+DEFAULT_DEMAND_CV = 0.5
+STOCKOUT_ALERT_PROBABILITY = 0.5 # Bu olasılığın üstü "riskli kalem" sayılır
+MAX_TENSOR_ELEMENTS = 4_000_000  # Parça başına ~16 MB (float32)
+PARALLEL_MIN_ELEMENTS = 20_000_000
+
+_residual_cache = {"key": None, "data": None}
+_residual_lock = threading.Lock()
+_process_pool = None
+
+def _row_lookup(snapshot: Dict, store_ids: np.ndarray, product_ids: np.ndarray):
+    """(store, product) çiftlerini snapshot satır indekslerine eşler (searchsorted ile vektörel join)."""
+    rows_store, rows_product = snapshot["store_ids_by_row"], snapshot["product_ids"]
+    width = int(max(rows_product.max(initial=0), product_ids.max(initial=0))) + 1
+    keys = rows_store * width + rows_product
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    lookup = store_ids * width + product_ids
+    pos = np.minimum(np.searchsorted(sorted_keys, lookup), max(len(keys) - 1, 0))
+    found = sorted_keys[pos] == lookup if len(keys) else np.zeros(len(lookup), dtype=bool)
+    return order[pos[found]], found
+
+def load_residual_model(db: Session, snapshot: Dict) -> Dict:
+    """
+    Satır bazlı talep belirsizliği: sigma[satır, gün] = sigma_abs + cv * tahmin[satır, gün].
+    Satış rollup'ı, tahmin/envanter versiyonu ve pencere günü değişmedikçe cache'ten.
+    """
+    watermark = ensure_sales_rollup(db)
+    anchor = rollup_anchor_date(db) or datetime.date.today()
+    current = versions.get_versions(db, [versions.INVENTORY, versions.FORECAST])
+    key = (watermark, current[versions.INVENTORY], current[versions.FORECAST], anchor, datetime.date.today())
+    with _residual_lock:
+        if _residual_cache["key"] == key:
+            return _residual_cache["data"]
+
+    n = len(snapshot["product_ids"])
+    bias = np.zeros(n)
+    sigma_abs = np.zeros(n)
+    cv = np.full(n, DEFAULT_DEMAND_CV)
+    source = np.full(n, 2, dtype=np.int8) # 0: residual, 1: history CV, 2: varsayılan
+    window_start = anchor - datetime.timedelta(days=RESIDUAL_WINDOW_DAYS - 1)
+    lookup_snapshot = dict(snapshot, store_ids_by_row=snapshot["store_ids"][snapshot["store_pos"]])
+
+    # 2. Geçmiş satış CV'si (Günlük seri sıfır günleri de içerir: Pencere gün sayısıyla)
+    history = db.query(
+        StoreDailySalesRollup.store_id, StoreDailySalesRollup.product_id,
+        func.sum(StoreDailySalesRollup.quantity),
+        func.sum(StoreDailySalesRollup.quantity * StoreDailySalesRollup.quantity)
+    ).filter(
+        StoreDailySalesRollup.date >= window_start, StoreDailySalesRollup.date <= anchor
+    ).group_by(StoreDailySalesRollup.store_id, StoreDailySalesRollup.product_id).all()
+    if n and history:
+        data = np.array(history, dtype=float)
+        rows, found = _row_lookup(lookup_snapshot, data[:, 0].astype(np.int64), data[:, 1].astype(np.int64))
+        total, squared = data[found, 2], data[found, 3]
+        variance = np.maximum(RESIDUAL_WINDOW_DAYS * squared - total ** 2, 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            history_cv = np.where(total > 0, np.sqrt(variance) / total, DEFAULT_DEMAND_CV)
+        cv[rows] = history_cv
+        source[rows] = 1
+
+    # 1. Tahmin sapmaları (Geçmiş tahmin günleri: Gerçekleşen - tahmin)
+    daily_forecast = db.query(
+        Forecast.store_id, Forecast.product_id, Forecast.date,
+        func.sum(Forecast.predicted_quantity).label("predicted")
+    ).filter(
+        Forecast.date >= window_start, Forecast.date <= anchor
+    ).group_by(Forecast.store_id, Forecast.product_id, Forecast.date).subquery()
+    error = func.coalesce(StoreDailySalesRollup.quantity, 0) - daily_forecast.c.predicted
+    residuals = db.query(
+        daily_forecast.c.store_id, daily_forecast.c.product_id,
+        func.count(), func.sum(error), func.sum(error * error)
+    ).outerjoin(
+        StoreDailySalesRollup,
+        (StoreDailySalesRollup.store_id == daily_forecast.c.store_id) &
+        (StoreDailySalesRollup.product_id == daily_forecast.c.product_id) &
+        (StoreDailySalesRollup.date == daily_forecast.c.date)
+    ).group_by(daily_forecast.c.store_id, daily_forecast.c.product_id).having(
+        func.count() >= MIN_RESIDUAL_DAYS
+    ).all()
+    if n and residuals:
+        data = np.array(residuals, dtype=float)
+        rows, found = _row_lookup(lookup_snapshot, data[:, 0].astype(np.int64), data[:, 1].astype(np.int64))
+        count, total, squared = data[found, 2], data[found, 3], data[found, 4]
+        bias[rows] = total / count
+        sigma_abs[rows] = np.sqrt(np.maximum(squared / count - (total / count) ** 2, 0.0))
+        cv[rows] = 0.0
+        source[rows] = 0
+
+    model = {"bias": bias, "sigma_abs": sigma_abs, "cv": cv, "source": source, "anchor": anchor}
+    with _residual_lock:
+        _residual_cache["key"] = key
+        _residual_cache["data"] = model
+    return model
+
+def _simulate_chunk(demand: np.ndarray, bias: np.ndarray, sigma_abs: np.ndarray, cv: np.ndarray,
+                    quantity: np.ndarray, paths: int, seed: np.random.SeedSequence) -> Dict:
+    """
+    Bir satır parçası için talep tensörünü üretir ve satır bazlı istatistikleri döner.
+    (Süreç havuzunda çalışır, bu yüzden modül seviyesinde ve sadece dizi alır.)
+    """
+    rng = np.random.default_rng(seed)
+    rows, horizon = demand.shape
+    mean = (demand + bias[:, None]).astype(np.float32)
+    scale = (sigma_abs[:, None] + cv[:, None] * demand).astype(np.float32)
+
+    sim = rng.standard_normal((rows, paths, horizon), dtype=np.float32)
+    sim *= scale[:, None, :]
+    sim += mean[:, None, :]
+    np.maximum(sim, 0, out=sim)
+
+    np.cumsum(sim, axis=2, out=sim) # Yerinde kümülatif talep (Ek tensör ayrılmaz)
+    total = sim[:, :, -1].astype(float)
+    stock = quantity[:, None]
+    served = np.minimum(total, np.maximum(stock, 0))
+    stocks_out = total > stock
+
+    # İlk tükenme günü: Kümülatif talebin stoğu geçtiği ilk gün (1 tabanlı)
+    first_day = (sim > stock[:, :, None].astype(np.float32)).argmax(axis=2) + 1
+    out_count = stocks_out.sum(axis=1)
+    with np.errstate(invalid="ignore"):
+        stockout_day = np.where(out_count > 0, (first_day * stocks_out).sum(axis=1) / np.maximum(out_count, 1), np.nan)
+
+    return {
+        "stockout_probability": out_count / paths,
+        "expected_demand": total.mean(axis=1),
+        "expected_served": served.mean(axis=1),
+        "expected_lost": (total - served).mean(axis=1),
+        "demand_p90": np.percentile(total, 90, axis=1) if rows else np.zeros(0),
+        "expected_stockout_day": stockout_day
+    }
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 2)
+    return _process_pool
+
+def run_monte_carlo(db: Session, paths: int = DEFAULT_PATHS, horizon_days: int = COVER_HORIZON_DAYS,
+                    store_id: Optional[int] = None, product_id: Optional[int] = None,
+                    seed: Optional[int] = None, parallel: bool = True, top: int = 20) -> Dict:
+    """
+    Envanter satırları için ufuk boyunca stok tükenme olasılığı, beklenen kayıp satış
+    ve karşılama oranı (fill rate). Yeniden sipariş/transfer olmadığı varsayılır.
+    Veritabanına yazmaz (Rollup güncellemesi hariç).
+    """
+    snapshot = load_sandbox_snapshot(db)
+    model = load_residual_model(db, snapshot)
+    horizon_days = max(1, min(horizon_days, snapshot["demand"].shape[1]))
+
+    row_store_ids = snapshot["store_ids"][snapshot["store_pos"]]
+    selected = np.ones(len(snapshot["product_ids"]), dtype=bool)
+    if store_id is not None:
+        selected &= row_store_ids == store_id
+    if product_id is not None:
+        selected &= snapshot["product_ids"] == product_id
+    rows = np.flatnonzero(selected)
+
+    demand = snapshot["demand"][rows, :horizon_days]
+    quantity = snapshot["quantity"][rows].astype(float)
+    bias, sigma_abs, cv = model["bias"][rows], model["sigma_abs"][rows], model["cv"][rows]
+
+    # Parçalama: Parça sınırları sadece yol/ufuk sayısına bağlı (Tohumlar deterministik)
+    chunk_rows = max(1, MAX_TENSOR_ELEMENTS // (paths * horizon_days))
+    bounds = [(start, min(start + chunk_rows, len(rows))) for start in range(0, len(rows), chunk_rows)]
+    seeds = np.random.SeedSequence(seed).spawn(len(bounds))
+    tasks = [
+        (demand[a:b], bias[a:b], sigma_abs[a:b], cv[a:b], quantity[a:b], paths, chunk_seed)
+        for (a, b), chunk_seed in zip(bounds, seeds)
+    ]
+
+    use_pool = parallel and len(tasks) > 1 and len(rows) * paths * horizon_days >= PARALLEL_MIN_ELEMENTS
+    results = None
+    used_pool = False # Sadece havuz sonuçları başarıyla döndüyse True (Seri geri dönüş raporlanır)
+    if use_pool:
+        try:
+            pool = _get_process_pool()
+            futures = [pool.submit(_simulate_chunk, *task) for task in tasks]
+            results = [f.result() for f in futures]
+            used_pool = True
+        except Exception as e:
+            logger.warning(f"Parallel Monte Carlo failed, falling back to serial: {e}")
+            results = None
+    if results is None:
+        results = [_simulate_chunk(*task) for task in tasks]
+
+    stats = {
+        key: np.concatenate([r[key] for r in results]) if results else np.zeros(0)
+        for key in ("stockout_probability", "expected_demand", "expected_served", "expected_lost",
+                    "demand_p90", "expected_stockout_day")
+    }
+    price = snapshot["price"][rows]
+    probability = stats["stockout_probability"]
+
+    # Mağaza bazlı özet (bincount, döngüsüz)
+    store_pos = snapshot["store_pos"][rows]
+    n_stores = len(snapshot["store_ids"])
+    store_demand = np.bincount(store_pos, weights=stats["expected_demand"], minlength=n_stores)
+    store_served = np.bincount(store_pos, weights=stats["expected_served"], minlength=n_stores)
+    store_lost_revenue = np.bincount(store_pos, weights=stats["expected_lost"] * price, minlength=n_stores)
+    store_risky = np.bincount(store_pos, weights=probability >= STOCKOUT_ALERT_PROBABILITY, minlength=n_stores)
+    store_items = np.bincount(store_pos, minlength=n_stores)
+    stores = [
+        {
+            "store_id": int(snapshot["store_ids"][i]),
+            "name": snapshot["store_names"][i],
+            "items": int(store_items[i]),
+            "risky_items": int(store_risky[i]),
+            "fill_rate": float(store_served[i] / store_demand[i]) if store_demand[i] > 0 else 1.0,
+            "expected_lost_revenue": float(store_lost_revenue[i])
+        }
+        for i in range(n_stores) if store_items[i] > 0
+    ]
+
+    # En riskli n kalem (Olasılık, sonra beklenen kayıp; argpartition yerine küçük lexsort yeterli)
+    top_rows = np.lexsort((-stats["expected_lost"], -probability))[:max(top, 0)]
+    names = dict(db.query(Product.id, Product.name).filter(
+        Product.id.in_([int(p) for p in snapshot["product_ids"][rows[top_rows]]])
+    ).all()) if len(top_rows) else {}
+    items = []
+    for i in top_rows:
+        product = int(snapshot["product_ids"][rows[i]])
+        stockout_day = stats["expected_stockout_day"][i]
+        items.append({
+            "store_id": int(row_store_ids[rows[i]]),
+            "product_id": product,
+            "product_name": names.get(product),
+            "quantity": int(quantity[i]),
+            "stockout_probability": float(probability[i]),
+            "expected_stockout_day": None if np.isnan(stockout_day) else float(stockout_day),
+            "expected_demand": float(stats["expected_demand"][i]),
+            "demand_p90": float(stats["demand_p90"][i]),
+            "expected_lost_sales": float(stats["expected_lost"][i]),
+            "fill_rate": float(stats["expected_served"][i] / stats["expected_demand"][i]) if stats["expected_demand"][i] > 0 else 1.0,
+            "demand_model": ("residual", "history_cv", "default_cv")[int(model["source"][rows[i]])]
+        })
+
+    total_demand = float(stats["expected_demand"].sum())
+    return {
+        "paths": paths,
+        "horizon_days": horizon_days,
+        "seed": seed,
+        "chunks": len(tasks),
+        "parallel": used_pool,
+        "summary": {
+            "items": int(len(rows)),
+            "risky_items": int((probability >= STOCKOUT_ALERT_PROBABILITY).sum()),
+            "mean_stockout_probability": float(probability.mean()) if len(rows) else 0.0,
+            "expected_demand": total_demand,
+            "expected_lost_sales": float(stats["expected_lost"].sum()),
+            "expected_lost_revenue": float((stats["expected_lost"] * price).sum()),
+            "fill_rate": float(stats["expected_served"].sum() / total_demand) if total_demand > 0 else 1.0
+        },
+        "stores": stores,
+        "items": items
+    }
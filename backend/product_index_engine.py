@@ -0,0 +1,340 @@
+from models import Product, Sale, DailySalesRollup, DataVersion
+from rollup_engine import ensure_sales_rollup, rollup_anchor_date
+from core import versions
+from core.logger import logger
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+import numpy as np
+import datetime
+import threading
+
+# ==========================================
+# 🧭 ÜRÜN BENZERLİK İNDEKSİ (EMBEDDING)
+# ==========================================
+# [OPTIMIZASYON] k-NN proxy araması her çağrıda SQL ORDER BY ABS(fiyat - ?) yapmaz.
+# Her ürün sabit boyutlu bir vektöre gömülür ve tüm katalog tek NumPy matrisinde,
+# normları önceden hesaplanmış olarak tutulur. Sorgu = matris x vektör + argpartition.
+#
+# Vektör blokları:
+#   [log fiyat, log maliyet, marj]  -> Tam kurulumda z-score ile normalize
+#   [kategori one-hot]
+#   [haftalık satış profili]         -> Gün payı - 1/7 (Satışsız ürün: Sıfır)
+#
+# Güncelleme artımlıdır:
+#   - PRODUCTS versiyonu değişince: Tek hafif sorgu, sadece eklenen/değişen ürün satırları
+#   - Rollup watermark'ı ilerleyince: Sadece yeni satışı olan ürünlerin satış blokları
+#   - Gün değişince, ürün silinince veya yeni kategori gelince: Tam kurulum
+
+PROFILE_DAYS = 56         # Haftalık profil penceresi (8 hafta)
+DEMAND_DAYS = 30          # Ortalama/varyans penceresi (Cold start ile aynı)
+NUMERIC_WEIGHT = 1.0
+CATEGORY_WEIGHT = 1.0
+PROFILE_WEIGHT = 5.0      # Gün payı sapmaları küçüktür (~0.05); diğer bloklarla dengelenir
+N_NUMERIC = 3
+N_WEEKDAYS = 7
+
+class ProductEmbeddingIndex:
+    """
+    Ürün benzerlik vektörlerinin süreç içi indeksi.
+    Satırlar ürün id'sine göre sıralıdır (id -> satır: searchsorted).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.products_token = None
+        self.watermark = None
+        self.anchor = None
+        self._checked_on = None # Son tam güncellik kontrolünün günü (anchor bugüne bağlı)
+        self._reset_arrays()
+
+    def _reset_arrays(self):
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._names: List[str] = []
+        self._prices = np.zeros(0)
+        self._costs = np.zeros(0)
+        self._category_codes = np.zeros(0, dtype=np.int64)
+        self._categories: List[str] = []       # Kod -> kategori adı
+        self._category_rows: Dict[int, np.ndarray] = {}
+        self._category_blocks: Dict[int, Tuple[np.ndarray, np.ndarray]] = {} # Kod -> (matris, norm) bitişik kopya
+        self._numeric_stats = (np.zeros(N_NUMERIC), np.ones(N_NUMERIC))
+        self._profile = np.zeros((0, N_WEEKDAYS))  # Gün bazlı satış toplamları (ham)
+        self._demand_sum = np.zeros(0)
+        self._demand_sq = np.zeros(0)
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._norms = np.zeros(0, dtype=np.float32)
+
+    # ---------- Güncellik ----------
+
+    def ensure_current(self, db: Session):
+        # Hızlı yol: Son satış id'si ve ürün versiyonu tek sorguda; değişiklik yoksa dokunma
+        last_sale_id, products_token = db.query(
+            select(func.max(Sale.id)).scalar_subquery(),
+            select(DataVersion.token).where(DataVersion.name == versions.PRODUCTS).scalar_subquery()
+        ).one()
+        if ((last_sale_id or 0) == self.watermark and (products_token or "0") == self.products_token
+                and self._checked_on == datetime.date.today()):
+            return
+
+        watermark = ensure_sales_rollup(db)
+        products_token = versions.get_versions(db, [versions.PRODUCTS])[versions.PRODUCTS]
+        anchor = rollup_anchor_date(db) or datetime.date.today()
+
+        with self._lock:
+            if self.products_token is None or anchor != self.anchor or (self.watermark or 0) > watermark:
+                self._full_rebuild(db, products_token, watermark, anchor)
+                self._checked_on = datetime.date.today()
+                return
+            if products_token != self.products_token:
+                if not self._apply_product_changes(db):
+                    self._full_rebuild(db, products_token, watermark, anchor)
+                    self._checked_on = datetime.date.today()
+                    return
+                self.products_token = products_token
+            if watermark != self.watermark:
+                touched = [row[0] for row in db.query(Sale.product_id).filter(Sale.id > self.watermark).distinct().all()]
+                self._load_sales(db, touched)
+                self._rebuild_rows(self._rows_for(touched))
+                self.watermark = watermark
+            self._checked_on = datetime.date.today()
+
+    def _full_rebuild(self, db: Session, products_token: str, watermark: int, anchor: datetime.date):
+        rows = db.query(Product.id, Product.name, Product.category, Product.price, Product.cost).order_by(Product.id).all()
+        self._reset_arrays()
+        self.anchor = anchor
+        self._categories = sorted({row[2] or "" for row in rows})
+        self._set_products(rows)
+
+        # Normalizasyon istatistikleri sadece tam kurulumda hesaplanır (artımlı satırlar aynı ölçeği kullanır)
+        numeric = self._numeric_features(self._prices, self._costs)
+        std = numeric.std(axis=0) if len(rows) else np.ones(N_NUMERIC)
+        self._numeric_stats = (numeric.mean(axis=0) if len(rows) else np.zeros(N_NUMERIC), np.where(std > 0, std, 1.0))
+
+        self._load_sales(db, None)
+        self._matrix = np.zeros((len(rows), N_NUMERIC + len(self._categories) + N_WEEKDAYS), dtype=np.float32)
+        self._norms = np.zeros(len(rows), dtype=np.float32)
+        self._rebuild_rows(np.arange(len(rows)))
+        self.products_token = products_token
+        self.watermark = watermark
+        logger.info(f"Product embedding index rebuilt: {len(rows)} products, {self._matrix.shape[1]} dims")
+
+    def _set_products(self, rows):
+        code = {name: i for i, name in enumerate(self._categories)}
+        self._ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self._names = [row[1] for row in rows]
+        self._category_codes = np.array([code[row[2] or ""] for row in rows], dtype=np.int64)
+        self._prices = np.array([row[3] or 0.0 for row in rows], dtype=float)
+        self._costs = np.array([row[4] or 0.0 for row in rows], dtype=float)
+        self._profile = np.zeros((len(rows), N_WEEKDAYS))
+        self._demand_sum = np.zeros(len(rows))
+        self._demand_sq = np.zeros(len(rows))
+        self._index_categories()
+
+    def _index_categories(self):
+        order = np.argsort(self._category_codes, kind="stable")
+        codes = self._category_codes[order]
+        bounds = np.flatnonzero(np.diff(codes)) + 1
+        self._category_rows = {
+            int(codes[group[0]]): order[group]
+            for group in np.split(np.arange(len(codes)), bounds) if len(group)
+        }
+        self._category_blocks = {}
+
+    def _apply_product_changes(self, db: Session) -> bool:
+        """
+        Katalogdaki ekleme/değişiklikleri uygular. Tam kurulum gerekiyorsa False döner
+        (ürün silinmiş, araya id eklenmiş veya yeni kategori gelmiş).
+        """
+        rows = db.query(Product.id, Product.name, Product.category, Product.price, Product.cost).order_by(Product.id).all()
+        n_old = len(self._ids)
+        if len(rows) < n_old or not np.array_equal([row[0] for row in rows[:n_old]], self._ids):
+            return False
+        code = {name: i for i, name in enumerate(self._categories)}
+        if any((row[2] or "") not in code for row in rows[n_old:]):
+            return False
+
+        changed = []
+        for i in range(n_old):
+            _, name, category, price, cost = rows[i]
+            if (category or "") not in code:
+                return False
+            if (code[category or ""] != self._category_codes[i] or (price or 0.0) != self._prices[i]
+                    or (cost or 0.0) != self._costs[i] or name != self._names[i]):
+                self._names[i] = name
+                self._category_codes[i] = code[category or ""]
+                self._prices[i] = price or 0.0
+                self._costs[i] = cost or 0.0
+                changed.append(i)
+
+        new_rows = rows[n_old:]
+        if new_rows:
+            n_new = len(new_rows)
+            self._ids = np.concatenate([self._ids, [row[0] for row in new_rows]]).astype(np.int64)
+            self._names.extend(row[1] for row in new_rows)
+            self._category_codes = np.concatenate([self._category_codes, [code[row[2] or ""] for row in new_rows]]).astype(np.int64)
+            self._prices = np.concatenate([self._prices, [row[3] or 0.0 for row in new_rows]])
+            self._costs = np.concatenate([self._costs, [row[4] or 0.0 for row in new_rows]])
+            self._profile = np.vstack([self._profile, np.zeros((n_new, N_WEEKDAYS))])
+            self._demand_sum = np.concatenate([self._demand_sum, np.zeros(n_new)])
+            self._demand_sq = np.concatenate([self._demand_sq, np.zeros(n_new)])
+            self._matrix = np.vstack([self._matrix, np.zeros((n_new, self._matrix.shape[1]), dtype=np.float32)])
+            self._norms = np.concatenate([self._norms, np.zeros(n_new, dtype=np.float32)])
+            new_ids = [row[0] for row in new_rows]
+            # Yeni ürünlerin satışı (varsa) rollup'tan yüklenir
+            self._load_sales(db, new_ids)
+            changed.extend(range(n_old, len(rows)))
+
+        if changed:
+            self._index_categories()
+            self._rebuild_rows(np.array(changed, dtype=np.int64))
+        return True
+
+    def _rows_for(self, product_ids) -> np.ndarray:
+        ids = np.asarray(sorted(product_ids), dtype=np.int64)
+        pos = np.searchsorted(self._ids, ids)
+        valid = (pos < len(self._ids)) & (self._ids[np.minimum(pos, len(self._ids) - 1)] == ids) if len(self._ids) else np.zeros(len(ids), bool)
+        return pos[valid]
+
+    # ---------- Özellikler ----------
+
+    def _load_sales(self, db: Session, product_ids: Optional[List[int]]):
+        """Profil ve talep toplamlarını rollup'tan okur (None -> tüm katalog, tek sorgu)."""
+        if product_ids is not None and not product_ids:
+            return
+        profile_start = self.anchor - datetime.timedelta(days=PROFILE_DAYS - 1)
+        query = db.query(DailySalesRollup.product_id, DailySalesRollup.date, DailySalesRollup.quantity).filter(
+            DailySalesRollup.date.between(profile_start, self.anchor)
+        )
+        if product_ids is not None:
+            rows_to_reset = self._rows_for(product_ids)
+            self._profile[rows_to_reset] = 0.0
+            self._demand_sum[rows_to_reset] = 0.0
+            self._demand_sq[rows_to_reset] = 0.0
+            query = query.filter(DailySalesRollup.product_id.in_(product_ids))
+        rows = query.all()
+        if not rows:
+            return
+
+        product_arr = np.array([row[0] for row in rows], dtype=np.int64)
+        ordinals = np.array([row[1].toordinal() for row in rows], dtype=np.int64)
+        quantities = np.array([row[2] or 0 for row in rows], dtype=float)
+
+        pos = np.searchsorted(self._ids, product_arr)
+        known = (pos < len(self._ids)) & (self._ids[np.minimum(pos, len(self._ids) - 1)] == product_arr)
+        pos, ordinals, quantities = pos[known], ordinals[known], quantities[known]
+
+        np.add.at(self._profile, (pos, (ordinals - 1) % N_WEEKDAYS), quantities)
+        recent = ordinals > self.anchor.toordinal() - DEMAND_DAYS
+        np.add.at(self._demand_sum, pos[recent], quantities[recent])
+        np.add.at(self._demand_sq, pos[recent], quantities[recent] ** 2)
+
+    @staticmethod
+    def _numeric_features(prices: np.ndarray, costs: np.ndarray) -> np.ndarray:
+        margin = np.divide(prices - costs, prices, out=np.zeros_like(prices), where=prices > 0)
+        return np.column_stack([np.log1p(np.maximum(prices, 0)), np.log1p(np.maximum(costs, 0)), margin])
+
+    def _rebuild_rows(self, rows: np.ndarray):
+        """Verilen satırların vektörlerini ve normlarını yeniden hesaplar (vektörel)."""
+        if len(rows) == 0:
+            return
+        mean, std = self._numeric_stats
+        n_categories = len(self._categories)
+        block = np.zeros((len(rows), self._matrix.shape[1]))
+
+        block[:, :N_NUMERIC] = (self._numeric_features(self._prices[rows], self._costs[rows]) - mean) / std * NUMERIC_WEIGHT
+        block[np.arange(len(rows)), N_NUMERIC + self._category_codes[rows]] = CATEGORY_WEIGHT
+
+        profile = self._profile[rows]
+        totals = profile.sum(axis=1, keepdims=True)
+        shares = np.divide(profile, totals, out=np.full_like(profile, 1.0 / N_WEEKDAYS), where=totals > 0)
+        block[:, N_NUMERIC + n_categories:] = (shares - 1.0 / N_WEEKDAYS) * PROFILE_WEIGHT
+
+        self._matrix[rows] = block
+        self._norms[rows] = np.linalg.norm(block, axis=1)
+        for code in np.unique(self._category_codes[rows]):
+            self._category_blocks.pop(int(code), None)
+
+    def _category_block(self, code: int):
+        """Kategorinin satırları ve bitişik (contiguous) matris kopyası. Sorguda fancy-index kopyası olmaz."""
+        rows = self._category_rows.get(code, np.zeros(0, dtype=np.int64))
+        if code not in self._category_blocks:
+            self._category_blocks[code] = (np.ascontiguousarray(self._matrix[rows]), self._norms[rows])
+        matrix, norms = self._category_blocks[code]
+        return rows, matrix, norms
+
+    # ---------- Sorgu ----------
+
+    def similar(self, db: Session, product_id: int, k: int, same_category: bool = True,
+                with_demand: bool = True) -> List[Dict]:
+        """
+        En benzer k ürün (kosinüs). same_category: Önce aynı kategori (hard filter);
+        kategoride yeterli ürün yoksa kalan yer tüm katalogdan doldurulur.
+        with_demand: Sadece son DEMAND_DAYS günde satışı olan ürünler aday olur
+        (Satışsız ürünlerin profil bloğu sıfırdır; yeni ürünler birbirine yakın düşer
+        ve proxy olarak ~0 talep taşırlar).
+        """
+        self.ensure_current(db)
+        with self._lock:
+            pos = self._rows_for([product_id])
+            if len(pos) == 0:
+                # Ürün versiyon artışından önce sorgulandı: Kataloğu tazele
+                if not self._apply_product_changes(db):
+                    self._full_rebuild(db, self.products_token, self.watermark, self.anchor)
+                pos = self._rows_for([product_id])
+                if len(pos) == 0:
+                    return []
+            row = int(pos[0])
+
+            eligible = self._demand_sum > 0 if with_demand else None
+            if same_category:
+                result = self._top_k(row, k, *self._category_block(int(self._category_codes[row])), eligible=eligible)
+                if len(result) < k:
+                    taken = {r for r, _ in result} | {row}
+                    rest = [pair for pair in self._top_k(row, k + len(taken), eligible=eligible) if pair[0] not in taken]
+                    result.extend(rest[:k - len(result)])
+            else:
+                result = self._top_k(row, k, eligible=eligible)
+
+            return [self._describe(r, score) for r, score in result]
+
+    def _top_k(self, row: int, k: int, rows: Optional[np.ndarray] = None,
+               matrix: Optional[np.ndarray] = None, norms: Optional[np.ndarray] = None,
+               eligible: Optional[np.ndarray] = None):
+        """
+        Aday satırlar arasında (None -> tüm katalog) row'a en yakın k satır: [(satır, kosinüs), ...].
+        eligible: Katalog boyunda maske; False olan satırlar aday olmaz.
+        """
+        if rows is None:
+            rows, matrix, norms = np.arange(len(self._ids)), self._matrix, self._norms
+        if len(rows) == 0:
+            return []
+
+        query = self._matrix[row]
+        denom = norms * self._norms[row]
+        scores = np.divide(matrix @ query, denom, out=np.zeros(len(rows), dtype=np.float32), where=denom > 0)
+        candidates = rows != row # Kendisi hariç
+        if eligible is not None:
+            candidates &= eligible[rows]
+        scores[~candidates] = -np.inf
+
+        k = min(k, int(candidates.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(rows[t]), float(scores[t])) for t in top]
+
+    def _describe(self, row: int, score: float) -> Dict:
+        avg = self._demand_sum[row] / DEMAND_DAYS
+        variance = max(self._demand_sq[row] / DEMAND_DAYS - avg * avg, 0.0)
+        return {
+            "id": int(self._ids[row]),
+            "name": self._names[row],
+            "price": float(self._prices[row]),
+            "category": self._categories[self._category_codes[row]],
+            "similarity": score,
+            "avg_daily_demand": float(avg),
+            "demand_variance": float(variance)
+        }
+
+product_index = ProductEmbeddingIndex()
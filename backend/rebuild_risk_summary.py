@@ -0,0 +1,18 @@
+from database import SessionLocal
+from risk_engine import refresh_store_risk_summary
+import models # Tabloların metadata'ya kaydı için
+
+# store_risk_summary tablosunu envanterden baştan kurar.
+# Envanter API dışından (toplu import, manuel SQL) değiştirildiğinde çalıştırın.
+
+def rebuild():
+    db = SessionLocal()
+    try:
+        count = refresh_store_risk_summary(db)
+        db.commit()
+        print(f"Risk summary rebuilt for {count} stores.")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    rebuild()
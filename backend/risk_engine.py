@@ -1,8 +1,40 @@
-from models import Store, Inventory
-from typing import Dict, List
+from models import Store, Inventory, StoreRiskSummary, Forecast
+from typing import Dict, Iterable, List, Optional
+from collections import OrderedDict
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, bindparam, func
 from core.logger import logger
+from core import versions
+import datetime
+import threading
+import numpy as np
+
+# Risk modları:
+# ratio -> Stok / güvenlik stoğu oranları (materialized özet)
+# cover -> Tahmin bazlı stokta kalma süresi (days-of-cover)
+RISK_MODES = ("ratio", "cover")
+
+COVER_HORIZON_DAYS = 30   # Kümülatif talebin izlendiği ufuk
+COVER_CRITICAL_DAYS = 3   # Bundan kısa sürede tükenecek kalem: Yüksek risk
+COVER_WARNING_DAYS = 7    # Bundan kısa sürede tükenecek kalem: Orta risk (mağaza skorunda riskli sayılır)
+
+FRONTEND_COLORS = {
+    "HIGH_RISK": "red",
+    "MEDIUM_RISK": "orange",
+    "OVERSTOCK": "yellow",
+    "LOW_RISK": "green",
+    "UNKNOWN": "gray"
+}
+
+def classify_risk(total_items: int, high_risk_count: int, overstock_count: int) -> str:
+    """Karar Mantığı: Riskli kalem oranı %20'yi, fazla stok oranı %40'ı aşarsa."""
+    if total_items == 0:
+        return "UNKNOWN"
+    if (high_risk_count / total_items) > 0.2:
+        return "HIGH_RISK"
+    if (overstock_count / total_items) > 0.4:
+        return "OVERSTOCK"
+    return "LOW_RISK"
 
 def analyze_store_risk(store: Store, db: Session) -> str:
     """
@@ -20,7 +52,7 @@ def analyze_store_risk(store: Store, db: Session) -> str:
             COUNT(*) as total_items,
             SUM(CASE WHEN quantity < safety_stock THEN 1 ELSE 0 END) as high_risk_count,
             SUM(CASE WHEN quantity > safety_stock * 3 THEN 1 ELSE 0 END) as overstock_count
-        FROM inventory
+        FROM inventories
         WHERE store_id = :store_id
     """)
     
@@ -40,86 +72,359 @@ def analyze_store_risk(store: Store, db: Session) -> str:
     if total_items == 0:
         return "LOW_RISK"
 
-    # Karar Mantığı (Aynı kalıyor)
-    if (high_risk_count / total_items) > 0.2:
-        return "HIGH_RISK"
-    
-    if (overstock_count / total_items) > 0.4:
-        return "OVERSTOCK"
-        
-    return "LOW_RISK"
+    return classify_risk(total_items, high_risk_count, overstock_count)
+
+# ==========================================
+# 🚦 MATERIALIZED RİSK ÖZETİ
+# ==========================================
+# [OPTIMIZASYON] Risk raporu her istekte tüm envanter tablosunu GROUP BY ile
+# taramaz. Mağaza başına bir satırlık özet (store_risk_summary) envanter yazan
+# her işlemde sadece etkilenen mağazalar için yenilenir; okuma O(mağaza) olur.
+
+def refresh_store_risk_summary(db: Session, store_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Verilen mağazaların risk özetini envanterden yeniden hesaplar.
+    store_ids None ise tüm mağazalar (tam yeniden kurulum).
+
+    Sadece etkilenen mağazaların envanter satırları okunur (inventories.store_id index'i).
+    Commit ETMEZ: Envanter yazmasıyla aynı transaction'da görünür olmalı.
+    Dönüş: Yenilenen mağaza sayısı.
+    """
+    db.flush() # Bekleyen ORM değişiklikleri (transfer) sayıma dahil olsun
+    if store_ids is None:
+        target_ids = [row[0] for row in db.query(Store.id).all()]
+        stats_query = text("""
+            SELECT
+                store_id,
+                SUM(quantity), SUM(safety_stock), COUNT(id),
+                SUM(CASE WHEN quantity < safety_stock THEN 1 ELSE 0 END),
+                SUM(CASE WHEN quantity > safety_stock * 3 THEN 1 ELSE 0 END)
+            FROM inventories
+            GROUP BY store_id
+        """)
+        stats_rows = db.execute(stats_query).fetchall()
+    else:
+        target_ids = sorted(set(store_ids))
+        if not target_ids:
+            return 0
+        stats_query = text("""
+            SELECT
+                store_id,
+                SUM(quantity), SUM(safety_stock), COUNT(id),
+                SUM(CASE WHEN quantity < safety_stock THEN 1 ELSE 0 END),
+                SUM(CASE WHEN quantity > safety_stock * 3 THEN 1 ELSE 0 END)
+            FROM inventories
+            WHERE store_id IN :store_ids
+            GROUP BY store_id
+        """).bindparams(bindparam("store_ids", expanding=True))
+        stats_rows = db.execute(stats_query, {"store_ids": target_ids}).fetchall()
+
+    stats_map = {row[0]: row[1:] for row in stats_rows}
+    now = datetime.datetime.utcnow()
+    summary_rows = []
+    for store_id in target_ids:
+        total_stock, total_safety, total_items, high_risk, overstock = stats_map.get(store_id, (0, 0, 0, 0, 0))
+        total_items = total_items or 0
+        high_risk = high_risk or 0
+        overstock = overstock or 0
+        summary_rows.append({
+            "store_id": store_id,
+            "total_stock": total_stock or 0,
+            "total_safety": total_safety or 0,
+            "total_items": total_items,
+            "high_risk_count": high_risk,
+            "overstock_count": overstock,
+            "status": classify_risk(total_items, high_risk, overstock),
+            "updated_at": now
+        })
+
+    # Upsert: Etkilenen satırları sil + toplu INSERT (SQLite ve PostgreSQL'de aynı çalışır)
+    summary_table = StoreRiskSummary.__table__
+    delete_query = summary_table.delete()
+    if store_ids is not None:
+        delete_query = delete_query.where(summary_table.c.store_id.in_(target_ids))
+    db.execute(delete_query)
+    if summary_rows:
+        db.execute(summary_table.insert(), summary_rows)
+
+    store_table = Store.__table__
+    db.execute(
+        store_table.update().where(store_table.c.id.in_(target_ids)).values(last_risk_analysis=now)
+    )
+    return len(target_ids)
 
 def get_risk_report(db: Session, stores: List[Store]) -> List[Dict]:
     """
-    TOPLU RİSK RAPORU (SQL OPTİMİZE)
+    TOPLU RİSK RAPORU (MATERIALIZED)
     
-    Tüm mağazaların risk durumunu tek sorguda çeker.
+    Mağaza risk durumlarını store_risk_summary tablosundan okur (O(mağaza)).
+    Özeti henüz oluşmamış mağazalar (ilk çalıştırma) bir kez hesaplanıp yazılır.
     """
-    # Tek sorguda tüm mağazaların stok istatistiklerini al
-    sql_query = text("""
-        SELECT 
-            i.store_id,
-            SUM(i.quantity) as total_stock_qty,
-            SUM(i.safety_stock) as total_safety_qty,
-            COUNT(i.id) as total_items,
-            SUM(CASE WHEN i.quantity < i.safety_stock THEN 1 ELSE 0 END) as high_risk,
-            SUM(CASE WHEN i.quantity > i.safety_stock * 3 THEN 1 ELSE 0 END) as overstock
-        FROM inventory i
-        GROUP BY i.store_id
-    """)
-    
-    try:
-        stats_results = db.execute(sql_query).fetchall()
-    except Exception as e:
-        logger.error(f"Bulk Risk Report Error: {e}")
-        stats_results = []
-        
-    # Sonuçları Store ID'ye göre sözlüğe al (O(1) erişim için)
-    stats_map = {}
-    for row in stats_results:
-        stats_map[row[0]] = {
-            "total_stock": row[1] or 0,
-            "total_safety": row[2] or 0,
-            "total_items": row[3] or 0,
-            "high_risk": row[4] or 0,
-            "overstock": row[5] or 0
-        }
+    store_ids = [store.id for store in stores]
+    summary_rows = db.query(StoreRiskSummary).filter(StoreRiskSummary.store_id.in_(store_ids)).all() if store_ids else []
+    summary_map = {row.store_id: row for row in summary_rows}
+
+    missing = [store_id for store_id in store_ids if store_id not in summary_map]
+    if missing:
+        try:
+            refresh_store_risk_summary(db, missing)
+            db.commit()
+        except Exception as e:
+            logger.error(f"Risk Summary Refresh Error: {e}")
+            db.rollback()
+        summary_map.update({
+            row.store_id: row
+            for row in db.query(StoreRiskSummary).filter(StoreRiskSummary.store_id.in_(missing)).all()
+        })
 
     report = []
-    
-    frontend_colors = {
-        "HIGH_RISK": "red",
-        "MEDIUM_RISK": "orange",
-        "OVERSTOCK": "yellow",
-        "LOW_RISK": "green",
-        "UNKNOWN": "gray"
-    }
-        
     for store in stores:
-        stat = stats_map.get(store.id, {})
-        
-        # Risk Durumu Hesapla
-        total_items = stat.get("total_items", 0)
-        high_risk = stat.get("high_risk", 0)
-        overstock = stat.get("overstock", 0)
-        
-        status = "LOW_RISK"
-        if total_items > 0:
-            if (high_risk / total_items) > 0.2:
-                status = "HIGH_RISK"
-            elif (overstock / total_items) > 0.4:
-                status = "OVERSTOCK"
-        else:
-            status = "UNKNOWN" if total_items == 0 else "LOW_RISK"
+        summary = summary_map.get(store.id)
+        status = summary.status if summary else "UNKNOWN"
             
         report.append({
             "store_id": store.id,
             "name": store.name,
             "type": store.store_type.value,
-            "stock": stat.get("total_stock", 0),
-            "safety_stock": stat.get("total_safety", 0),
+            "stock": summary.total_stock if summary else 0,
+            "safety_stock": summary.total_safety if summary else 0,
             "status": status,
-            "color": frontend_colors.get(status, "gray")
+            "color": FRONTEND_COLORS.get(status, "gray")
         })
         
     return report
+
+# ==========================================
+# ⏳ STOKTA KALMA SÜRESİ (DAYS-OF-COVER)
+# ==========================================
+# [OPTIMIZASYON] Her envanter satırı için kümülatif tahmin talebi tek NumPy
+# geçişinde hesaplanır: İki toplu sorgu (envanter + günlük tahmin) ->
+# talep matrisi D[satır, gün] -> cumsum -> stoğun tükendiği ilk gün.
+# Sonuç envanter ve tahmin versiyonlarına göre süreç içinde cache'lenir.
+# Cache anahtarı ufku içermez: Taban matris en uzun istenen ufukla (en az
+# COVER_HORIZON_DAYS) bir kez kurulur; kısa ufuklar ondan dilimlenir ve küçük
+# bir LRU'da tutulur (Farklı ufuklu istekler birbirini silip tam geçişi tekrarlatmaz).
+
+COVER_VIEW_CACHE_SIZE = 8
+
+_cover_cache = {"key": None, "data": None, "cumulative": None, "views": OrderedDict()}
+_cover_lock = threading.Lock()
+
+def compute_days_of_cover(db: Session, horizon_days: int = COVER_HORIZON_DAYS) -> Dict:
+    """
+    Tüm envanter satırları için stokta kalma süresi (gün) ve tükenme tarihi.
+
+    Dönüş (satır sırası envanter id sırasıdır):
+      ids, store_ids, product_ids, quantity, safety_stock -> np.ndarray
+      demand      -> Günlük tahmini talep matrisi D[satır, gün]
+      demand_7d   -> Gelecek 7 günün toplam tahmini talebi
+      cover_days  -> Stoğun tükenmesine kalan gün (ufuk içinde tükenmiyorsa inf)
+      today       -> Hesaplama günü (tükenme tarihi = today + floor(cover_days))
+    """
+    horizon_days = max(1, horizon_days)
+    today = datetime.date.today()
+    inventory_rows = db.query(
+        Inventory.id, Inventory.store_id, Inventory.product_id, Inventory.quantity, Inventory.safety_stock
+    ).order_by(Inventory.id).all()
+
+    n = len(inventory_rows)
+    data = np.array(inventory_rows, dtype=np.int64).reshape(n, 5) if n else np.zeros((0, 5), dtype=np.int64)
+    ids, store_ids, product_ids = data[:, 0], data[:, 1], data[:, 2]
+    quantity = data[:, 3].astype(float)
+    safety_stock = data[:, 4]
+
+    # Günlük talep matrisi: D[satır, gün]
+    demand = np.zeros((n, horizon_days))
+    forecast_rows = db.query(
+        Forecast.store_id, Forecast.product_id, Forecast.date, func.sum(Forecast.predicted_quantity)
+    ).filter(
+        Forecast.date >= today,
+        Forecast.date < today + datetime.timedelta(days=horizon_days)
+    ).group_by(Forecast.store_id, Forecast.product_id, Forecast.date).all()
+
+    if n and forecast_rows:
+        # (store, product) -> satır eşlemesi: Sıralı anahtar + searchsorted (vektörel join)
+        keys = store_ids * (product_ids.max() + 1) + product_ids
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+
+        f_store = np.array([row[0] for row in forecast_rows], dtype=np.int64)
+        f_product = np.array([row[1] for row in forecast_rows], dtype=np.int64)
+        f_day = np.array([(row[2] - today).days for row in forecast_rows], dtype=np.int64)
+        f_qty = np.array([row[3] or 0.0 for row in forecast_rows], dtype=float)
+
+        valid = f_product <= product_ids.max()
+        f_keys = f_store[valid] * (product_ids.max() + 1) + f_product[valid]
+        pos = np.searchsorted(sorted_keys, f_keys)
+        pos = np.minimum(pos, n - 1)
+        found = sorted_keys[pos] == f_keys
+        rows = order[pos[found]]
+        np.add.at(demand, (rows, f_day[valid][found]), f_qty[valid][found])
+
+    cumulative = np.cumsum(demand, axis=1)
+    return {
+        "ids": ids,
+        "store_ids": store_ids,
+        "product_ids": product_ids,
+        "quantity": data[:, 3],
+        "safety_stock": safety_stock,
+        "demand": demand,
+        "demand_7d": cumulative[:, min(7, horizon_days) - 1],
+        "cover_days": cover_days_from(demand, quantity, cumulative),
+        "today": today,
+        "horizon_days": horizon_days
+    }
+
+def cover_days_from(demand: np.ndarray, quantity: np.ndarray, cumulative: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Günlük talep matrisi D[satır, gün] ve stok vektöründen stokta kalma süresi.
+    Ufuk içinde tükenmeyen satır: inf. (Sandbox simülasyonları da kullanır.)
+    """
+    cumulative = np.cumsum(demand, axis=1) if cumulative is None else cumulative
+    quantity = np.asarray(quantity, dtype=float)
+    n = len(quantity)
+    if n == 0:
+        return np.zeros(0)
+    crossed = cumulative >= quantity[:, None]
+    stocks_out = crossed.any(axis=1)
+    day = crossed.argmax(axis=1)
+
+    # Gün içi doğrusal enterpolasyon: k + (stok - önceki kümülatif) / k. gün talebi
+    row_idx = np.arange(n)
+    previous = np.where(day > 0, cumulative[row_idx, np.maximum(day - 1, 0)], 0.0)
+    day_demand = demand[row_idx, day]
+    cover_days = np.where(
+        stocks_out,
+        day + (quantity - previous) / np.where(day_demand > 0, day_demand, 1.0),
+        np.inf
+    )
+    cover_days[quantity <= 0] = 0.0
+    return cover_days
+
+def _cover_view(base: Dict, cumulative: np.ndarray, horizon_days: int) -> Dict:
+    """Taban sonuçtan kısa ufuk: Talep ve kümülatif matrisler dilimlenir (kopyasız), cover_days yeniden bulunur."""
+    if horizon_days == base["horizon_days"]:
+        return base
+    demand = base["demand"][:, :horizon_days]
+    window = cumulative[:, :horizon_days]
+    return dict(
+        base,
+        demand=demand,
+        demand_7d=window[:, min(7, horizon_days) - 1],
+        cover_days=cover_days_from(demand, base["quantity"].astype(float), window),
+        horizon_days=horizon_days
+    )
+
+def get_cover_snapshot(db: Session, horizon_days: int = COVER_HORIZON_DAYS) -> Dict:
+    """Days-of-cover sonucu; envanter/tahmin değişmedikçe ve gün dönmedikçe cache'ten (ufuk başına dilim)."""
+    horizon_days = max(1, horizon_days)
+    current = versions.get_versions(db, [versions.INVENTORY, versions.FORECAST])
+    key = (current[versions.INVENTORY], current[versions.FORECAST], datetime.date.today())
+    base_horizon = max(horizon_days, COVER_HORIZON_DAYS)
+    with _cover_lock:
+        if _cover_cache["key"] == key:
+            if horizon_days <= _cover_cache["data"]["horizon_days"]:
+                return _cached_cover_view(horizon_days)
+            base_horizon = max(base_horizon, _cover_cache["data"]["horizon_days"])
+
+    data = compute_days_of_cover(db, base_horizon)
+    cumulative = np.cumsum(data["demand"], axis=1)
+    with _cover_lock:
+        _cover_cache.update(key=key, data=data, cumulative=cumulative, views=OrderedDict())
+        return _cached_cover_view(horizon_days)
+
+def _cached_cover_view(horizon_days: int) -> Dict:
+    """Ufuk dilimi LRU'su (_cover_lock altında çağrılır)."""
+    views = _cover_cache["views"]
+    if horizon_days not in views:
+        views[horizon_days] = _cover_view(_cover_cache["data"], _cover_cache["cumulative"], horizon_days)
+        if len(views) > COVER_VIEW_CACHE_SIZE:
+            views.popitem(last=False)
+    views.move_to_end(horizon_days)
+    return views[horizon_days]
+
+def cover_risk_level(cover_days: float) -> str:
+    if cover_days < COVER_CRITICAL_DAYS:
+        return "Yüksek"
+    if cover_days < COVER_WARNING_DAYS:
+        return "Orta"
+    return "Düşük"
+
+def top_cover_risks(cover: Dict, n: int = 10, store_id: Optional[int] = None) -> List[int]:
+    """
+    Stokta kalma süresi en kısa n satırın indeksleri (artan sırada).
+    [OPTIMIZASYON] Tam sıralama yerine argpartition (O(N)) + sadece n elemanı sırala.
+    """
+    candidates = np.arange(len(cover["ids"]))
+    if store_id is not None:
+        candidates = candidates[cover["store_ids"] == store_id]
+    if n <= 0 or len(candidates) == 0:
+        return []
+
+    values = cover["cover_days"][candidates]
+    if n < len(candidates):
+        part = np.argpartition(values, n - 1)[:n]
+    else:
+        part = np.arange(len(candidates))
+    # Eşitlikte envanter sırası (stabil sonuç)
+    part = part[np.lexsort((candidates[part], values[part]))]
+    return candidates[part].tolist()
+
+def cover_row(cover: Dict, idx: int) -> Dict:
+    """Tek envanter satırının days-of-cover özeti."""
+    cover_days = float(cover["cover_days"][idx])
+    finite = np.isfinite(cover_days)
+    return {
+        "inventory_id": int(cover["ids"][idx]),
+        "store_id": int(cover["store_ids"][idx]),
+        "product_id": int(cover["product_ids"][idx]),
+        "stock": int(cover["quantity"][idx]),
+        "safety_stock": int(cover["safety_stock"][idx]),
+        "forecast_7d": round(float(cover["demand_7d"][idx]), 1),
+        "days_of_cover": round(cover_days, 1) if finite else None,
+        "stockout_date": (cover["today"] + datetime.timedelta(days=int(cover_days))).isoformat() if finite else None,
+        "risk": cover_risk_level(cover_days)
+    }
+
+def get_cover_risk_report(db: Session, stores: List[Store], horizon_days: int = COVER_HORIZON_DAYS) -> List[Dict]:
+    """
+    Tahmin bazlı mağaza risk raporu (get_risk_report ile aynı format).
+    Riskli kalem: COVER_WARNING_DAYS içinde tükenecek.
+    Fazla stok: Ufuk boyunca tükenmeyen ve güvenlik stoğunun 3 katını aşan.
+    """
+    cover = get_cover_snapshot(db, horizon_days)
+    store_index = {store.id: pos for pos, store in enumerate(stores)}
+    # Envanter satırlarını rapordaki mağaza pozisyonuna eşle (Raporda olmayanlar -1)
+    lookup = np.full(int(cover["store_ids"].max()) + 1 if len(cover["store_ids"]) else 1, -1, dtype=np.int64)
+    for store_id, pos in store_index.items():
+        if store_id < len(lookup):
+            lookup[store_id] = pos
+    positions = lookup[cover["store_ids"]] if len(cover["store_ids"]) else np.zeros(0, dtype=np.int64)
+    mask = positions >= 0
+    positions = positions[mask]
+    n_stores = len(stores)
+
+    quantity = cover["quantity"][mask]
+    safety = cover["safety_stock"][mask]
+    cover_days = cover["cover_days"][mask]
+
+    total_items = np.bincount(positions, minlength=n_stores)
+    total_stock = np.bincount(positions, weights=quantity, minlength=n_stores)
+    total_safety = np.bincount(positions, weights=safety, minlength=n_stores)
+    high_risk = np.bincount(positions, weights=cover_days < COVER_WARNING_DAYS, minlength=n_stores)
+    overstock = np.bincount(positions, weights=~np.isfinite(cover_days) & (quantity > safety * 3), minlength=n_stores)
+
+    report = []
+    for pos, store in enumerate(stores):
+        status = classify_risk(int(total_items[pos]), int(high_risk[pos]), int(overstock[pos]))
+        report.append({
+            "store_id": store.id,
+            "name": store.name,
+            "type": store.store_type.value,
+            "stock": int(total_stock[pos]),
+            "safety_stock": int(total_safety[pos]),
+            "status": status,
+            "color": FRONTEND_COLORS.get(status, "gray")
+        })
+    return report
+
@@ -0,0 +1,246 @@
+from models import Store, Inventory, Product, StoreRiskSummary, RiskSnapshot, DataVersion
+from risk_engine import classify_risk, refresh_store_risk_summary
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import func, case, or_
+from sqlalchemy.exc import IntegrityError
+from core.logger import logger
+import datetime
+import math
+import threading
+import uuid
+
+# ==========================================
+# 📈 RİSK GEÇMİŞİ (RUN-LENGTH ENCODING)
+# ==========================================
+# [OPTIMIZASYON] Her örnekte her mağaza/kategori için yeni satır yazılmaz.
+# Sayaçlar bir önceki örnekle aynıysa son koşunun (run) period_end'i ilerletilir.
+# Tüm örnek tek SELECT (son koşular) + tek UPDATE + tek toplu INSERT ile yazılır.
+
+HISTORY_SCOPES = ("store", "category")
+HISTORY_BUCKETS = {"hour": 3600, "day": 86400, "week": 7 * 86400}
+MAX_HISTORY_POINTS = 2000
+COUNTER_FIELDS = ("status", "total_items", "total_stock", "high_risk_count", "overstock_count")
+
+def collect_risk_counters(db: Session) -> List[Dict]:
+    """
+    Anlık risk sayaçları: Mağaza bazlı (materialized store_risk_summary'den, O(mağaza))
+    ve kategori bazlı (envanter x ürün tek GROUP BY).
+    """
+    store_ids = [row[0] for row in db.query(Store.id).all()]
+    summary_rows = db.query(
+        StoreRiskSummary.store_id, StoreRiskSummary.status, StoreRiskSummary.total_items,
+        StoreRiskSummary.total_stock, StoreRiskSummary.high_risk_count, StoreRiskSummary.overstock_count
+    ).all()
+    missing = set(store_ids) - {row[0] for row in summary_rows}
+    if missing:
+        refresh_store_risk_summary(db, missing)
+        summary_rows = db.query(
+            StoreRiskSummary.store_id, StoreRiskSummary.status, StoreRiskSummary.total_items,
+            StoreRiskSummary.total_stock, StoreRiskSummary.high_risk_count, StoreRiskSummary.overstock_count
+        ).all()
+
+    counters = [
+        {
+            "scope_type": "store",
+            "scope_key": str(row[0]),
+            "status": row[1],
+            "total_items": row[2] or 0,
+            "total_stock": row[3] or 0,
+            "high_risk_count": row[4] or 0,
+            "overstock_count": row[5] or 0
+        }
+        for row in summary_rows
+    ]
+
+    category_rows = db.query(
+        Product.category,
+        func.count(Inventory.id),
+        func.sum(Inventory.quantity),
+        func.sum(case((Inventory.quantity < Inventory.safety_stock, 1), else_=0)),
+        func.sum(case((Inventory.quantity > Inventory.safety_stock * 3, 1), else_=0))
+    ).join(Product, Product.id == Inventory.product_id).group_by(Product.category).all()
+
+    for category, total_items, total_stock, high_risk, overstock in category_rows:
+        total_items = total_items or 0
+        high_risk = high_risk or 0
+        overstock = overstock or 0
+        counters.append({
+            "scope_type": "category",
+            "scope_key": category or "",
+            "status": classify_risk(total_items, high_risk, overstock),
+            "total_items": total_items,
+            "total_stock": total_stock or 0,
+            "high_risk_count": high_risk,
+            "overstock_count": overstock
+        })
+    return counters
+
+def snapshot_max_gap(interval_minutes: int) -> Optional[datetime.timedelta]:
+    """Koşunun uzatılabileceği en büyük boşluk: İki örnek aralığı (kaçırılan tek örneği tolere eder)."""
+    return datetime.timedelta(minutes=interval_minutes * 2) if interval_minutes > 0 else None
+
+def take_risk_snapshot(db: Session, now: Optional[datetime.datetime] = None,
+                       max_gap: Optional[datetime.timedelta] = None) -> Dict[str, int]:
+    """
+    Tek örnek alır ve RLE olarak yazar.
+    max_gap: Son koşu bu süreden eskiyse (örnekleyici durmuşsa) değerler aynı olsa da
+    yeni koşu açılır; aradaki boşluk geçmişte "veri yok" olarak görünür.
+    Commit ETMEZ.
+    """
+    now = now or datetime.datetime.utcnow()
+    counters = collect_risk_counters(db)
+
+    # Her kapsamın son koşusu (Tek sorgu: scope başına max id)
+    latest_ids = db.query(func.max(RiskSnapshot.id)).group_by(RiskSnapshot.scope_type, RiskSnapshot.scope_key)
+    latest = {
+        (run.scope_type, run.scope_key): run
+        for run in db.query(RiskSnapshot).filter(RiskSnapshot.id.in_(latest_ids.scalar_subquery())).all()
+    }
+
+    extend_ids = []
+    new_runs = []
+    for counter in counters:
+        run = latest.get((counter["scope_type"], counter["scope_key"]))
+        unchanged = run is not None and all(getattr(run, field) == counter[field] for field in COUNTER_FIELDS)
+        fresh = run is not None and (max_gap is None or now - run.period_end <= max_gap)
+        if unchanged and fresh:
+            extend_ids.append(run.id)
+        else:
+            new_runs.append(dict(counter, period_start=now, period_end=now, samples=1))
+
+    table = RiskSnapshot.__table__
+    if extend_ids:
+        db.execute(
+            table.update()
+            .where(table.c.id.in_(extend_ids))
+            .values(period_end=now, samples=table.c.samples + 1)
+        )
+    if new_runs:
+        db.execute(table.insert(), new_runs)
+
+    return {"extended": len(extend_ids), "inserted": len(new_runs)}
+
+def query_risk_history(db: Session, scope_type: str, scope_key: str, start: datetime.datetime,
+                       end: datetime.datetime, bucket: str = "day") -> List[Dict]:
+    """
+    [start, end) aralığını bucket genişliğinde noktalara indirger (downsampling).
+    Her nokta, aralıkla kesişen son koşunun değerleri ve aralıktaki en kötü
+    high_risk_count'u taşır. Koşu yoksa değerler None'dır.
+
+    Koşular sıralı ve çakışmasız olduğundan tek geçişte (iki işaretçi) hesaplanır:
+    Maliyet O(koşu + nokta), ham örnek sayısından bağımsızdır.
+    """
+    if bucket not in HISTORY_BUCKETS:
+        raise ValueError(f"Geçersiz bucket: {bucket}")
+    step = datetime.timedelta(seconds=HISTORY_BUCKETS[bucket])
+    n_points = math.ceil((end - start) / step)
+    if n_points <= 0:
+        return []
+    if n_points > MAX_HISTORY_POINTS:
+        raise ValueError(f"Çok fazla nokta ({n_points}). Daha geniş bir bucket seçin.")
+
+    runs = db.query(RiskSnapshot).filter(
+        RiskSnapshot.scope_type == scope_type,
+        RiskSnapshot.scope_key == scope_key,
+        RiskSnapshot.period_end >= start,
+        RiskSnapshot.period_start < end
+    ).order_by(RiskSnapshot.period_start).all()
+
+    points = []
+    first = 0
+    for b in range(n_points):
+        bucket_start = start + step * b
+        bucket_end = min(bucket_start + step, end)
+        # Bu aralıktan önce biten koşuları atla
+        while first < len(runs) and runs[first].period_end < bucket_start:
+            first += 1
+
+        last_run = None
+        worst = None
+        j = first
+        while j < len(runs) and runs[j].period_start < bucket_end:
+            last_run = runs[j]
+            worst = runs[j].high_risk_count if worst is None else max(worst, runs[j].high_risk_count)
+            j += 1
+
+        point = {"t": bucket_start.isoformat()}
+        for field in COUNTER_FIELDS:
+            point[field] = getattr(last_run, field) if last_run else None
+        point["max_high_risk_count"] = worst
+        points.append(point)
+    return points
+
+# ==========================================
+# ⏱️ PERİYODİK ÖRNEKLEYİCİ
+# ==========================================
+# Her worker süreci kendi thread'ini başlatır; örneği interval başına tek worker alır.
+# Slot data_versions tablosundaki bir kira (lease) satırıyla DB seviyesinde paylaşılır:
+# Koşullu tek UPDATE atomiktir, satır kilidi örnekle aynı transaction'da commit'e kadar
+# tutulur. Eşzamanlı worker 0 satır günceller ve örneği atlar (Koşular N kez uzamaz).
+SNAPSHOT_LEASE = "risk_snapshotter"
+SNAPSHOT_SLOT_FRACTION = 0.9 # Slot, son örnek interval'ın %90'ından eskiyse alınır (zamanlayıcı kayması payı)
+
+_snapshotter_stop = threading.Event()
+_snapshotter_thread = None
+
+def claim_snapshot_slot(db: Session, now: datetime.datetime, interval_minutes: int) -> bool:
+    """
+    Periyodik örnek slotunu bu worker için alır; başka worker bu interval'da örnek
+    aldıysa False döner. Commit ETMEZ: Örnek yazımıyla aynı transaction'da commit edilmelidir.
+    """
+    table = DataVersion.__table__
+    threshold = now - datetime.timedelta(minutes=interval_minutes * SNAPSHOT_SLOT_FRACTION)
+    result = db.execute(
+        table.update()
+        .where(table.c.name == SNAPSHOT_LEASE, or_(table.c.updated_at.is_(None), table.c.updated_at <= threshold))
+        .values(token=uuid.uuid4().hex, updated_at=now)
+    )
+    if result.rowcount:
+        return True
+    if db.query(DataVersion.name).filter(DataVersion.name == SNAPSHOT_LEASE).first() is not None:
+        return False
+
+    # İlk örnek: Kira satırını oluşturan worker slotu alır (name birincil anahtar)
+    try:
+        db.add(DataVersion(name=SNAPSHOT_LEASE, token=uuid.uuid4().hex, updated_at=now))
+        db.flush()
+        return True
+    except IntegrityError:
+        db.rollback()
+        return False
+
+def start_risk_snapshotter(session_factory, interval_minutes: int):
+    """Arka planda her interval_minutes dakikada bir örnek alan daemon thread başlatır."""
+    global _snapshotter_thread
+    if interval_minutes <= 0 or (_snapshotter_thread and _snapshotter_thread.is_alive()):
+        return
+
+    interval = interval_minutes * 60
+    max_gap = snapshot_max_gap(interval_minutes)
+
+    def run():
+        while not _snapshotter_stop.is_set():
+            db = session_factory()
+            try:
+                now = datetime.datetime.utcnow()
+                if claim_snapshot_slot(db, now, interval_minutes):
+                    result = take_risk_snapshot(db, now=now, max_gap=max_gap)
+                    db.commit()
+                    logger.info(f"Risk snapshot: {result['extended']} extended, {result['inserted']} new runs")
+                else:
+                    db.rollback()
+                    logger.info("Risk snapshot skipped: taken by another worker this interval")
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Risk Snapshot Error: {e}")
+            finally:
+                db.close()
+            _snapshotter_stop.wait(interval)
+
+    _snapshotter_stop.clear()
+    _snapshotter_thread = threading.Thread(target=run, name="risk-snapshotter", daemon=True)
+    _snapshotter_thread.start()
+
+def stop_risk_snapshotter():
+    _snapshotter_stop.set()
@@ -0,0 +1,98 @@
+from models import Sale, DailySalesRollup, StoreDailySalesRollup, DataVersion
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from core.logger import logger
+from typing import Optional
+import datetime
+
+# ==========================================
+# 📅 GÜNLÜK SATIŞ ROLLUP'I
+# ==========================================
+# [OPTIMIZASYON] Satış analizleri ham sales tablosu yerine ürün x gün (ve mağaza x ürün x gün)
+# özetlerinden okunur.
+# Satışlar sadece eklenir (append-only). Bu yüzden rollup'ın hangi satışa kadar
+# işlendiği tek bir sayıyla (max sale id = watermark) izlenir:
+#   - Yeni satış geldiyse: Sadece yeni satırların dokunduğu günler yeniden hesaplanır.
+#   - Watermark geriye gittiyse (reset / silme): Tam yeniden kurulum.
+# Kontrol MAX(id) ile yapılır (PK index'inden, tablo taranmaz).
+
+ROLLUP_WATERMARK = "sales_rollup"             # data_versions satırı: token = işlenen son sale id
+STORE_ROLLUP_WATERMARK = "store_sales_rollup"
+
+# (watermark adı, rollup modeli, gruplama kolonları)
+ROLLUPS = (
+    (ROLLUP_WATERMARK, DailySalesRollup, ("product_id", "date")),
+    (STORE_ROLLUP_WATERMARK, StoreDailySalesRollup, ("store_id", "product_id", "date")),
+)
+
+def _rebuild_dates(db: Session, model, keys, dates: Optional[list] = None):
+    """Verilen günlerin (None -> tümü) rollup satırlarını tek INSERT ... SELECT ile yeniden yazar."""
+    table = model.__table__
+    group_columns = [getattr(Sale, key) for key in keys]
+    delete_query = table.delete()
+    source = select(
+        *group_columns,
+        func.sum(Sale.quantity),
+        func.sum(Sale.total_price),
+        func.count(Sale.id)
+    )
+    if dates is not None:
+        delete_query = delete_query.where(table.c.date.in_(dates))
+        source = source.where(Sale.date.in_(dates))
+    source = source.group_by(*group_columns)
+
+    db.execute(delete_query)
+    db.execute(table.insert().from_select(
+        [*keys, "quantity", "revenue", "sale_count"], source
+    ))
+
+def ensure_sales_rollup(db: Session) -> int:
+    """
+    Rollup'ları (ürün x gün, mağaza x ürün x gün) güncel satışlara getirir ve güncel watermark'ı döner.
+    Değişiklik yoksa sadece iki küçük sorgu atar (kilit yok). Güncelleme yaptıysa commit eder.
+    Dönüş değeri, rollup'tan türeyen cache'ler için anahtar olarak kullanılabilir.
+    """
+    current_max = db.query(func.max(Sale.id)).scalar() or 0
+    tokens = dict(db.query(DataVersion.name, DataVersion.token).filter(
+        DataVersion.name.in_([rollup[0] for rollup in ROLLUPS])
+    ).all())
+    stale = [rollup for rollup in ROLLUPS if tokens.get(rollup[0]) != str(current_max)]
+    if not stale:
+        return current_max # Güncel: Kilit alınmaz
+
+    touched_dates = {} # Aynı watermark'tan gelen rollup'lar gün listesini paylaşır
+    for name, model, keys in stale:
+        # Güncelleme gerekli: Watermark satırını kilitle (Eşzamanlı yenilemeler sıraya girer)
+        mark = db.query(DataVersion).filter(DataVersion.name == name).with_for_update().first()
+        processed = int(mark.token) if mark and mark.token and mark.token.isdigit() else None
+        if processed == current_max:
+            continue # Başka bir istek yeniledi
+
+        if processed is None or current_max < processed:
+            _rebuild_dates(db, model, keys)
+            logger.info(f"Sales rollup {name} rebuilt (watermark {processed} -> {current_max})")
+        else:
+            if processed not in touched_dates:
+                touched_dates[processed] = [
+                    row[0] for row in db.query(Sale.date).filter(Sale.id > processed).distinct().all()
+                ]
+            _rebuild_dates(db, model, keys, touched_dates[processed])
+            logger.info(f"Sales rollup {name} refreshed for {len(touched_dates[processed])} day(s)")
+
+        if mark is None:
+            mark = DataVersion(name=name)
+            db.add(mark)
+        mark.token = str(current_max)
+        mark.updated_at = datetime.datetime.utcnow()
+    db.commit()
+    return current_max
+
+def rollup_anchor_date(db: Session) -> Optional[datetime.date]:
+    """
+    Kayan pencerelerin bitiş günü: Bugün veya (veri daha eskiyse) son satış günü.
+    Demo/backtest verisinde satışlar geçmişte kalabilir; pencere boş kalmasın.
+    """
+    last_date = db.query(func.max(DailySalesRollup.date)).scalar()
+    if last_date is None:
+        return None
+    return min(last_date, datetime.date.today())
@@ -0,0 +1,262 @@
+from models import Store, Product, StoreType
+from risk_engine import get_cover_snapshot, cover_days_from, classify_risk, COVER_WARNING_DAYS
+from core import versions
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+import numpy as np
+import datetime
+import threading
+
+# ==========================================
+# 🧪 SANDBOX SİMÜLASYONU (Copy-on-Write)
+# ==========================================
+# [OPTIMIZASYON] Senaryolar canlı Inventory/Sale satırlarını değiştirmez ve commit etmez.
+# Envanter, fiyat ve tahminler bir kez NumPy dizilerine yüklenir (salt okunur snapshot;
+# envanter/tahmin/ürün versiyonları değişene kadar cache'te). Her çalıştırma stok
+# vektörünün bir kopyası üzerinde senaryo operatörlerini uygular ve KPI + risk
+# farklarını döner. Veritabanına hiç yazılmadığı için eşzamanlı çalıştırmak güvenlidir.
+
+SANDBOX_SCENARIOS = ("sales_boom", "recession", "supply_shock", "custom")
+CRITICAL_STORE_STOCK = 100 # /api/simulate/stats ile aynı "kritik mağaza" eşiği
+PRICE_ELASTICITY = 1.5     # simulate_custom_scenario ile aynı varsayımlar
+CUSTOM_DAILY_SALES = 2
+CUSTOM_BASE_SALES = 5
+
+_snapshot_cache = {"key": None, "data": None}
+_snapshot_lock = threading.Lock()
+
+def _readonly(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+def load_sandbox_snapshot(db: Session) -> Dict:
+    """
+    Simülasyonların okuduğu salt okunur snapshot.
+    Envanter + tahmin talep matrisi days-of-cover snapshot'ından paylaşılır; üzerine
+    satır bazlı fiyat ve mağaza tipi eklenir.
+    """
+    current = versions.get_versions(db, [versions.INVENTORY, versions.FORECAST, versions.PRODUCTS])
+    key = (current[versions.INVENTORY], current[versions.FORECAST], current[versions.PRODUCTS], datetime.date.today())
+    with _snapshot_lock:
+        if _snapshot_cache["key"] == key:
+            return _snapshot_cache["data"]
+
+    cover = get_cover_snapshot(db)
+    stores = db.query(Store.id, Store.name, Store.store_type).order_by(Store.id).all()
+    store_ids = np.array([row[0] for row in stores], dtype=np.int64)
+    prices = dict(db.query(Product.id, Product.price).all())
+
+    store_pos = np.searchsorted(store_ids, cover["store_ids"]) if len(store_ids) else np.zeros(0, dtype=np.int64)
+    is_retail = np.array([row[2] == StoreType.STORE for row in stores], dtype=bool)
+    data = {
+        "store_ids": _readonly(store_ids),
+        "store_names": [row[1] for row in stores],
+        "store_pos": _readonly(store_pos),
+        "retail_rows": _readonly(is_retail[store_pos] if len(stores) else np.zeros(0, dtype=bool)),
+        "retail_stores": _readonly(is_retail),
+        "product_ids": cover["product_ids"],
+        "quantity": _readonly(np.array(cover["quantity"], dtype=np.int64)),
+        "safety_stock": _readonly(np.array(cover["safety_stock"], dtype=np.int64)),
+        "price": _readonly(np.array([prices.get(int(p)) or 0.0 for p in cover["product_ids"]], dtype=float)),
+        "demand": cover["demand"],
+        "today": cover["today"]
+    }
+    with _snapshot_lock:
+        _snapshot_cache["key"] = key
+        _snapshot_cache["data"] = data
+    return data
+
+# ==========================================
+# ⚙️ SENARYO OPERATÖRLERİ
+# ==========================================
+# Her operatör stok kopyasını (quantity) yerinde değiştirir ve etkisini döner.
+# Mantık canlı simülasyonlarla (simulation_engine) aynıdır; döngüler vektörel.
+
+def _sales_boom(snapshot: Dict, quantity: np.ndarray, rng: np.random.Generator, step: Dict) -> Dict:
+    # Perakende mağazaların %70'i etkilenir; stokun %50-%90'ı satılır
+    affected_stores = snapshot["retail_stores"] & (rng.random(len(snapshot["store_ids"])) > 0.3)
+    rows = affected_stores[snapshot["store_pos"]] & (quantity > 0)
+    sold = np.zeros_like(quantity)
+    sold[rows] = (quantity[rows] * rng.uniform(0.5, 0.9, rows.sum())).astype(np.int64)
+    quantity -= sold
+    return {
+        "impacted_stores": int(affected_stores.sum()),
+        "units_sold": int(sold.sum()),
+        "revenue": float((sold * snapshot["price"]).sum()),
+        "stock_change": -int(sold.sum())
+    }
+
+def _recession(snapshot: Dict, quantity: np.ndarray, rng: np.random.Generator, step: Dict) -> Dict:
+    # Perakende mağazalara güvenlik stoğunun 1-3 katı kadar satılmayan stok eklenir
+    rows = snapshot["retail_rows"]
+    added = np.zeros_like(quantity)
+    added[rows] = (snapshot["safety_stock"][rows] * rng.uniform(1.0, 3.0, rows.sum())).astype(np.int64)
+    quantity += added
+    return {"units_added": int(added.sum()), "revenue": 0.0, "stock_change": int(added.sum())}
+
+def _supply_shock(snapshot: Dict, quantity: np.ndarray, rng: np.random.Generator, step: Dict) -> Dict:
+    # Tüm ağda (Hub ve Center dahil) pozitif stokların yarısı kaybolur
+    lost = np.where(quantity > 0, quantity // 2, 0)
+    quantity -= lost
+    return {"units_lost": int(lost.sum()), "revenue": 0.0, "stock_change": -int(lost.sum())}
+
+def _custom(snapshot: Dict, quantity: np.ndarray, rng: np.random.Generator, step: Dict) -> Dict:
+    price_change = step.get("price_change", 0)
+    delay_days = step.get("delay_days", 0)
+    elasticity = step.get("elasticity", PRICE_ELASTICITY)
+    demand_change = -1 * (price_change / 100.0) * elasticity if price_change else 0.0
+
+    rows = snapshot["retail_rows"] & (quantity > 0)
+    lost = np.zeros_like(quantity)
+    lost[rows] = np.minimum(quantity[rows], CUSTOM_DAILY_SALES * delay_days)
+    quantity -= lost
+
+    selling = rows & (quantity > 0)
+    unit_revenue = CUSTOM_BASE_SALES * (1 + demand_change) * (1 + price_change / 100.0)
+    revenue = float((snapshot["price"][selling] * unit_revenue).sum())
+    return {"units_lost": int(lost.sum()), "revenue": revenue, "stock_change": -int(lost.sum())}
+
+SCENARIO_OPERATORS = {
+    "sales_boom": _sales_boom,
+    "recession": _recession,
+    "supply_shock": _supply_shock,
+    "custom": _custom
+}
+
+# ==========================================
+# 📊 KPI VE RİSK FARKLARI
+# ==========================================
+
+def sandbox_kpis(snapshot: Dict, quantity: np.ndarray) -> Dict:
+    """Stok vektörü için ağ KPI'ları ve mağaza bazlı risk durumları (bincount ile, döngüsüz)."""
+    n_stores = len(snapshot["store_ids"])
+    store_pos = snapshot["store_pos"]
+    safety = snapshot["safety_stock"]
+
+    items = np.bincount(store_pos, minlength=n_stores)
+    high_risk = np.bincount(store_pos, weights=quantity < safety, minlength=n_stores).astype(np.int64)
+    overstock = np.bincount(store_pos, weights=quantity > safety * 3, minlength=n_stores).astype(np.int64)
+    store_stock = np.bincount(store_pos, weights=quantity, minlength=n_stores).astype(np.int64)
+    statuses = [classify_risk(int(items[i]), int(high_risk[i]), int(overstock[i])) for i in range(n_stores)]
+
+    cover = cover_days_from(snapshot["demand"], quantity)
+    status_counts = {}
+    for status in statuses:
+        status_counts[status] = status_counts.get(status, 0) + 1
+
+    return {
+        "total_stock": int(quantity.sum()),
+        "stock_value": float((np.maximum(quantity, 0) * snapshot["price"]).sum()),
+        "stockout_items": int((quantity <= 0).sum()),
+        "high_risk_items": int(high_risk.sum()),
+        "overstock_items": int(overstock.sum()),
+        "cover_risk_items": int((cover < COVER_WARNING_DAYS).sum()),
+        "critical_stores": int(((store_stock < CRITICAL_STORE_STOCK) & (items > 0)).sum()),
+        "store_status_counts": status_counts,
+        "_statuses": statuses
+    }
+
+def run_sandbox(db: Session, steps: List[Dict], seed: Optional[int] = None) -> Dict:
+    """
+    Senaryo adımlarını sırayla stok kopyasına uygular. Veritabanına yazmaz.
+    steps: [{"scenario": "sales_boom" | "recession" | "supply_shock" | "custom",
+             "price_change": int, "delay_days": int}, ...]
+    """
+    for step in steps:
+        if step["scenario"] not in SANDBOX_SCENARIOS:
+            raise ValueError(f"Geçersiz senaryo: {step['scenario']}")
+
+    snapshot = load_sandbox_snapshot(db)
+    rng = np.random.default_rng(seed)
+    quantity = snapshot["quantity"].copy() # Copy-on-write: Snapshot paylaşılır, kopya değişir
+
+    before = sandbox_kpis(snapshot, snapshot["quantity"])
+    step_results = []
+    total_revenue = 0.0
+    for step in steps:
+        effect = SCENARIO_OPERATORS[step["scenario"]](snapshot, quantity, rng, step)
+        total_revenue += effect["revenue"]
+        step_results.append(dict(effect, scenario=step["scenario"]))
+    after = sandbox_kpis(snapshot, quantity)
+
+    before_statuses, after_statuses = before.pop("_statuses"), after.pop("_statuses")
+    store_changes = [
+        {
+            "store_id": int(snapshot["store_ids"][i]),
+            "name": snapshot["store_names"][i],
+            "before": before_statuses[i],
+            "after": after_statuses[i]
+        }
+        for i in range(len(before_statuses)) if before_statuses[i] != after_statuses[i]
+    ]
+    numeric_keys = [key for key, value in before.items() if isinstance(value, (int, float))]
+
+    return {
+        "seed": seed,
+        "steps": step_results,
+        "revenue": total_revenue,
+        "before": before,
+        "after": after,
+        "delta": {key: after[key] - before[key] for key in numeric_keys},
+        "store_risk_changes": store_changes
+    }
+
+# ==========================================
+# 🗺️ PARAMETRE IZGARASI TARAMASI (Custom Senaryo)
+# ==========================================
+# [OPTIMIZASYON] Custom senaryonun sonucu sadece iki gecikme fonksiyonuna bağlıdır:
+#   stok kaybı(d) = -Σ min(q, 2d)          (q > 0 olan perakende satırlar)
+#   ciro(p, d, e) = 5 (1 - p e) (1 + p) Σ fiyat   (q > 2d olan satırlar)
+# Stoklar bir kez sıralanır; her gecikme değeri searchsorted + kümülatif toplamla
+# O(log N) çözülür, fiyat x gecikme x elastisite ızgarası tek yayınlamayla (broadcast)
+# hesaplanır. Tüm noktalar aynı snapshot'ı paylaşır, veritabanına yazılmaz.
+
+MAX_SWEEP_POINTS = 20000
+
+def sweep_custom_scenario(db: Session, price_changes: List[float], delay_days: List[int],
+                          elasticities: List[float]) -> Dict:
+    """
+    Custom senaryonun (bkz. simulate_custom_scenario) tüm ızgara noktaları için ciro ve
+    stok etkisi. Yüzeyler [elastisite][fiyat][gecikme] sırasıyla iç içe listelerdir (heatmap).
+    """
+    snapshot = load_sandbox_snapshot(db)
+    rows = snapshot["retail_rows"] & (snapshot["quantity"] > 0)
+    order = np.argsort(snapshot["quantity"][rows], kind="stable")
+    quantity = snapshot["quantity"][rows][order].astype(float)
+    price = snapshot["price"][rows][order]
+
+    # Gecikme boyutu: Kayıp = min(q, 2d) toplamı, satış yapan satırlar q > 2d
+    lost_cap = CUSTOM_DAILY_SALES * np.asarray(delay_days, dtype=float)
+    split = np.searchsorted(quantity, lost_cap, side="right") # q <= 2d olan satır sayısı
+    quantity_prefix = np.r_[0.0, np.cumsum(quantity)]
+    price_suffix = np.r_[np.cumsum(price[::-1])[::-1], 0.0]
+    stock_impact = -(quantity_prefix[split] + lost_cap * (len(quantity) - split))
+    selling_price_total = price_suffix[split]
+
+    # Fiyat x elastisite boyutu: Birim ciro çarpanı
+    change = np.asarray(price_changes, dtype=float)[None, :] / 100.0
+    elasticity = np.asarray(elasticities, dtype=float)[:, None]
+    unit_revenue = CUSTOM_BASE_SALES * (1 - change * elasticity) * (1 + change)
+
+    revenue = unit_revenue[:, :, None] * selling_price_total[None, None, :] # [e, p, d]
+    baseline = CUSTOM_BASE_SALES * float(price.sum()) # Fiyat değişimi ve gecikme yok
+    best = np.unravel_index(np.argmax(revenue), revenue.shape) if revenue.size else None
+
+    return {
+        "axes": {
+            "elasticity": [float(e) for e in elasticities],
+            "price_change": [float(p) for p in price_changes],
+            "delay_days": [int(d) for d in delay_days]
+        },
+        "baseline_revenue": baseline,
+        "revenue": revenue.tolist(),
+        "revenue_change": (revenue - baseline).tolist(),
+        "stock_change": stock_impact.tolist(), # Sadece gecikmeye bağlı
+        "best": {
+            "elasticity": float(elasticities[best[0]]),
+            "price_change": float(price_changes[best[1]]),
+            "delay_days": int(delay_days[best[2]]),
+            "revenue": float(revenue[best])
+        } if best is not None else None,
+        "points": int(revenue.size)
+    }
@@ -1,8 +1,10 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, select, func
 from models import Store, Inventory, Sale, Product, StoreType
 from seed import seed_data
 from database import engine, Base
+from core import versions
+from risk_engine import refresh_store_risk_summary
 import random
 from datetime import date
 
@@ -34,7 +36,6 @@ def simulate_sales_boom(db: Session):
                         sale = Sale(
                             store_id=store.id,
                             product_id=item.product_id,
-                            customer_id=1, # Dummy customer
                             date=date.today(),
                             quantity=sold_qty,
                             total_price=sold_qty * item.product.price
@@ -42,6 +43,8 @@ def simulate_sales_boom(db: Session):
                         db.add(sale)
                         total_sales_generated += sold_qty
 
+    refresh_store_risk_summary(db) # Tüm ağ etkilendi: Tek GROUP BY ile yenile
+    versions.bump_version(db, versions.INVENTORY)
     db.commit()
     return f"Talep Patlaması Simüle Edildi: {impacted_count} mağazada toplam {total_sales_generated} ürün satıldı. Stoklar eridi!"
 
@@ -63,6 +66,8 @@ def simulate_recession(db: Session):
             unsold_qty = int(item.safety_stock * random.uniform(1.0, 3.0))
             item.quantity += unsold_qty
             
+    refresh_store_risk_summary(db) # Tüm ağ etkilendi: Tek GROUP BY ile yenile
+    versions.bump_version(db, versions.INVENTORY)
     db.commit()
     return f"Durgunluk Simüle Edildi: Tüm mağazalarda stoklar şişirildi (Overstock durumu yaratıldı)."
 
@@ -72,18 +77,26 @@ def simulate_supply_shock(db: Session):
     Tüm stokları (Hub ve Center dahil) %50 siler.
     Etki: Küresel yokluk.
     
-    [OPTIMIZASYON] yield_per ile 1000'erli paketler halinde işlenir.
+    [OPTIMIZASYON] Satırlar belleğe çekilmez: Tek set-based UPDATE (quantity - quantity // 2).
+    (Eski yield_per döngüsü ORM unique() kısıtına takılıyordu.)
     """
-    # Batch Processing (Memory Friendly)
-    query = db.query(Inventory).execution_options(yield_per=1000)
-    total_lost = 0
-    
-    for item in query:
-        if item.quantity > 0:
-            lost_qty = int(item.quantity * 0.5)
-            item.quantity -= lost_qty
-            total_lost += lost_qty
+    inventory_table = Inventory.__table__
+    lost_expr = inventory_table.c.quantity // 2 # int(quantity * 0.5) ile aynı (pozitif stok)
+
+    total_lost = db.execute(
+        select(func.sum(lost_expr)).where(inventory_table.c.quantity > 0)
+    ).scalar() or 0
+    db.execute(
+        inventory_table.update()
+        .where(inventory_table.c.quantity > 0)
+        .values(
+            quantity=inventory_table.c.quantity - lost_expr,
+            version=inventory_table.c.version + 1 # ORM yazanlar bu değişikliği çakışma olarak görsün
+        )
+    )
             
+    refresh_store_risk_summary(db) # Tüm ağ etkilendi: Tek GROUP BY ile yenile
+    versions.bump_version(db, versions.INVENTORY)
     db.commit()
     return f"Tedarik Krizi Simüle Edildi: Lojistik hatlarında {total_lost} ürün kaybedildi."
 
@@ -132,6 +145,8 @@ def simulate_custom_scenario(db: Session, price_change: int, delay_days: int):
                     revenue_impact = new_sales * item.product.price * (1 + price_change/100.0)
                     total_revenue_impact += revenue_impact
 
+    refresh_store_risk_summary(db) # Tüm ağ etkilendi: Tek GROUP BY ile yenile
+    versions.bump_version(db, versions.INVENTORY)
     db.commit()
     
     direction = "Artış" if total_revenue_impact > 0 else "Düşüş"
@@ -157,5 +172,12 @@ def reset_database(db: Session):
     
     # 2. Seed işlemini çalıştır
     seed_data()
+
+    # 3. Risk özetini yeni envanterden kur
+    refresh_store_risk_summary(db)
+
+    # 4. Tüm veri versiyonlarını yenile (Reset öncesi cache'ler bir daha eşleşmesin)
+    versions.bump_version(db, versions.INVENTORY, versions.FORECAST, versions.ROUTE_PENALTIES, versions.PRODUCTS)
+    db.commit()
     
     return "Sistem Fabrika Ayarlarına Döndürüldü (Reset)."
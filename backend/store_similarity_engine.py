@@ -0,0 +1,204 @@
+from models import Store, StoreFeatures, Sale, Product
+from core.logger import logger
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+import numpy as np
+import threading
+
+# ==========================================
+# 🏬 MAĞAZA BENZERLİK SERVİSİ (STORE k-NN)
+# ==========================================
+# [OPTIMIZASYON] Proxy mağaza seçimi her seri için "aynı tipteki her mağazaya
+# SELECT ... FIRST" döngüsü yapmaz. Süreç içinde iki yapı tutulur:
+#   1. Komşu sıralaması: Her mağaza için aynı tipteki diğer mağazalar, çevresel
+#      özellikler (StoreFeatures, z-score) + konum (haversine) birleşik mesafesine
+#      göre önceden sıralanmış (n x n, vektörel).
+#   2. Veri bulunurluk bitmap'i: Kullanılan her veri eşiği (min_rows) için
+#      (mağaza, ürün) -> "en az min_rows satış kaydı var" biti, ürün ekseninde
+#      paketli (hücre başına 1 bit). Tek GROUP BY ... HAVING ile kurulur; yeni
+#      satışlarda sadece watermark'tan sonra satış gören çiftler yeniden sayılır.
+# Proxy seçimi = komşu sırasında biti açık ilk mağaza (dizi okuması).
+# Konum, mağaza tipi veya StoreFeatures değerleri değişince (katalog imzası)
+# komşu sıralaması baştan kurulur.
+
+FEATURE_WEIGHT = 1.0
+GEO_WEIGHT = 1.0
+FEATURE_COLUMNS = ("competitor_density", "population_density", "income_level")
+DEFAULT_THRESHOLDS = (1,) # Açılışta kurulan bitmap'ler; diğer eşikler ilk kullanımda eklenir
+
+def haversine_matrix(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Tüm nokta çiftleri arası haversine mesafesi (km), vektörel."""
+    R = 6371
+    lat_r, lon_r = np.radians(lat), np.radians(lon)
+    dlat = lat_r[:, None] - lat_r[None, :]
+    dlon = lon_r[:, None] - lon_r[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat_r)[:, None] * np.cos(lat_r)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * R * np.arctan2(np.sqrt(a), np.sqrt(np.maximum(1 - a, 0)))
+
+def _scaled(distances: np.ndarray) -> np.ndarray:
+    """Mesafeyi sıfır olmayan çiftlerin medyanına böler (Farklı birimler aynı ölçeğe gelir)."""
+    positive = distances[distances > 0]
+    return distances / np.median(positive) if len(positive) else distances
+
+def _catalog_signature(db: Session) -> tuple:
+    """
+    Komşu sıralamasını etkileyen verinin imzası: Mağaza konum/tip satırları ve
+    StoreFeatures satırlarının tamamı (mağaza başına bir satırlık boyut tabloları) +
+    max ürün id. Herhangi bir konum / tip / özellik düzenlemesi imzayı değiştirir.
+    """
+    stores = db.query(Store.id, Store.store_type, Store.lat, Store.lon).order_by(Store.id).all()
+    features = db.query(StoreFeatures.id, StoreFeatures.store_id, StoreFeatures.store_type,
+                        *[getattr(StoreFeatures, column) for column in FEATURE_COLUMNS]).order_by(StoreFeatures.id).all()
+    return hash((tuple(map(tuple, stores)), tuple(map(tuple, features)))), len(stores), len(features)
+
+class StoreSimilarityIndex:
+    """Mağaza komşulukları ve (mağaza, ürün) veri bulunurluğu. Süreç başına tek örnek."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.catalog_key = None     # Mağaza/özellik imzası + max ürün id (bkz. _catalog_signature)
+        self.watermark = None       # Bitmap'lere işlenen son sale id
+        self._store_ids = np.zeros(0, dtype=np.int64)
+        self._product_ids = np.zeros(0, dtype=np.int64)
+        self._neighbors: List[np.ndarray] = [] # Pozisyon -> benzerlik sırasına göre komşu pozisyonları
+        self._bitmaps: Dict[int, np.ndarray] = {} # min_rows -> (mağaza, ceil(ürün / 8)) uint8
+
+    # ---------- Güncellik ----------
+
+    def ensure_current(self, db: Session):
+        last_product_id, last_sale_id = db.query(
+            select(func.max(Product.id)).scalar_subquery(),
+            select(func.max(Sale.id)).scalar_subquery()
+        ).one()
+        catalog_key, last_sale_id = _catalog_signature(db) + (last_product_id,), last_sale_id or 0
+
+        with self._lock:
+            if catalog_key != self.catalog_key or last_sale_id < (self.watermark or 0):
+                self._rebuild(db, catalog_key, last_sale_id)
+            elif last_sale_id != self.watermark:
+                self._refresh_pairs(db, self.watermark)
+                self.watermark = last_sale_id
+
+    def _rebuild(self, db: Session, catalog_key, last_sale_id: int):
+        stores = db.query(Store.id, Store.store_type, Store.lat, Store.lon).order_by(Store.id).all()
+        features = {
+            row[0]: row[1:]
+            for row in db.query(StoreFeatures.store_id, StoreFeatures.store_type,
+                                *[getattr(StoreFeatures, column) for column in FEATURE_COLUMNS]).all()
+        }
+        self._store_ids = np.array([row[0] for row in stores], dtype=np.int64)
+        self._product_ids = np.array([row[0] for row in db.query(Product.id).order_by(Product.id).all()], dtype=np.int64)
+
+        lat = np.array([row[2] or 0.0 for row in stores])
+        lon = np.array([row[3] or 0.0 for row in stores])
+        geo = haversine_matrix(lat, lon)
+
+        # Çevresel özellikler: z-score; özelliği olmayan mağaza ortalamada (0) kabul edilir
+        n = len(stores)
+        numeric = np.full((n, len(FEATURE_COLUMNS)), np.nan)
+        formats = sorted({str(f[0]) for f in features.values() if f[0]})
+        onehot = np.zeros((n, len(formats)))
+        for pos, row in enumerate(stores):
+            feature = features.get(row[0])
+            if feature is None:
+                continue
+            numeric[pos] = [value if value is not None else np.nan for value in feature[1:]]
+            if feature[0]:
+                onehot[pos, formats.index(str(feature[0]))] = 1.0
+        if n and not np.all(np.isnan(numeric)):
+            mean = np.nanmean(numeric, axis=0)
+            std = np.nanstd(numeric, axis=0)
+            numeric = (numeric - mean) / np.where(std > 0, std, 1.0)
+        numeric = np.nan_to_num(numeric, nan=0.0)
+        vectors = np.hstack([numeric, onehot])
+        feature_distance = np.linalg.norm(vectors[:, None, :] - vectors[None, :, :], axis=2)
+
+        distance = GEO_WEIGHT * _scaled(geo) + FEATURE_WEIGHT * _scaled(feature_distance)
+        types = np.array([row[1].value if row[1] is not None else "" for row in stores])
+        same_type = types[:, None] == types[None, :]
+        np.fill_diagonal(same_type, False)
+        distance = np.where(same_type, distance, np.inf)
+
+        order = np.argsort(distance, axis=1, kind="stable")
+        self._neighbors = [order[i][np.isfinite(distance[i, order[i]])] for i in range(n)]
+
+        thresholds = set(self._bitmaps) | set(DEFAULT_THRESHOLDS)
+        self._bitmaps = {}
+        for min_rows in sorted(thresholds):
+            self._build_bitmap(db, min_rows)
+        self.catalog_key = catalog_key
+        self.watermark = last_sale_id
+        logger.info(f"Store similarity index rebuilt: {n} stores, {len(self._product_ids)} products")
+
+    def _positions(self, rows):
+        """(store_id, product_id, ...) satırlarını bilinen (mağaza, ürün) pozisyonlarına eşler."""
+        data = np.array(rows, dtype=np.int64).reshape(len(rows), -1)
+        store_pos = np.searchsorted(self._store_ids, data[:, 0])
+        product_pos = np.searchsorted(self._product_ids, data[:, 1])
+        known = (store_pos < len(self._store_ids)) & (product_pos < len(self._product_ids))
+        known[known] &= (self._store_ids[store_pos[known]] == data[known, 0]) & (self._product_ids[product_pos[known]] == data[known, 1])
+        return store_pos[known], product_pos[known], data[known]
+
+    def _set_bits(self, bitmap: np.ndarray, store_pos: np.ndarray, product_pos: np.ndarray, on: np.ndarray):
+        """Paketli bitmap'te bitleri açar/kapatır (np.packbits ile aynı bit sırası: MSB önce)."""
+        masks = (np.uint8(0x80) >> (product_pos & 7).astype(np.uint8)).astype(np.uint8)
+        np.bitwise_or.at(bitmap, (store_pos[on], product_pos[on] >> 3), masks[on])
+        np.bitwise_and.at(bitmap, (store_pos[~on], product_pos[~on] >> 3), ~masks[~on])
+
+    def _build_bitmap(self, db: Session, min_rows: int):
+        """Eşik için bitmap: Tek GROUP BY ... HAVING count >= min_rows."""
+        bitmap = np.zeros((len(self._store_ids), (len(self._product_ids) + 7) // 8), dtype=np.uint8)
+        rows = db.query(Sale.store_id, Sale.product_id).group_by(Sale.store_id, Sale.product_id)\
+            .having(func.count(Sale.id) >= min_rows).all()
+        if rows:
+            store_pos, product_pos, _ = self._positions(rows)
+            self._set_bits(bitmap, store_pos, product_pos, np.ones(len(store_pos), dtype=bool))
+        self._bitmaps[min_rows] = bitmap
+
+    def _refresh_pairs(self, db: Session, watermark: int):
+        """
+        Watermark'tan sonra satış gören (mağaza, ürün) çiftlerinin kayıt sayısını
+        yeniden sayar (tek sorgu) ve tüm eşik bitmap'lerinde bu çiftlerin bitini günceller.
+        """
+        touched = select(Sale.store_id, Sale.product_id).where(Sale.id > watermark).distinct().subquery()
+        rows = db.query(Sale.store_id, Sale.product_id, func.count(Sale.id)).join(
+            touched, (touched.c.store_id == Sale.store_id) & (touched.c.product_id == Sale.product_id)
+        ).group_by(Sale.store_id, Sale.product_id).all()
+        if not rows:
+            return
+        store_pos, product_pos, data = self._positions(rows)
+        for min_rows, bitmap in self._bitmaps.items():
+            self._set_bits(bitmap, store_pos, product_pos, data[:, 2] >= min_rows)
+
+    # ---------- Sorgu ----------
+
+    def _position(self, ids: np.ndarray, value: int) -> Optional[int]:
+        pos = int(np.searchsorted(ids, value))
+        return pos if pos < len(ids) and ids[pos] == value else None
+
+    def proxy_store(self, db: Session, store_id: int, product_id: int, min_rows: int = 1,
+                    check: bool = True) -> Optional[int]:
+        """
+        Ürün için en az min_rows satış kaydı olan en benzer (aynı tip) mağazanın id'si.
+        check=False: Güncellik kontrolü atlanır (Seri başına çağıran döngüler döngüden önce
+        bir kez ensure_current çağırır). İlk kullanımda indeks yine kurulur.
+        """
+        if check or self.catalog_key is None:
+            self.ensure_current(db)
+        min_rows = max(1, min_rows)
+        with self._lock:
+            if min_rows not in self._bitmaps:
+                self._build_bitmap(db, min_rows)
+            store_pos = self._position(self._store_ids, store_id)
+            product_pos = self._position(self._product_ids, product_id)
+            if store_pos is None or product_pos is None:
+                return None
+            neighbors = self._neighbors[store_pos]
+            column = self._bitmaps[min_rows][neighbors, product_pos >> 3]
+            available = (column >> (7 - (product_pos & 7))) & 1
+            if not available.any():
+                return None
+            return int(self._store_ids[neighbors[int(np.argmax(available))]])
+
+store_similarity = StoreSimilarityIndex()
@@ -0,0 +1,352 @@
+from models import Store, StoreType, Product
+from sandbox_engine import load_sandbox_snapshot
+from store_similarity_engine import haversine_matrix
+from transfer_engine import partition_regions
+from core import versions
+from typing import Dict, Optional
+from sqlalchemy.orm import Session
+import numpy as np
+import datetime
+import threading
+
+# ==========================================
+# 🚚 ÇOK GÜNLÜ TEDARİK ZİNCİRİ SİMÜLATÖRÜ
+# ==========================================
+# [OPTIMIZASYON] Mevcut senaryolar tek seferlik değişiklik uygular. Bu simülatör
+# N gün boyunca gün gün ilerler; tüm durum yoğun mağaza x ürün dizileridir:
+#   stock[S, P], in_transit[S, P], pipeline[gün % halka, S, P]
+# Her gün (döngü gün sayısı kadar, satır sayısı kadar değil):
+#   1. Yoldaki sevkiyatlar varır
+#   2. Mağazalar (STORE) tahmini talebi tüketir -> satış / kayıp satış
+#   3. Gözden geçirme günüyse transfer politikası vektörel uygulanır:
+#      CENTER -> HUB, HUB -> STORE, CENTER -> STORE, (opsiyonel) STORE -> STORE
+#      Öncelik transfer_engine ile aynı: A grubu önce, sonra aciliyet; hamle başına
+#      kamyon kapasitesi sınırı. CENTER eksikleri tedarikçiden sipariş edilir.
+# Teslim süreleri rota mesafesinden türetilir (haversine, calculate_distance ile aynı formül).
+# simulate_supply_chain sadece dizilerle çalışır: Politika taramaları aynı snapshot'ı paylaşır.
+
+TYPE_CENTER, TYPE_HUB, TYPE_STORE = 0, 1, 2
+STORE_TYPE_CODES = {StoreType.CENTER: TYPE_CENTER, StoreType.HUB: TYPE_HUB, StoreType.STORE: TYPE_STORE}
+
+HANDLING_DAYS = 1     # Yükleme/boşaltma (her sevkiyatın asgari süresi)
+KM_PER_DAY = 400      # Bir kamyonun günde kat ettiği mesafe
+MAX_SIMULATION_DAYS = 365
+STORE_GIVE_RATIO = 0.5 # Mağazalar fazlalarının sadece %50'sini verebilir (transfer_engine kuralı)
+
+DEFAULT_POLICY = {
+    "days": 90,
+    "max_truck_capacity": 50,  # Hamle başına en fazla adet
+    "safety_factor": 1.0,      # Güvenlik stoğu çarpanı
+    "review_days": 1,          # Politika kaç günde bir çalışır
+    "lookahead_days": 7,       # Hedef stok: Önümüzdeki n günün talebi + güvenlik stoğu
+    "lateral_transfers": True, # Mağazalar arası transfer
+    "supplier_lead_days": 7,   # Tedarikçi -> CENTER teslim süresi
+    "center_cover_days": 30,   # CENTER hedef stoğu: Ağ talebinin kaç günlüğü
+    "demand_scale": 1.0        # Talep çarpanı (Kampanya / durgunluk senaryoları)
+}
+
+_snapshot_cache = {"key": None, "data": None}
+_snapshot_lock = threading.Lock()
+
+def load_network_snapshot(db: Session) -> Dict:
+    """
+    Simülatörün başlangıç durumu (yoğun diziler). Envanter, tahmin ve ürün
+    versiyonları değişmedikçe cache'ten döner. Süreç havuzuna pickle edilebilir.
+    """
+    current = versions.get_versions(db, [versions.INVENTORY, versions.FORECAST, versions.PRODUCTS])
+    key = (current[versions.INVENTORY], current[versions.FORECAST], current[versions.PRODUCTS], datetime.date.today())
+    with _snapshot_lock:
+        if _snapshot_cache["key"] == key:
+            return _snapshot_cache["data"]
+
+    sandbox = load_sandbox_snapshot(db)
+    stores = db.query(Store.id, Store.name, Store.store_type, Store.lat, Store.lon).order_by(Store.id).all()
+    store_ids = np.array([row[0] for row in stores], dtype=np.int64)
+    types = np.array([STORE_TYPE_CODES.get(row[2], TYPE_STORE) for row in stores], dtype=np.int8)
+    lat = np.array([row[3] or 0.0 for row in stores], dtype=float)
+    lon = np.array([row[4] or 0.0 for row in stores], dtype=float)
+    n_stores = len(stores)
+
+    # Envanter satırlarını yoğun (S, P) dizilere yerleştir
+    product_ids, product_pos = np.unique(sandbox["product_ids"], return_inverse=True)
+    store_pos = sandbox["store_pos"] # Aynı mağaza sırası (id artan)
+    shape = (n_stores, len(product_ids))
+    stock = np.zeros(shape)
+    safety = np.zeros(shape)
+    stocked = np.zeros(shape, dtype=bool)
+    demand = np.zeros(shape + (sandbox["demand"].shape[1],))
+    np.add.at(stock, (store_pos, product_pos), sandbox["quantity"])
+    np.add.at(safety, (store_pos, product_pos), sandbox["safety_stock"])
+    np.add.at(demand, (store_pos, product_pos), sandbox["demand"])
+    stocked[store_pos, product_pos] = True
+    demand[types != TYPE_STORE] = 0.0 # Talep satış noktalarında (STORE) oluşur; depolar aşağı akışı besler
+
+    price = np.zeros(len(product_ids))
+    np.add.at(price, product_pos, sandbox["price"])
+    price /= np.maximum(np.bincount(product_pos, minlength=len(product_ids)), 1)
+    a_class = {row[0] for row in db.query(Product.id).filter(Product.abc_category == "A").all()}
+    abc_a = np.isin(product_ids, list(a_class))
+
+    # Rotalar: Mesafe -> teslim süresi; mağazanın HUB'ı (bölge) ve en yakın CENTER'ı
+    distance = haversine_matrix(lat, lon) if n_stores else np.zeros((0, 0))
+    lead = HANDLING_DAYS + np.ceil(distance / KM_PER_DAY).astype(np.int64)
+    regions = partition_regions({
+        row[0]: {"id": row[0], "type": row[2], "lat": row[3], "lon": row[4]} for row in stores
+    }, "hub")
+    region_of = np.array([regions.get(int(s), 0) for s in store_ids], dtype=np.int64)
+    hub_ids = set(store_ids[types == TYPE_HUB].tolist())
+    hub_of = np.array([
+        int(np.searchsorted(store_ids, regions[int(s)])) if regions.get(int(s)) in hub_ids and int(s) not in hub_ids else -1
+        for s in store_ids
+    ], dtype=np.int64)
+    center_idx = np.flatnonzero(types == TYPE_CENTER)
+    if len(center_idx):
+        center_distance = distance[:, center_idx].copy()
+        center_distance[center_idx, np.arange(len(center_idx))] = np.inf # Kendi kendine sevkiyat yok
+        center_of = np.where(types == TYPE_CENTER, -1, center_idx[center_distance.argmin(axis=1)])
+    else:
+        center_of = np.full(n_stores, -1, dtype=np.int64)
+
+    data = {
+        "store_ids": store_ids,
+        "store_names": [row[1] for row in stores],
+        "types": types,
+        "product_ids": product_ids,
+        "price": price,
+        "abc_a": abc_a,
+        "stock": stock,
+        "safety": safety,
+        "stocked": stocked,
+        "demand": demand,
+        "distance": distance,
+        "lead": lead,
+        "region_of": region_of,
+        "hub_of": hub_of,
+        "center_of": center_of,
+        "start_date": sandbox["today"]
+    }
+    for value in data.values():
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+    with _snapshot_lock:
+        _snapshot_cache["key"] = key
+        _snapshot_cache["data"] = data
+    return data
+
+def _demand_day(demand: np.ndarray, day: int) -> np.ndarray:
+    """Tahmin ufkunun ötesi: Son haftanın profili tekrarlanır."""
+    horizon = demand.shape[2]
+    if day < horizon:
+        return demand[:, :, day]
+    week = min(7, horizon)
+    return demand[:, :, horizon - week + (day - horizon) % week]
+
+def _allocate(source: np.ndarray, target: np.ndarray, product: np.ndarray, request: np.ndarray,
+              a_first: np.ndarray, urgency: np.ndarray, available: np.ndarray) -> np.ndarray:
+    """
+    Kaynak x ürün grupları içinde öncelik sırasıyla açgözlü (greedy) dağıtım, döngüsüz:
+    Grup içi kümülatif talep, kaynağın kullanılabilir stoğunu aşana kadar karşılanır.
+    available[S, P] yerinde düşürülür.
+    """
+    allocated = np.zeros(len(request))
+    if not len(request):
+        return allocated
+    order = np.lexsort((target, -urgency, ~a_first, product, source))
+    group = source[order] * available.shape[1] + product[order]
+    wanted = request[order]
+    before = np.cumsum(wanted) - wanted
+    starts = np.r_[True, group[1:] != group[:-1]]
+    before -= np.maximum.accumulate(np.where(starts, before, 0))
+    supply = available[source[order], product[order]]
+    allocated[order] = np.clip(supply - before, 0, wanted)
+    np.subtract.at(available, (source, product), allocated)
+    return allocated
+
+def simulate_supply_chain(snapshot: Dict, policy: Optional[Dict] = None, daily: bool = True) -> Dict:
+    """
+    Snapshot üzerinde politikayı gün gün çalıştırır. Veritabanına dokunmaz
+    (Süreç havuzunda da çalışabilir). policy: DEFAULT_POLICY anahtarlarının alt kümesi.
+    """
+    policy = dict(DEFAULT_POLICY, **(policy or {}))
+    days = int(policy["days"])
+    cap = float(policy["max_truck_capacity"])
+    review = max(1, int(policy["review_days"]))
+    lookahead = max(1, int(policy["lookahead_days"]))
+    supplier_lead = max(1, int(policy["supplier_lead_days"]))
+
+    types, price = snapshot["types"], snapshot["price"]
+    demand = snapshot["demand"]
+    n_stores, n_products = snapshot["stock"].shape
+    stocked = snapshot["stocked"]
+    safety = snapshot["safety"] * policy["safety_factor"]
+    lead, distance = snapshot["lead"], snapshot["distance"]
+    is_store = types == TYPE_STORE
+    is_hub = types == TYPE_HUB
+    is_center = types == TYPE_CENTER
+    scale = policy["demand_scale"]
+
+    stock = snapshot["stock"].astype(float)
+    in_transit = np.zeros_like(stock)
+    ring = int(max(lead.max(initial=0), supplier_lead)) + 1
+    pipeline = np.zeros((ring,) + stock.shape)
+
+    # CENTER hedefi: Ağ ortalama günlük talebinin center_cover_days katı (CENTER'lar arasında eşit)
+    network_daily = demand.sum(axis=(0, 2)) / max(demand.shape[2], 1) * scale
+    center_target = network_daily * policy["center_cover_days"] / max(int(is_center.sum()), 1)
+
+    # Kayan pencere: Önümüzdeki lookahead günün talebi (gün 1..lookahead)
+    window = sum(_demand_day(demand, d) for d in range(1, lookahead + 1)) * scale if n_stores else np.zeros_like(stock)
+
+    totals = {key: 0.0 for key in ("demand", "sold", "lost", "revenue", "lost_revenue", "units_shipped",
+                                   "moves", "truck_km", "supplier_units", "stockout_days", "stock_on_hand")}
+    store_demand = np.zeros(n_stores)
+    store_sold = np.zeros(n_stores)
+    series = []
+    region_members = [
+        members for members in (
+            np.flatnonzero(is_store & (snapshot["region_of"] == region)) for region in np.unique(snapshot["region_of"])
+        ) if len(members)
+    ]
+    lanes = (
+        # (alıcı maskesi, kaynak dizisi) - Hiyerarşi sırası: CENTER -> HUB, HUB -> STORE, CENTER -> STORE
+        (is_hub, snapshot["center_of"]),
+        (is_store, snapshot["hub_of"]),
+        (is_store, snapshot["center_of"])
+    )
+
+    for day in range(days):
+        # 1. Varışlar
+        slot = day % ring
+        stock += pipeline[slot]
+        in_transit -= pipeline[slot]
+        pipeline[slot] = 0.0
+
+        # 2. Talep (Sadece STORE; stok kadar satılır, gerisi kayıp)
+        today_demand = _demand_day(demand, day) * scale
+        sold = np.minimum(np.maximum(stock, 0), today_demand)
+        stock -= sold
+        lost = today_demand - sold
+        store_demand += today_demand.sum(axis=1)
+        store_sold += sold.sum(axis=1)
+        day_shipped = 0.0
+        day_moves = 0
+
+        # 3. Politika
+        if day % review == 0 and n_stores:
+            position = stock + in_transit
+            hub_window = np.zeros_like(stock)
+            served_by_hub = is_store & (snapshot["hub_of"] >= 0)
+            np.add.at(hub_window, snapshot["hub_of"][served_by_hub], window[served_by_hub])
+            target = np.where(is_store[:, None], window, 0.0) + np.where(is_hub[:, None], hub_window, 0.0)
+            target += safety
+            target[is_center] = center_target + safety[is_center]
+            shortage = np.where(stocked, np.maximum(target - position, 0.0), 0.0)
+
+            # Verilebilir stok: Depolar güvenlik stoğunun üstünü, mağazalar fazlanın yarısını
+            available = np.where(is_store[:, None], np.floor(np.maximum(stock - target, 0) * STORE_GIVE_RATIO),
+                                 np.maximum(stock - safety, 0))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                urgency = np.where(position > 0, np.minimum(window / position, 1.0), 1.0)
+
+            tiers = list(lanes)
+            if policy["lateral_transfers"]:
+                # Bölgedeki (aynı HUB) en çok fazlası olan mağaza, ürün bazında tek aday kaynak
+                best = np.full(stock.shape, -1, dtype=np.int64)
+                for members in region_members:
+                    top = members[available[members].argmax(axis=0)]
+                    has_excess = available[top, np.arange(n_products)] > 0
+                    best[members] = np.where(has_excess, top, -1)
+                tiers.append((is_store, best))
+
+            for receivers, sources in tiers:
+                src = sources if sources.ndim == 2 else np.broadcast_to(sources[:, None], stock.shape)
+                rows, cols = np.nonzero(receivers[:, None] & (shortage >= 1) & (src >= 0))
+                src = src[rows, cols]
+                valid = src != rows
+                rows, cols, src = rows[valid], cols[valid], src[valid]
+                request = np.minimum(np.floor(shortage[rows, cols]), cap)
+                amount = np.floor(_allocate(src, rows, cols, request, snapshot["abc_a"][cols], urgency[rows, cols], available))
+                moved = amount > 0
+                rows, cols, src, amount = rows[moved], cols[moved], src[moved], amount[moved]
+                if not len(amount):
+                    continue
+                np.subtract.at(stock, (src, cols), amount)
+                arrival = (day + lead[src, rows]) % ring
+                np.add.at(pipeline, (arrival, rows, cols), amount)
+                np.add.at(in_transit, (rows, cols), amount)
+                np.subtract.at(shortage, (rows, cols), amount)
+                day_shipped += amount.sum()
+                day_moves += len(amount)
+                totals["truck_km"] += float(distance[src, rows].sum())
+
+            # CENTER eksikleri tedarikçiden (supplier_lead_days sonra varır; sevkiyat sonrası pozisyonla)
+            order = np.where(is_center[:, None] & stocked, np.ceil(np.maximum(target - stock - in_transit, 0)), 0.0)
+            if order.any():
+                pipeline[(day + supplier_lead) % ring] += order
+                in_transit += order
+                totals["supplier_units"] += float(order.sum())
+
+        # Pencereyi bir gün kaydır
+        if n_stores:
+            window += (_demand_day(demand, day + lookahead + 1) - _demand_day(demand, day + 1)) * scale
+
+        stockouts = int((is_store[:, None] & stocked & (stock <= 0) & (today_demand > 0)).sum())
+        on_hand = float(stock.sum())
+        totals["demand"] += float(today_demand.sum())
+        totals["sold"] += float(sold.sum())
+        totals["lost"] += float(lost.sum())
+        totals["revenue"] += float(sold.sum(axis=0) @ price)
+        totals["lost_revenue"] += float(lost.sum(axis=0) @ price)
+        totals["units_shipped"] += float(day_shipped)
+        totals["moves"] += day_moves
+        totals["stockout_days"] += stockouts
+        totals["stock_on_hand"] += on_hand
+        if daily:
+            series.append({
+                "date": (snapshot["start_date"] + datetime.timedelta(days=day)).isoformat(),
+                "demand": float(today_demand.sum()),
+                "sold": float(sold.sum()),
+                "lost": float(lost.sum()),
+                "stock_on_hand": on_hand,
+                "in_transit": float(in_transit.sum()),
+                "moves": day_moves,
+                "units_shipped": float(day_shipped),
+                "stockouts": stockouts
+            })
+
+    result = {
+        "policy": policy,
+        "summary": {
+            "days": days,
+            "demand": totals["demand"],
+            "sold": totals["sold"],
+            "lost_sales": totals["lost"],
+            "fill_rate": totals["sold"] / totals["demand"] if totals["demand"] > 0 else 1.0,
+            "revenue": totals["revenue"],
+            "lost_revenue": totals["lost_revenue"],
+            "transfer_moves": int(totals["moves"]),
+            "units_shipped": totals["units_shipped"],
+            "truck_km": totals["truck_km"],
+            "supplier_units": totals["supplier_units"],
+            "stockout_item_days": int(totals["stockout_days"]),
+            "avg_stock_on_hand": totals["stock_on_hand"] / days if days else float(stock.sum()),
+            "end_stock": float(stock.sum())
+        },
+        "stores": [
+            {
+                "store_id": int(snapshot["store_ids"][i]),
+                "name": snapshot["store_names"][i],
+                "fill_rate": float(store_sold[i] / store_demand[i]) if store_demand[i] > 0 else 1.0,
+                "lost_sales": float(store_demand[i] - store_sold[i]),
+                "end_stock": float(stock[i].sum())
+            }
+            for i in np.flatnonzero(is_store)
+        ]
+    }
+    if daily:
+        result["daily"] = series
+    return result
+
+def run_supply_chain(db: Session, policy: Optional[Dict] = None, daily: bool = True) -> Dict:
+    """Güncel snapshot üzerinde simülasyon (bkz. simulate_supply_chain)."""
+    return simulate_supply_chain(load_network_snapshot(db), policy, daily)
@@ -1,19 +1,37 @@
-from models import Store, StoreType, Forecast
+from models import Store, StoreType, Forecast, Inventory, Product, RoutePenalty
 from risk_engine import analyze_store_risk
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple, Iterator
 import math
+import os
+import bisect
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 from datetime import date, timedelta
+from core.logger import logger
+
+# Bölgesel planlama modları
+REGION_MODES = ("hub", "cluster")
+
+# Öneri yanıt formatları: full (XAI metinleriyle), compact (id + miktar + skor)
+RECOMMENDATION_VIEWS = ("full", "compact")
+
+# Paralel planlama eşiği: Bundan az alıcı varsa süreç havuzu açmak (pickle + IPC)
+# planlamanın kendisinden daha pahalıdır, bölgeler sırayla planlanır.
+PARALLEL_MIN_RECEIVERS = 500
+
+_process_pool = None
 
 def calculate_distance(lat1, lon1, lat2, lon2):
     """
     Haversine Formülü: Küresel yüzey üzerindeki iki nokta arasındaki en kısa mesafeyi hesaplar.
-    
+
     Matematiksel Formül:
     a = sin²(Δlat/2) + cos(lat1) * cos(lat2) * sin²(Δlon/2)
     c = 2 * atan2(√a, √(1-a))
     d = R * c
-    
+
     R: Dünya Yarıçapı (Ortalama 6371 km)
     """
     R = 6371 # Dünya yarıçapı (km)
@@ -25,198 +43,769 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
     return R * c
 
-def generate_transfer_recommendations(db: Session, stores: List[Store], max_truck_capacity: int = 50) -> List[Dict]:
+def _store_info(stores: List[Store]) -> Dict[int, Dict]:
+    return {
+        s.id: {
+            "id": s.id,
+            "name": s.name,
+            "type": s.store_type,
+            "lat": s.lat,
+            "lon": s.lon
+        }
+        for s in stores
+    }
+
+def product_scope(product_ids: Optional[List[int]] = None, category: Optional[str] = None,
+                  abc_class: Optional[str] = None):
     """
-    Robin Hood Algoritması (Proaktif Stok Dengeleme):
-    Zenginden (Stok Fazlası Olan) alıp, fakire (Stok İhtiyacı Olan) verme prensibi.
-    
-    Adımlar:
-    1. Talep Tahmini Analizi (Gelecek 7 gün ne satacak?)
-    2. Eksik (Shortage) ve Fazla (Excess) tespiti.
-    3. Maliyet Fonksiyonu (Cost Function) ile en uygun transfer eşlemesi.
+    Kapsamlı (scoped) planlama için ürün filtresi.
+    Filtre yoksa None, varsa envanter ve tahmin sorgularına IN (SELECT ...) olarak
+    gömülen bir alt sorgu döner. Böylece ürün listesi Python'a çekilmez,
+    filtre veritabanında uygulanır.
+    """
+    if not product_ids and not category and not abc_class:
+        return None
+    query = select(Product.id)
+    if product_ids:
+        query = query.where(Product.id.in_(product_ids))
+    if category:
+        query = query.where(Product.category == category)
+    if abc_class:
+        query = query.where(Product.abc_category == abc_class)
+    return query
+
+def hub_catchment(stores: List[Store], hub_id: int) -> List[Store]:
+    """Bir HUB'ın etki alanındaki mağazalar (HUB dahil, bkz. partition_regions)."""
+    regions = partition_regions(_store_info(stores), "hub")
+    return [s for s in stores if regions.get(s.id) == hub_id]
+
+def load_planning_snapshot(db: Session, stores: List[Store], horizon_days: int = 7, products=None) -> Dict:
+    """
+    Planlama için gereken tüm veriyi (envanter, tahmin, ürün) toplu sorgularla çeker.
+
+    Eski yöntem her envanter satırı için ayrı bir Forecast sorgusu atıyordu (N+1).
+    Yeni yöntem 3 sorgu ile çalışır ve ORM nesnesi yerine düz sözlükler döner;
+    böylece veri süreç havuzuna (ProcessPool) pickle edilerek gönderilebilir.
+
+    products: product_scope() alt sorgusu. Verilirse sadece bu ürünlerin envanter
+    ve tahmin satırları okunur (Maliyet, dilimin boyutuyla orantılı kalır).
     """
-    
-    recommendations = []
-    transfer_id_counter = 100
     today = date.today()
-    next_week = today + timedelta(days=7)
-    
-    # Envanteri analiz et
-    # İhtiyacı olanlar (Receivers) ve Fazlası olanlar (Givers)
+    end_date = today + timedelta(days=horizon_days)
+    store_ids = [s.id for s in stores]
+
+    store_info = _store_info(stores)
+
+    inventory_query = db.query(
+        Inventory.store_id, Inventory.product_id, Inventory.quantity, Inventory.safety_stock
+    ).filter(Inventory.store_id.in_(store_ids))
+    if products is not None:
+        inventory_query = inventory_query.filter(Inventory.product_id.in_(products))
+    inventory_rows = inventory_query.order_by(Inventory.id).all()
+
+    # Gelecek talebi (store, product) bazında tek GROUP BY ile topla
+    demand_query = db.query(
+        Forecast.store_id, Forecast.product_id, func.sum(Forecast.predicted_quantity)
+    ).filter(
+        Forecast.store_id.in_(store_ids),
+        Forecast.date >= today,
+        Forecast.date <= end_date
+    )
+    if products is not None:
+        demand_query = demand_query.filter(Forecast.product_id.in_(products))
+    demand_rows = demand_query.group_by(Forecast.store_id, Forecast.product_id).all()
+    demand_map = {(row[0], row[1]): row[2] or 0 for row in demand_rows}
+
+    product_ids = {row[1] for row in inventory_rows}
+    product_rows = db.query(Product.id, Product.name, Product.abc_category)\
+        .filter(Product.id.in_(product_ids)).all() if product_ids else []
+    products = {row[0]: {"name": row[1], "abc_category": row[2]} for row in product_rows}
+
+    # Envanteri mağaza sırasına göre grupla (Eski store.inventory döngüsüyle aynı sıra)
+    items_by_store = {store_id: [] for store_id in store_ids}
+    for store_id, product_id, quantity, safety_stock in inventory_rows:
+        items_by_store[store_id].append({
+            "product_id": product_id,
+            "quantity": quantity,
+            "safety_stock": safety_stock,
+            "demand": demand_map.get((store_id, product_id), 0)
+        })
+
+    # Global envanter sırası (Öncelik eşitliğinde sıralamayı belirler)
+    # (mağaza sırası, envanter sırası): Sonradan açılan satırlar mağazasının sonuna düşer
+    position = 0
+    for store_rank, store_id in enumerate(store_ids):
+        for item in items_by_store[store_id]:
+            item["position"] = (store_rank, position)
+            position += 1
+
+    return {
+        "stores": store_info,
+        "store_order": store_ids,
+        "items": items_by_store,
+        "products": products,
+        "demand": demand_map
+    }
+
+def _empty_giver_pool() -> Dict[StoreType, List[Dict]]:
+    return {StoreType.HUB: [], StoreType.CENTER: [], StoreType.STORE: []}
+
+def classify_item(store: Dict, item: Dict, product: Dict) -> Tuple[Optional[str], Optional[Dict]]:
+    """
+    Tek bir envanter satırını sınıflandırır: ("receiver", {...}), ("giver", {...}) veya (None, None).
+    """
+    total_predicted_demand = item["demand"]
+    quantity = item["quantity"]
+    safety_stock = item["safety_stock"]
+
+    # Alıcı mı? (Receiver Detection)
+    # Formül: Mevcut Stok < (Tahminlenen Talep + Güvenlik Stoğu)
+    if quantity < (total_predicted_demand + safety_stock):
+        shortage = (total_predicted_demand + safety_stock) - quantity
+
+        # Aciliyet Skoru (Urgency Metric):
+        # Stok 0 ise aciliyet maksimumdur (1.0).
+        # Değilse, talebin kaçta kaçını karşıladığına göre lineer artar.
+        urgency_score = 1.0 if quantity == 0 else (total_predicted_demand / quantity if quantity > 0 else 1.0)
+
+        return "receiver", {
+            "store": store,
+            "product_id": item["product_id"],
+            "product_name": product.get("name"),
+            "shortage": shortage,
+            "priority": min(urgency_score, 1.0),
+            "current_stock": quantity,
+            "safety_stock": safety_stock,
+            "predicted_demand": total_predicted_demand,
+            "abc_category": product.get("abc_category"),
+            "position": item["position"]
+        }
+
+    # Verici mi? (Gelecek hafta talebinden ve güvenlik stoğundan fazlası varsa)
+    if quantity > (total_predicted_demand + safety_stock):
+        excess = quantity - (total_predicted_demand + safety_stock)
+
+        # Mağazalar için daha sıkı kural (Sadece %50 fazlasını verebilir)
+        if store["type"] == StoreType.STORE:
+            excess = int(excess * 0.5)
+
+        if excess > 0:
+            return "giver", {
+                "store": store,
+                "product_id": item["product_id"],
+                "excess": excess,
+                "current_stock": quantity
+            }
+
+    return None, None
+
+def receiver_sort_key(req: Dict) -> Tuple:
+    """
+    Öncelik sırası: A grubu önce, sonra aciliyet (yüksekten düşüğe),
+    eşitlikte envanter sırası (Stabil sıralama ile birebir aynı sonuç).
+    """
+    return (req["abc_category"] != 'A', -req["priority"], req["position"])
+
+def build_pools(snapshot: Dict) -> Tuple[List[Dict], Dict[int, Dict[StoreType, List[Dict]]]]:
+    """
+    Alıcı (Receiver) ve Verici (Giver) havuzlarını oluşturur.
+
+    Vericiler ürün bazında indekslenir: givers[product_id][StoreType] -> [giver, ...]
+    Böylece eşleştirme sırasında tüm verici listesini filtrelemek gerekmez.
+    """
     receivers = []
-    givers = {StoreType.HUB: [], StoreType.CENTER: [], StoreType.STORE: []}
-    
-    # 1. Havuzları Doldur (Tahmin Odaklı Analiz)
-    for store in stores:
-        for item in store.inventory:
-            # GELECEK TALEBİ ÇEK (Önümüzdeki 7 gün)
-            future_demand = db.query(Forecast).filter(
-                Forecast.store_id == store.id,
-                Forecast.product_id == item.product_id,
-                Forecast.date >= today,
-                Forecast.date <= next_week
-            ).with_entities(Forecast.predicted_quantity).all()
-            
-            total_predicted_demand = sum([f[0] for f in future_demand])
-            
-            # Alıcı mı? (Receiver Detection)
-            # Formül: Mevcut Stok < (Tahminlenen Talep + Güvenlik Stoğu)
-            if item.quantity < (total_predicted_demand + item.safety_stock):
-                shortage = (total_predicted_demand + item.safety_stock) - item.quantity
-                
-                # Aciliyet Skoru (Urgency Metric):
-                # Stok 0 ise aciliyet maksimumdur (1.0).
-                # Değilse, talebin kaçta kaçını karşıladığına göre lineer artar.
-                urgency_score = 1.0 if item.quantity == 0 else (total_predicted_demand / item.quantity if item.quantity > 0 else 1.0)
-                
-                receivers.append({
-                    "store": store,
-                    "product": item.product,
-                    "shortage": shortage,
-                    "priority": min(urgency_score, 1.0),
-                    "current_stock": item.quantity,
-                    "safety_stock": item.safety_stock,
-                    "predicted_demand": total_predicted_demand,
-                    "abc_category": item.product.abc_category
-                })
-            
-            # Verici mi? (Gelecek hafta talebinden ve güvenlik stoğundan fazlası varsa)
-            elif item.quantity > (total_predicted_demand + item.safety_stock):
-                excess = item.quantity - (total_predicted_demand + item.safety_stock)
-                
-                # Mağazalar için daha sıkı kural (Sadece %50 fazlasını verebilir)
-                if store.store_type == StoreType.STORE:
-                    excess = int(excess * 0.5)
-
-                if excess > 0:
-                    givers[store.store_type].append({
-                        "store": store,
-                        "product_id": item.product_id,
-                        "excess": excess,
-                        "current_stock": item.quantity
-                    })
-
-    # 2. Önceliğe Göre Sırala (ABC Kategorisi A olanlar ve Urgency Score yüksek olanlar önce)
-    receivers.sort(key=lambda x: (x["abc_category"] == 'A', x["priority"]), reverse=True)
-    
-    # 3. Eşleştirme Algoritması
-    
-    # [OPTIMIZASYON] Ceza Puanlarını Toplu Çek (Memory Cache)
-    # N+1 Problemini çözer: Döngü içinde her defasında DB'ye gitmek yerine
-    # tek seferde tüm ceza tablosunu çekip RAM'e alıyoruz.
-    from models import RoutePenalty
-    all_penalties = db.query(RoutePenalty).all()
-    penalty_map = {}
-    for p in all_penalties:
-        penalty_map[(p.source_store_id, p.target_store_id)] = p.penalty_score
+    givers = {}
+
+    for store_id in snapshot["store_order"]:
+        store = snapshot["stores"][store_id]
+        for item in snapshot["items"][store_id]:
+            product = snapshot["products"].get(item["product_id"], {})
+            role, entry = classify_item(store, item, product)
+            if role == "receiver":
+                receivers.append(entry)
+            elif role == "giver":
+                givers.setdefault(item["product_id"], _empty_giver_pool())[store["type"]].append(entry)
+
+    # Önceliğe Göre Sırala (ABC Kategorisi A olanlar ve Urgency Score yüksek olanlar önce)
+    receivers.sort(key=receiver_sort_key)
+    for rank, req in enumerate(receivers):
+        req["rank"] = rank
+
+    return receivers, givers
+
+def load_penalty_map(db: Session) -> Dict[Tuple[int, int], float]:
+    """
+    [OPTIMIZASYON] Ceza Puanlarını Toplu Çek (Memory Cache)
+    N+1 Problemini çözer: Döngü içinde her defasında DB'ye gitmek yerine
+    tek seferde tüm ceza tablosunu çekip RAM'e alıyoruz.
+    """
+    rows = db.query(RoutePenalty.source_store_id, RoutePenalty.target_store_id, RoutePenalty.penalty_score).all()
+    return {(row[0], row[1]): row[2] for row in rows}
+
+def iter_matches(receivers: List[Dict], givers: Dict, penalty_map: Dict, max_truck_capacity: int) -> Iterator[Dict]:
+    """
+    Eşleştirme Algoritması (Açgözlü / Greedy):
+    Alıcılar öncelik sırasıyla gezilir, her biri için hiyerarşiye göre
+    (HUB -> CENTER -> STORE) en yüksek skorlu verici seçilir.
+
+    Vericilerin 'excess' değerleri yerinde (in-place) düşürülür.
+    Generator olduğu için eşleşmeler bulundukça (öncelik sırasıyla) üretilir.
+    """
+    search_order = [StoreType.HUB, StoreType.CENTER, StoreType.STORE]
 
     for req in receivers:
-        needed_product_id = req["product"].id
-        amount_needed = req["shortage"]
-        
-        # SIRA 1: HUB Kontrolü
-        # SIRA 2: CENTER Kontrolü
-        # SIRA 3: STORE Kontrolü
-        
-        search_order = [StoreType.HUB, StoreType.CENTER, StoreType.STORE]
+        product_givers = givers.get(req["product_id"])
+        if not product_givers:
+            continue
+
         best_source = None
         min_dist = float('inf')
         best_score = -float('inf')
-        
+
         for source_type in search_order:
-            potential_givers = [g for g in givers[source_type] if g["product_id"] == needed_product_id and g["excess"] > 0]
-            
+            potential_givers = [g for g in product_givers[source_type] if g["excess"] > 0]
+
             if not potential_givers:
                 continue # Bu türde kaynak yok, bir sonrakine bak
-                
+
             # Bu türdeki en uygun (en optimize) kaynağı bul
             for giver in potential_givers:
-                dist = calculate_distance(req["store"].lat, req["store"].lon, giver["store"].lat, giver["store"].lon)
-                
+                dist = calculate_distance(req["store"]["lat"], req["store"]["lon"], giver["store"]["lat"], giver["store"]["lon"])
+
                 # --- ROBIN HOOD SKORU (Optimizasyon Fonksiyonu) ---
                 # Amaç: Lojistik maliyeti en aza indirirken, stok riskini en çok azaltan hamleyi bulmak.
                 # Skor Fonksiyonu: F(x) = (Aciliyet * w1) - (Mesafe * w2) - (Ceza * w3)
-                
-                logistics_cost = dist * 2.5 # km başına 2.5 TL birim maliyet
-                
+
                 # Merkez/Hub ise mesafeyi biraz daha tolere et (Daha büyük araçları var)
-                dist_penalty = dist if source_type == StoreType.STORE else dist * 0.7 
-                
+                dist_penalty = dist if source_type == StoreType.STORE else dist * 0.7
+
                 # Ceza Puanını RAM'den Oku (Hızlı)
-                penalty_score = penalty_map.get((giver["store"].id, req["store"].id), 0.0)
-                
+                penalty_score = penalty_map.get((giver["store"]["id"], req["store"]["id"]), 0.0)
+
                 # Skor Hesaplama (Ceza puanı skoru düşürür)
                 score = (req["priority"] * 100) - (dist_penalty * 0.5) - (penalty_score * 5.0)
-                
+
                 if score > best_score:
                     best_score = score
                     min_dist = dist
                     best_source = giver
-            
+
             if best_source:
                 # Kaynak bulundu! Döngüyü kır (Hiyerarşi kuralı: Hub varsa Store'a bakma)
-                break 
-        
+                break
+
         if best_source:
             # Transfer miktarını belirle (Aracın kapasitesini aşamaz)
-            transfer_amount = min(amount_needed, best_source["excess"], max_truck_capacity)
-            
+            transfer_amount = min(req["shortage"], best_source["excess"], max_truck_capacity)
+
             # Kaynağın stoğunu sanal olarak düşür (aynı döngüde başkasına vermesin)
             best_source["excess"] -= transfer_amount
-            
-            source_store = best_source["store"]
-            target_store = req["store"]
-            product_name = req["product"].name
-            
-            # --- XAI (Açıklanabilir Yapay Zeka - Explainable AI) ---
-            # "Black Box" (Kara Kutu) model olmamak için, sistemin neden bu kararı verdiği
-            # son kullanıcıya doğal dilde raporlanır.
-            explanations = []
-            
-            # Neden Hedef Seçildi?
-            stockout_risk_reduction = min(100, round((transfer_amount / req["predicted_demand"]) * 100)) if req["predicted_demand"] > 0 else 100
-            
-            explanations.append(f"Risk Analizi: Stok tükenme riski %{stockout_risk_reduction} oranında azaltıldı.")
-            explanations.append(f"Talep Tahmini: Önümüzdeki 7 gün için {req['predicted_demand']} adet ihtiyaç var.")
-            
-            # Neden Kaynak Seçildi?
-            if source_store.store_type == StoreType.HUB:
-                explanations.append(f"Lojistik Stratejisi: En verimli kaynak (HUB) kullanıldı.")
-            else:
-                 explanations.append(f"Lojistik Stratejisi: En yakın ve stoğu bol mağaza ({source_store.name}) seçildi.")
-
-            # ABC Önceliği
-            if req['abc_category'] == 'A':
-                explanations.append(f"Finansal Etki: A Grubu (Yüksek Ciro) ürün önceliklendirildi.")
-            
-            # Maliyet/Lojistik
-            estimated_cost = min_dist * 4.5 # km başına 4.5 TL (Örnek)
-            explanations.append(f"Lojistik Maliyet: ₺{estimated_cost:,.0f} (Mesafe: {min_dist:.1f} km).")
-            
-            rec = {
-                "transfer_id": f"TRF-{transfer_id_counter}",
-                "source": {
-                    "id": source_store.id,
-                    "name": source_store.name,
-                    "type": source_store.store_type.value
-                },
-                "target": {
-                    "id": target_store.id,
-                    "name": target_store.name,
-                    "type": target_store.store_type.value
-                },
-                "product_id": req["product"].id,
-                "product": product_name, 
+
+            yield {
+                "receiver": req,
+                "source": best_source["store"],
                 "amount": transfer_amount,
-                "xai_explanation": { # Frontend'de kart olarak gösterilecek
-                    "summary": f"Stok Riski %{stockout_risk_reduction} Azaltıldı | Maliyet: ₺{estimated_cost:,.0f}",
-                    "reasons": explanations,
-                    "score": round(max(0, best_score)), # Skor negatif olmasın
-                    "type": "PROACTIVE" # Frontend için tip belirteci
-                },
-                "algorithm": "Robin Hood AI v2.2 (Bulk Optimized)"
+                "distance": min_dist,
+                "score": best_score
             }
-            recommendations.append(rec)
-            transfer_id_counter += 1
 
-    return recommendations
+def match_receivers(receivers: List[Dict], givers: Dict, penalty_map: Dict, max_truck_capacity: int) -> List[Dict]:
+    """Tüm eşleşmeleri liste olarak döner (bkz. iter_matches)."""
+    return list(iter_matches(receivers, givers, penalty_map, max_truck_capacity))
+
+def render_explanation(match: Dict) -> Dict:
+    """
+    Eşleşmenin XAI açıklamasını (özet + gerekçeler) üretir.
+
+    Liste yanıtında bu metinler her kart için önceden formatlanmak zorunda değildir:
+    Kompakt modda sadece kullanıcının açtığı kart için ayrı endpoint'ten çağrılır.
+    """
+    req = match["receiver"]
+    source_store = match["source"]
+    transfer_amount = match["amount"]
+    min_dist = match["distance"]
+
+    # --- XAI (Açıklanabilir Yapay Zeka - Explainable AI) ---
+    # "Black Box" (Kara Kutu) model olmamak için, sistemin neden bu kararı verdiği
+    # son kullanıcıya doğal dilde raporlanır.
+    explanations = []
+
+    # Neden Hedef Seçildi?
+    stockout_risk_reduction = min(100, round((transfer_amount / req["predicted_demand"]) * 100)) if req["predicted_demand"] > 0 else 100
+
+    explanations.append(f"Risk Analizi: Stok tükenme riski %{stockout_risk_reduction} oranında azaltıldı.")
+    explanations.append(f"Talep Tahmini: Önümüzdeki 7 gün için {req['predicted_demand']} adet ihtiyaç var.")
+
+    # Neden Kaynak Seçildi?
+    if source_store["type"] == StoreType.HUB:
+        explanations.append(f"Lojistik Stratejisi: En verimli kaynak (HUB) kullanıldı.")
+    else:
+        explanations.append(f"Lojistik Stratejisi: En yakın ve stoğu bol mağaza ({source_store['name']}) seçildi.")
+
+    # ABC Önceliği
+    if req['abc_category'] == 'A':
+        explanations.append(f"Finansal Etki: A Grubu (Yüksek Ciro) ürün önceliklendirildi.")
+
+    # Maliyet/Lojistik
+    estimated_cost = min_dist * 4.5 # km başına 4.5 TL (Örnek)
+    explanations.append(f"Lojistik Maliyet: ₺{estimated_cost:,.0f} (Mesafe: {min_dist:.1f} km).")
+
+    return { # Frontend'de kart olarak gösterilecek
+        "summary": f"Stok Riski %{stockout_risk_reduction} Azaltıldı | Maliyet: ₺{estimated_cost:,.0f}",
+        "reasons": explanations,
+        "score": round(max(0, match["score"])), # Skor negatif olmasın
+        "type": "PROACTIVE" # Frontend için tip belirteci
+    }
+
+def recommendation_id(match: Dict) -> str:
+    """
+    Kararlı öneri kimliği: TRF-{kaynak}-{hedef}-{ürün}.
+    Plan sırasından bağımsızdır; araya giren transfer/red başka bir kartı işaret ettirmez.
+    (Bir planda her alıcı (hedef, ürün) en fazla bir kez eşleşir.)
+    """
+    return f"TRF-{match['source']['id']}-{match['receiver']['store']['id']}-{match['receiver']['product_id']}"
+
+def parse_recommendation_id(transfer_id: str) -> Optional[Tuple[int, int, int]]:
+    """TRF-{kaynak}-{hedef}-{ürün} -> (kaynak, hedef, ürün); geçersizse None."""
+    parts = transfer_id.removeprefix("TRF-").split("-")
+    if len(parts) != 3 or not all(part.isdigit() for part in parts):
+        return None
+    return int(parts[0]), int(parts[1]), int(parts[2])
+
+def build_compact_recommendation(match: Dict) -> Dict:
+    """
+    Kompakt öneri: Sadece id'ler, miktar ve skor (Metin formatlama yok).
+    """
+    req = match["receiver"]
+    return {
+        "transfer_id": recommendation_id(match),
+        "source_id": match["source"]["id"],
+        "target_id": req["store"]["id"],
+        "product_id": req["product_id"],
+        "amount": match["amount"],
+        "score": round(max(0, match["score"]))
+    }
+
+def build_recommendation(match: Dict, view: str = "full") -> Dict:
+    """
+    Eşleşmeyi frontend'in beklediği öneri formatına (XAI açıklamalı) çevirir.
+    view="compact" ise açıklamasız kompakt formatı döner.
+    """
+    if view == "compact":
+        return build_compact_recommendation(match)
+
+    req = match["receiver"]
+    source_store = match["source"]
+    target_store = req["store"]
+
+    return {
+        "transfer_id": recommendation_id(match),
+        "source": {
+            "id": source_store["id"],
+            "name": source_store["name"],
+            "type": source_store["type"].value
+        },
+        "target": {
+            "id": target_store["id"],
+            "name": target_store["name"],
+            "type": target_store["type"].value
+        },
+        "product_id": req["product_id"],
+        "product": req["product_name"],
+        "amount": match["amount"],
+        "xai_explanation": render_explanation(match),
+        "algorithm": "Robin Hood AI v2.2 (Bulk Optimized)"
+    }
+
+# ==========================================
+# 🗺️ BÖLGESEL (REGION) PLANLAMA
+# ==========================================
+
+def partition_regions(store_info: Dict[int, Dict], mode: str = "hub", n_regions: Optional[int] = None) -> Dict[int, int]:
+    """
+    Mağazaları bölgelere ayırır: {store_id: region_id}
+
+    Modlar:
+    - hub: Her HUB bir bölge merkezidir. STORE ve CENTER noktaları en yakın HUB'ın
+      etki alanına (catchment) atanır. HUB yoksa tek bölge döner.
+    - cluster: lat/lon üzerinde K-Means kümeleme. n_regions verilmezse
+      √(N/2) kuralı kullanılır.
+    """
+    if mode not in REGION_MODES:
+        raise ValueError(f"Geçersiz bölge modu: {mode}")
+
+    store_ids = list(store_info.keys())
+    if not store_ids:
+        return {}
+
+    if mode == "hub":
+        hubs = [s for s in store_info.values() if s["type"] == StoreType.HUB]
+        if not hubs:
+            return {store_id: 0 for store_id in store_ids}
+
+        regions = {}
+        for store_id, store in store_info.items():
+            if store["type"] == StoreType.HUB:
+                regions[store_id] = store_id
+                continue
+            nearest_hub = min(hubs, key=lambda h: calculate_distance(store["lat"], store["lon"], h["lat"], h["lon"]))
+            regions[store_id] = nearest_hub["id"]
+        return regions
+
+    # mode == "cluster"
+    import numpy as np
+    from sklearn.cluster import KMeans
+
+    k = n_regions or max(1, round(math.sqrt(len(store_ids) / 2)))
+    k = min(k, len(store_ids))
+    if k == 1:
+        return {store_id: 0 for store_id in store_ids}
+
+    # Boylamı cos(enlem) ile ölçekle: Derece cinsinden mesafeler km'ye orantılı olsun
+    coords = np.array([[store_info[s]["lat"], store_info[s]["lon"]] for s in store_ids], dtype=float)
+    coords[:, 1] *= np.cos(np.radians(coords[:, 0].mean()))
+
+    labels = KMeans(n_clusters=k, n_init=10, random_state=42).fit_predict(coords)
+    return {store_id: int(label) for store_id, label in zip(store_ids, labels)}
+
+def _plan_region(receivers: List[Dict], givers: Dict, penalty_map: Dict, max_truck_capacity: int):
+    """
+    Tek bir bölgeyi planlar (Süreç havuzunda çalışır, bu yüzden modül seviyesinde).
+    Eşleşmeleri, kaynak bulunamayan alıcıları ve kalan verici havuzunu döner.
+    """
+    matches = match_receivers(receivers, givers, penalty_map, max_truck_capacity)
+    matched_ranks = {m["receiver"]["rank"] for m in matches}
+    residual = [r for r in receivers if r["rank"] not in matched_ranks]
+    return matches, residual, givers
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 2)
+    return _process_pool
+
+def plan_by_region(receivers: List[Dict], givers: Dict, penalty_map: Dict, regions: Dict[int, int],
+                   max_truck_capacity: int, parallel: bool = True) -> List[Dict]:
+    """
+    Bölge Bazlı Planlama (2 Aşamalı):
+
+    1. Aşama: Her bölge kendi içinde (bağımsız olarak) planlanır. Bölgeler
+       birbirinden bağımsız olduğu için süreç havuzunda paralel çalışır.
+       Gecikme süresi tüm ağ yerine en büyük bölgeyle sınırlanır.
+    2. Aşama: Bölge içinde kaynak bulamayan alıcılar (artık eksikler), tüm
+       bölgelerden kalan fazla stoklarla (cross-region) eşleştirilir.
+    """
+    region_receivers = {}
+    region_givers = {}
+
+    for req in receivers:
+        region_receivers.setdefault(regions[req["store"]["id"]], []).append(req)
+
+    for product_id, by_type in givers.items():
+        for store_type, type_givers in by_type.items():
+            for giver in type_givers:
+                region = regions[giver["store"]["id"]]
+                product_givers = region_givers.setdefault(region, {}).setdefault(product_id, _empty_giver_pool())
+                product_givers[store_type].append(giver)
+
+    region_ids = sorted(set(region_receivers) | set(region_givers))
+    tasks = []
+    for region in region_ids:
+        # Her bölgeye sadece kendi rotalarının ceza puanlarını gönder (IPC yükünü azaltır)
+        region_penalties = {
+            lane: score for lane, score in penalty_map.items()
+            if regions.get(lane[0]) == region and regions.get(lane[1]) == region
+        }
+        tasks.append((region_receivers.get(region, []), region_givers.get(region, {}), region_penalties, max_truck_capacity))
+
+    use_pool = parallel and len(tasks) > 1 and len(receivers) >= PARALLEL_MIN_RECEIVERS
+    results = None
+    if use_pool:
+        try:
+            pool = _get_process_pool()
+            futures = [pool.submit(_plan_region, *task) for task in tasks]
+            results = [f.result() for f in futures]
+        except Exception as e:
+            logger.warning(f"Parallel region planning failed, falling back to serial: {e}")
+            results = None
+    if results is None:
+        results = [_plan_region(*task) for task in tasks]
+
+    # 2. Aşama: Bölgeler arası (Cross-Region) artık eksik planlaması
+    matches = []
+    residual_receivers = []
+    remaining_givers = {}
+    for region_matches, residual, region_pool in results:
+        matches.extend(region_matches)
+        residual_receivers.extend(residual)
+        for product_id, by_type in region_pool.items():
+            product_givers = remaining_givers.setdefault(product_id, _empty_giver_pool())
+            for store_type, type_givers in by_type.items():
+                product_givers[store_type].extend(type_givers)
+
+    residual_receivers.sort(key=lambda r: r["rank"])
+    matches.extend(match_receivers(residual_receivers, remaining_givers, penalty_map, max_truck_capacity))
+
+    # Global öncelik sırasını geri kur (A grubu ve aciliyet önce)
+    matches.sort(key=lambda m: m["receiver"]["rank"])
+    return matches
+
+def iter_transfer_recommendations(snapshot: Dict, penalty_map: Dict, max_truck_capacity: int = 50, view: str = "full") -> Iterator[Dict]:
+    """
+    Akış (Streaming) Planlama:
+    Veri önceden yüklenmiş snapshot üzerinden öneriler bulundukça üretilir.
+    Alıcılar öncelik sırasıyla işlendiği için en acil (A grubu) öneriler
+    plan tamamlanmadan istemciye ulaşır.
+    """
+    receivers, givers = build_pools(snapshot)
+    for match in iter_matches(receivers, givers, penalty_map, max_truck_capacity):
+        yield build_recommendation(match, view)
+
+def plan_transfer_matches(db: Session, stores: List[Store], max_truck_capacity: int = 50,
+                          region_mode: Optional[str] = None, n_regions: Optional[int] = None,
+                          parallel: bool = True,
+                          penalty_map: Optional[Dict[Tuple[int, int], float]] = None,
+                          products=None) -> List[Dict]:
+    """
+    Robin Hood Algoritması (Proaktif Stok Dengeleme):
+    Zenginden (Stok Fazlası Olan) alıp, fakire (Stok İhtiyacı Olan) verme prensibi.
+
+    Adımlar:
+    1. Talep Tahmini Analizi (Gelecek 7 gün ne satacak?)
+    2. Eksik (Shortage) ve Fazla (Excess) tespiti.
+    3. Maliyet Fonksiyonu (Cost Function) ile en uygun transfer eşlemesi.
+
+    region_mode verilirse ('hub' veya 'cluster') ağ bölgelere ayrılır ve
+    bölgeler paralel planlanır (bkz. plan_by_region).
+
+    Kapsamlı planlama: stores sadece ilgili mağazaları, products (product_scope)
+    sadece ilgili ürünleri içerir. Transfer bu dilimin içinde planlanır.
+    """
+    # 1. Havuzları Doldur (Tahmin Odaklı Analiz)
+    snapshot = load_planning_snapshot(db, stores, products=products)
+    receivers, givers = build_pools(snapshot)
+
+    # 2. Ceza Puanları (Verilmediyse tablodan okunur)
+    if penalty_map is None:
+        penalty_map = load_penalty_map(db)
+
+    # 3. Eşleştirme Algoritması
+    if region_mode:
+        regions = partition_regions(snapshot["stores"], region_mode, n_regions)
+        matches = plan_by_region(receivers, givers, penalty_map, regions, max_truck_capacity, parallel)
+    else:
+        matches = match_receivers(receivers, givers, penalty_map, max_truck_capacity)
+    return matches
+
+def generate_transfer_recommendations(db: Session, stores: List[Store], max_truck_capacity: int = 50,
+                                      region_mode: Optional[str] = None, n_regions: Optional[int] = None,
+                                      parallel: bool = True, view: str = "full",
+                                      penalty_map: Optional[Dict[Tuple[int, int], float]] = None,
+                                      products=None) -> List[Dict]:
+    """Eşleşmeleri (bkz. plan_transfer_matches) öneri formatına çevirir."""
+    matches = plan_transfer_matches(db, stores, max_truck_capacity, region_mode, n_regions,
+                                    parallel, penalty_map, products)
+    return [build_recommendation(match, view) for match in matches]
+
+# ==========================================
+# ♻️ ARTIMLI (INCREMENTAL) PLANLAYICI
+# ==========================================
+
+class TransferPlanner:
+    """
+    Son planı ve alıcı/verici durumunu bellekte tutan artımlı planlayıcı.
+
+    Eşleştirme ürünler arasında bağımsızdır (bir verici sadece kendi ürününü
+    verebilir). Bu yüzden bir stok veya ceza değişikliğinde sadece etkilenen
+    ürünler yeniden çözülür; diğer ürünlerin eşleşmeleri aynen korunur.
+
+    Planlayıcı hangi veri versiyonları (core.versions) üzerine kurulduğunu bilir.
+    Delta olayları sadece planlayıcı bir önceki versiyondaysa uygulanır;
+    aksi halde (başka bir worker yazmışsa) plan bayat sayılır ve bir sonraki
+    okumada tam plan yapılır.
+    """
+
+    def __init__(self, max_truck_capacity: int = 50):
+        self.max_truck_capacity = max_truck_capacity
+        self.versions = None
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._items = {}                 # (store_id, product_id) -> item
+        self._store_rank = {}            # store_id -> mağaza sırası
+        self._stores_by_product = {}     # product_id -> [store_id, ...] (mağaza sırasıyla)
+        self._products_by_store = {}     # store_id -> {product_id, ...}
+        self._penalty_map = {}
+        self._matches = {}               # product_id -> [match, ...]
+        self._order = []                 # Global öncelik sırası (sıralı anahtar listesi)
+        self._by_key = {}                # sıralama anahtarı -> match
+        self._rendered = {}              # view -> son oluşturulan öneri listesi
+
+    def is_current(self, current_versions: Dict[str, str]) -> bool:
+        return self.versions is not None and self.versions == current_versions
+
+    def rebuild(self, db: Session, stores: List[Store], current_versions: Dict[str, str],
+                penalty_map: Optional[Dict[Tuple[int, int], float]] = None):
+        """Tam plan: Tüm ağı baştan planlar."""
+        snapshot = load_planning_snapshot(db, stores)
+        if penalty_map is None:
+            penalty_map = load_penalty_map(db)
+        else:
+            penalty_map = dict(penalty_map) # Delta'lar planlayıcının kendi kopyasına yazılır
+
+        with self._lock:
+            self._snapshot = snapshot
+            self._penalty_map = penalty_map
+            self._items = {}
+            self._store_rank = {store_id: idx for idx, store_id in enumerate(snapshot["store_order"])}
+            self._stores_by_product = {}
+            self._products_by_store = {}
+            for store_id in snapshot["store_order"]:
+                self._products_by_store[store_id] = set()
+                for item in snapshot["items"][store_id]:
+                    self._index_item(store_id, item)
+
+            self._matches = {}
+            self._order = []
+            self._by_key = {}
+            for product_id in self._stores_by_product:
+                self._solve_product(product_id)
+            self._rendered = {}
+            self.versions = dict(current_versions)
+
+    def _index_item(self, store_id: int, item: Dict):
+        product_id = item["product_id"]
+        self._items[(store_id, product_id)] = item
+        self._stores_by_product.setdefault(product_id, []).append(store_id)
+        self._products_by_store[store_id].add(product_id)
+
+    def _solve_product(self, product_id: int):
+        """Tek bir ürünün alıcı/verici havuzunu kurup yeniden eşleştirir."""
+        # Eski eşleşmeleri sıralı listeden çıkar
+        for match in self._matches.pop(product_id, []):
+            key = receiver_sort_key(match["receiver"])
+            idx = bisect.bisect_left(self._order, key)
+            del self._order[idx]
+            del self._by_key[key]
+
+        product = self._snapshot["products"].get(product_id, {})
+        receivers = []
+        givers = {product_id: _empty_giver_pool()}
+        for store_id in self._stores_by_product.get(product_id, []):
+            store = self._snapshot["stores"][store_id]
+            role, entry = classify_item(store, self._items[(store_id, product_id)], product)
+            if role == "receiver":
+                receivers.append(entry)
+            elif role == "giver":
+                givers[product_id][store["type"]].append(entry)
+
+        receivers.sort(key=receiver_sort_key)
+        matches = match_receivers(receivers, givers, self._penalty_map, self.max_truck_capacity)
+
+        self._matches[product_id] = matches
+        for match in matches:
+            key = receiver_sort_key(match["receiver"])
+            bisect.insort(self._order, key)
+            self._by_key[key] = match
+
+    def _advance(self, transitions: Dict[str, Tuple[str, str]]) -> bool:
+        """
+        Planlayıcı versiyonlarını ilerletir. Delta, planlayıcının bildiği
+        versiyondan başlamıyorsa (araya başka yazma girmiş) planı bayatlatır.
+        """
+        if self.versions is None:
+            return False
+        for name, (previous, new) in transitions.items():
+            if name in self.versions and self.versions[name] != previous:
+                self.versions = None
+                return False
+        for name, (previous, new) in transitions.items():
+            if name in self.versions:
+                self.versions[name] = new
+        return True
+
+    def apply_inventory_delta(self, changes: List[Tuple[int, int, int]], transitions: Dict[str, Tuple[str, str]]):
+        """
+        Stok değişikliklerini uygular: changes = [(store_id, product_id, yeni_miktar), ...]
+        Sadece değişen ürünler yeniden çözülür.
+        """
+        with self._lock:
+            if not self._advance(transitions):
+                return
+
+            affected_products = set()
+            for store_id, product_id, quantity in changes:
+                if store_id not in self._snapshot["stores"]:
+                    continue
+                item = self._items.get((store_id, product_id))
+                if item is None:
+                    # Hedefte yeni açılan envanter satırı (transfer_stock safety=10 ile açar)
+                    if product_id not in self._snapshot["products"]:
+                        # Planlayıcının tanımadığı ürün: Güvenli yol tam plan
+                        self.versions = None
+                        return
+                    item = {
+                        "product_id": product_id,
+                        "quantity": quantity,
+                        "safety_stock": 10,
+                        "demand": self._snapshot["demand"].get((store_id, product_id), 0),
+                        "position": (self._store_rank[store_id], len(self._items))
+                    }
+                    self._index_item(store_id, item)
+                    self._stores_by_product[product_id].sort(key=self._store_rank.get)
+                else:
+                    item["quantity"] = quantity
+                affected_products.add(product_id)
+
+            for product_id in affected_products:
+                self._solve_product(product_id)
+            self._rendered = {}
+
+    def apply_penalty_delta(self, source_store_id: int, target_store_id: int, penalty_score: float,
+                            transitions: Dict[str, Tuple[str, str]]):
+        """
+        Rota ceza puanı değişikliğini uygular.
+        Sadece bu rotada (kaynak verici, hedef alıcı) olabilen ürünler yeniden çözülür.
+        """
+        with self._lock:
+            if not self._advance(transitions):
+                return
+
+            self._penalty_map[(source_store_id, target_store_id)] = penalty_score
+            shared = self._products_by_store.get(source_store_id, set()) & self._products_by_store.get(target_store_id, set())
+            stores = self._snapshot["stores"]
+            for product_id in shared:
+                product = self._snapshot["products"].get(product_id, {})
+                target_role, _ = classify_item(stores[target_store_id], self._items[(target_store_id, product_id)], product)
+                source_role, _ = classify_item(stores[source_store_id], self._items[(source_store_id, product_id)], product)
+                if target_role == "receiver" and source_role == "giver":
+                    self._solve_product(product_id)
+            self._rendered = {}
+
+    def recommendations(self, view: str = "full") -> List[Dict]:
+        """Güncel planı öncelik sırasıyla öneri listesi olarak döner."""
+        with self._lock:
+            if view not in self._rendered:
+                self._rendered[view] = [build_recommendation(self._by_key[key], view) for key in self._order]
+            return self._rendered[view]
+
+    def find_match(self, source_id: int, target_id: int, product_id: int) -> Tuple[Optional[Dict], bool]:
+        """
+        Güncel plandaki (hedef, ürün) eşleşmesi.
+        Dönüş: (eşleşme, kaynak_aynı_mı). Hedef/ürün için eşleşme yoksa (None, False).
+        """
+        with self._lock:
+            return match_for_target(self._matches.get(product_id, []), source_id, target_id)
+
+def match_for_target(matches: List[Dict], source_id: int, target_id: int) -> Tuple[Optional[Dict], bool]:
+    """Eşleşme listesinde hedef mağazanın eşleşmesini bulur ve kaynağın aynı olup olmadığını döner."""
+    for match in matches:
+        if match["receiver"]["store"]["id"] == target_id:
+            return match, match["source"]["id"] == source_id
+    return None, False
+
+def build_explanation(match: Dict) -> Dict:
+    """Tek bir önerinin XAI açıklaması (kompakt alanlar + açıklama metinleri)."""
+    return {
+        **build_compact_recommendation(match),
+        "xai_explanation": render_explanation(match)
+    }
@@ -4,6 +4,8 @@ import { Responsive } from 'react-grid-layout';
 import 'react-grid-layout/css/styles.css';
 import 'react-resizable/css/styles.css';
 import { useDashboardStats, useRecentSales } from '../hooks/useDashboard';
+import { useTransferStream } from '../hooks/useTransfers';
+import { useLiveEvents } from '../hooks/useLiveEvents';
 import { useAuth } from '../context/AuthContext';
 import axiosClient from '../api/axios';
 import _ from 'lodash';
@@ -71,6 +73,14 @@ const DraggableDashboard = () => {
     // eslint-disable-next-line no-unused-vars
     const { isLoading: salesLoading } = useRecentSales();
 
+    // Transfer önerileri akışla gelir; sayaç ilk kartlarla birlikte güncellenir,
+    // öneriler geçersizlendiğinde (transfer / canlı olay) akış yeniden başlar
+    const { recommendations: streamedTransfers } = useTransferStream();
+
+    // Stok/risk değişiklikleri backend'den itilir (SSE); widget cache'leri sadece değişiklikte yenilenir.
+    // Düşük stok / risk durumu alarmları Risk kartında gösterilir.
+    const { alerts: liveAlerts } = useLiveEvents();
+
     // Layout State
     // Default Layouts for different breakpoints
     const defaultLayouts = {
@@ -162,10 +172,10 @@ const DraggableDashboard = () => {
                 isDraggable={true}
             >
                 <div key="risk">
-                    <RiskWidget />
+                    <RiskWidget alerts={liveAlerts} />
                 </div>
                 <div key="transfer">
-                    <TransferWidget pendingCount={12} />
+                    <TransferWidget pendingCount={streamedTransfers.length} />
                 </div>
                 <div key="store">
                     <StoreWidget
@@ -1,10 +1,12 @@
 import React, { useState } from 'react';
+import { useQueryClient } from '@tanstack/react-query';
 import axiosClient from '../api/axios';
 import { XMarkIcon, ExclamationTriangleIcon } from '@heroicons/react/24/outline';
 
 const RejectionModal = ({ isOpen, onClose, transfer, onRejectSuccess }) => {
     const [reason, setReason] = useState('COST'); // Default reason
     const [loading, setLoading] = useState(false);
+    const queryClient = useQueryClient();
 
     if (!isOpen || !transfer) return null;
 
@@ -20,6 +22,8 @@ const RejectionModal = ({ isOpen, onClose, transfer, onRejectSuccess }) => {
             };
 
             await axiosClient.post('/api/transfer/reject', payload);
+            // Red rota cezasını değiştirir (envanter olayı yayınlanmaz): Öneriler ve akış yenilensin
+            queryClient.invalidateQueries({ queryKey: ['transfer-recommendations'] });
             if (onRejectSuccess) onRejectSuccess(transfer.transfer_id);
             onClose();
         } catch (error) {
@@ -8,7 +8,15 @@ import Tilt from 'react-parallax-tilt';
 // RiskWidget.jsx
 import { useDashboardStats } from '../../hooks/useDashboard';
 
-const RiskWidget = ({ style, className, ...props }) => {
+// Canlı alarm seviyesi -> renk (alert_engine: critical / warning / info)
+const ALERT_STYLES = {
+    critical: 'bg-red-600 text-white',
+    warning: 'bg-amber-400 text-slate-900',
+    info: 'bg-slate-200 text-slate-700',
+};
+const VISIBLE_ALERTS = 2;
+
+const RiskWidget = ({ style, className, alerts = [], ...props }) => {
     const navigate = useNavigate();
     const { data: stats } = useDashboardStats();
     const riskyCount = stats?.critical_stores || 0;
@@ -58,6 +66,23 @@ const RiskWidget = ({ style, className, ...props }) => {
                         <CountUp end={riskyCount} duration={2} />
                     </h3>
                     <p className="text-sm lg:text-lg font-bold text-red-600">Riskli Mağaza</p>
+
+                    {/* Canlı Alarmlar (SSE: düşük stok / risk durumu değişimi) */}
+                    {alerts.length > 0 && (
+                        <ul className="mt-2 space-y-1">
+                            {alerts.slice(0, VISIBLE_ALERTS).map((alert, index) => (
+                                <li key={`${index}-${alert.message}`} className="flex items-center gap-2 text-[11px] text-slate-700 truncate" title={alert.message}>
+                                    <span className={`px-1.5 py-0.5 rounded-md font-bold uppercase text-[9px] ${ALERT_STYLES[alert.level] || ALERT_STYLES.warning}`}>
+                                        {alert.level}
+                                    </span>
+                                    <span className="truncate">{alert.message}</span>
+                                </li>
+                            ))}
+                            {alerts.length > VISIBLE_ALERTS && (
+                                <li className="text-[10px] text-red-400 font-medium">+{alerts.length - VISIBLE_ALERTS} alarm daha</li>
+                            )}
+                        </ul>
+                    )}
                     <div className="flex items-center gap-2 mt-2 text-xs lg:text-sm text-red-500 font-medium group-hover:translate-x-1 transition-transform">
                         <span>Aksiyon Al</span>
                         <ArrowRightIcon className="w-3 h-3 lg:w-4 lg:h-4" />
@@ -0,0 +1,41 @@
+import { useEffect, useState } from 'react';
+import { useQueryClient } from '@tanstack/react-query';
+import axiosClient from '../api/axios';
+
+// Envanter değişiminde yeniden çekilecek sorgular
+const INVENTORY_QUERY_KEYS = [
+    ['stores'],
+    ['inventory'],
+    ['dashboard-critical-stock'],
+    ['transfer-recommendations'],
+];
+
+const MAX_ALERTS = 20;
+
+// Backend Olay Akışı (SSE)
+// Periyodik sorgu yerine: Sadece gerçek bir envanter değişikliğinde ilgili cache'ler geçersizlenir.
+// EventSource bağlantı koparsa kendisi yeniden bağlanır (Last-Event-ID ile kaçırılanlar gelir).
+export const useLiveEvents = () => {
+    const queryClient = useQueryClient();
+    const [alerts, setAlerts] = useState([]);
+
+    useEffect(() => {
+        const source = new EventSource(`${axiosClient.defaults.baseURL}/api/events/stream`);
+
+        const onInventory = () => {
+            INVENTORY_QUERY_KEYS.forEach((queryKey) => queryClient.invalidateQueries({ queryKey }));
+        };
+
+        const onAlert = (event) => {
+            const alert = JSON.parse(event.data);
+            setAlerts((prev) => [alert, ...prev].slice(0, MAX_ALERTS));
+        };
+
+        source.addEventListener('inventory', onInventory);
+        source.addEventListener('alert', onAlert);
+
+        return () => source.close();
+    }, [queryClient]);
+
+    return { alerts };
+};
@@ -32,6 +32,19 @@ const runWhatIf = async (payload) => {
     return data;
 };
 
+// Run What-If for a whole plan (moves: [{ source_store_id, target_store_id, product_id, amount }])
+const runWhatIfBatch = async (moves) => {
+    const { data } = await axiosClient.post('/api/simulate/what-if/batch', { moves });
+    return data;
+};
+
+// Run scenarios on a copy of the inventory snapshot (no DB writes, no reset needed)
+// steps: [{ scenario: 'sales_boom' | 'recession' | 'supply_shock' | 'custom', price_change, delay_days }]
+const runSandbox = async ({ steps, seed }) => {
+    const { data } = await axiosClient.post('/api/simulate/sandbox', { steps, seed });
+    return data;
+};
+
 export const useSimulationStats = () => {
     return useQuery({
         queryKey: ['simulation-stats'],
@@ -65,9 +78,19 @@ export const useSimulationActions = () => {
         },
     });
 
+    const whatIfBatchMutation = useMutation({
+        mutationFn: runWhatIfBatch,
+    });
+
+    const sandboxMutation = useMutation({
+        mutationFn: runSandbox,
+    });
+
     return {
         reset: resetMutation,
         runScenario: scenarioMutation,
-        runWhatIf: whatIfMutation
+        runWhatIf: whatIfMutation,
+        runWhatIfBatch: whatIfBatchMutation,
+        runSandbox: sandboxMutation
     };
 };
@@ -65,3 +65,55 @@ export const useTransfers = () => {
         isTransferring: transferMutation.isPending
     };
 };
+
+// Transfer Önerilerini Akış (NDJSON) Olarak Getir
+// Öneriler öncelik sırasıyla gelir: En acil kartlar plan bitmeden ekrana düşer.
+// Akış bir query olarak tutulur: ['transfer-recommendations'] geçersizlendiğinde
+// (transfer, red, canlı envanter olayı) akış kendiliğinden yeniden başlar.
+const TRANSFER_STREAM_KEY = ['transfer-recommendations', 'stream', 'compact'];
+
+const streamRecommendations = async (queryClient, signal) => {
+    const response = await fetch(
+        `${axiosClient.defaults.baseURL}/api/transfers/recommendations/stream?format=ndjson&view=compact`,
+        { signal }
+    );
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    // İlk yüklemede kartlar geldikçe gösterilir; yenilemede eski liste akış bitene kadar kalır (sayaç titremez)
+    const progressive = queryClient.getQueryData(TRANSFER_STREAM_KEY) === undefined;
+    let buffer = '';
+    let received = [];
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop(); // Yarım kalan satır bir sonraki parçayla birleşir
+
+        const batch = lines.filter(Boolean).map((line) => JSON.parse(line));
+        if (batch.length) {
+            received = [...received, ...batch];
+            if (progressive) {
+                queryClient.setQueryData(TRANSFER_STREAM_KEY, received);
+            }
+        }
+    }
+    return received;
+};
+
+export const useTransferStream = () => {
+    const queryClient = useQueryClient();
+
+    const streamQuery = useQuery({
+        queryKey: TRANSFER_STREAM_KEY,
+        queryFn: ({ signal }) => streamRecommendations(queryClient, signal),
+        staleTime: 1000 * 60 * 2, // 2 dakika boyunca taze
+    });
+
+    return {
+        recommendations: streamQuery.data ?? [],
+        isStreaming: streamQuery.isFetching
+    };
+};